@@ -0,0 +1,184 @@
+import ast
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from timeit import default_timer as timer
+
+import fire
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.getcwd())
+
+from src.analysis.pipeline import pipeline_clean_results_incremental
+from src.analysis.schema import apply_results_schema
+from src.data.variables import ResponseMap, QNum, responses_to_map
+
+SAMPLE_SIZE = 100
+PROC_STATUS = "/proc/self/status"
+PROC_CLEAR_REFS = "/proc/self/clear_refs"
+
+
+def load_response_maps(
+    directory: str = "data_files",
+) -> tuple[dict[QNum, ResponseMap], dict[QNum, ResponseMap]]:
+    variables = pd.read_csv(os.path.join(directory, "variables", "variables.csv"))
+    responses, flipped = {}, {}
+    for qnum, choices in zip(variables["number"], variables["responses"]):
+        choices = ast.literal_eval(choices)
+        responses[qnum] = responses_to_map(choices, is_scale_flipped=False)
+        flipped[qnum] = responses_to_map(choices, is_scale_flipped=True)
+    return responses, flipped
+
+
+def get_response_variants(response_map: ResponseMap) -> list[str]:
+    """Typical completions for a question: valid, bare key, text only, prefixed and invalid."""
+    variants = ["I don't know"]
+    for key, label in response_map.items():
+        variants += [
+            f"{key}: {label}",
+            f"{key}",
+            label,
+            f"Your response: {key}: {label}",
+            f"{key}: {label} because I think so",
+            label[:5],
+        ]
+    return variants
+
+
+def build_results(
+    n_rows: int,
+    responses: dict[QNum, ResponseMap],
+    flipped_responses: dict[QNum, ResponseMap],
+    seed: int = 42,
+) -> pd.DataFrame:
+    """
+    Synthetic simulation results with the columns and dtypes of the results store: runs of
+    SAMPLE_SIZE completions to every question, half of them on the flipped scale. Completions are
+    drawn from a pool of variants per question, so the results take little more memory than the
+    stored results would.
+    """
+    rng = np.random.default_rng(seed)
+    qnums = list(responses)
+    pools = [
+        get_response_variants(maps[qnum])
+        for qnum in qnums
+        for maps in [responses, flipped_responses]
+    ]
+    sizes = np.array([len(pool) for pool in pools])
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    pool = np.array([response for pool in pools for response in pool], dtype=object)
+
+    row = np.arange(n_rows)
+    question = (row // SAMPLE_SIZE) % len(qnums)
+    run = row // (SAMPLE_SIZE * len(qnums))
+    is_scale_flipped = row % 2 == 1
+    variant = 2 * question + is_scale_flipped
+    choice = offsets[variant] + rng.integers(0, sizes[variant])
+
+    runs = [f"run{i}" for i in range(run.max() + 1)]
+    qnums = np.array(qnums, dtype=object)
+    results = pd.DataFrame(
+        {
+            "model": pd.Categorical.from_codes(run, runs),
+            "number": pd.Categorical.from_codes(question, qnums),
+            "question": pd.Categorical.from_codes(
+                question, [f"{qnum}: question" for qnum in qnums]
+            ),
+            "choices": pd.Categorical(
+                np.array([str(list(responses[q].values())) for q in qnums])[question]
+            ),
+            "response": pool[choice],
+            "is_scale_flipped": is_scale_flipped,
+            "run_id": pd.Categorical.from_codes(run, runs),
+            "subgroup": pd.Categorical.from_codes(np.zeros(n_rows, int), ["general"]),
+            "is_lora": run % 2 == 0,
+        }
+    )
+    return apply_results_schema(results, copy=False)
+
+
+def measure_clean(n_rows: int, directory: str = "data_files") -> dict:
+    """
+    Peak resident memory of the clean stage on synthetic results, as run by clean_results.py.
+    Run in a fresh process, as the peak resident memory of a process never decreases.
+    """
+    responses, flipped = load_response_maps(directory)
+    results = build_results(n_rows, responses, flipped)
+    results_mb = results.memory_usage(deep=True).sum() / 2**20
+    # importing the models briefly takes far more memory than the results
+    rss_mb = _reset_peak_rss()
+
+    start = timer()
+    clean, _ = pipeline_clean_results_incremental(
+        results, responses, flipped, copy=False
+    )
+    seconds = timer() - start
+    peak_mb = _get_peak_rss()
+    return {
+        "rows": n_rows,
+        "seconds": seconds,
+        "results_mb": results_mb,
+        "clean_mb": clean.memory_usage(deep=True).sum() / 2**20,
+        "rss_before_mb": rss_mb,
+        "peak_rss_mb": peak_mb,
+        "peak_rss_increase_mb": peak_mb - rss_mb,
+    }
+
+
+def _reset_peak_rss() -> float:
+    """
+    Reset the peak resident memory of the process to the current one and return it in MB.
+    Only possible on Linux, elsewhere the peak since the start of the process is kept.
+    """
+    if os.path.exists(PROC_CLEAR_REFS):
+        with open(PROC_CLEAR_REFS, "w") as f:
+            f.write("5")
+        return _read_proc_status("VmRSS")
+    return _get_peak_rss()
+
+
+def _get_peak_rss() -> float:
+    if os.path.exists(PROC_STATUS):
+        return _read_proc_status("VmHWM")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if platform.system() == "Darwin" else peak / 2**10
+
+
+def _read_proc_status(field: str) -> float:
+    with open(PROC_STATUS) as f:
+        for line in f:
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1]) / 2**10
+    raise KeyError(field)
+
+
+def main(
+    n_rows: int = 1_000_000, output: str = None, directory: str = "data_files"
+):
+    """
+    Measure the peak memory and runtime of cleaning a synthetic results set of n_rows rows and
+    save them as JSON. The increase in peak resident memory over the loaded results is the
+    memory used by the pipeline itself.
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        result = executor.submit(measure_clean, n_rows, directory).result()
+    result["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    result["python"] = platform.python_version()
+
+    for k, v in result.items():
+        print(f"{k}: {v:.1f}" if isinstance(v, float) else f"{k}: {v}")
+    if output:
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,268 @@
+import json
+import os
+import platform
+import string
+import sys
+import time
+from timeit import default_timer as timer
+
+import fire
+import numpy as np
+import pandas as pd
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+from transformers import (
+    LlamaConfig,
+    LlamaForCausalLM,
+    PreTrainedTokenizerFast,
+    logging as hf_logging,
+)
+
+sys.path.append(os.getcwd())
+
+from src.prompting.messages import Survey, extract_user_prompts_from_survey_individual
+from src.simulation.inference import get_decoder, simulate_whole_survey
+from src.simulation.models import ModelConfig
+
+BASELINE_PATH = os.path.join("benchmarks", "simulation-baseline.json")
+
+DECODING_STYLES = ["unconstrained", "constrained"]
+BATCH_SIZES = [4, 16]
+SAMPLE_SIZES = [8, 32]
+SURVEY_SIZES = [2, 8]
+# throughput is only comparable to a baseline recorded with the same hardware and torch
+COMPARABLE_ENVIRONMENT_KEYS = ["machine", "cpu_count", "torch_threads", "torch"]
+
+TINY_CHAT_TEMPLATE = (
+    "{% for message in messages %}"
+    "<{{ message['role'] }}>{{ message['content'] }}</s>"
+    "{% endfor %}"
+    "{% if add_generation_prompt %}<assistant>{% endif %}"
+)
+
+
+def build_tiny_tokenizer() -> PreTrainedTokenizerFast:
+    """
+    Character-level tokenizer built in memory, so that the benchmarks run offline.
+    """
+    special_tokens = ["<pad>", "<s>", "</s>", "<unk>"]
+    characters = list(string.printable) + ["–", "´", "’"]
+    vocab = {t: i for i, t in enumerate(special_tokens + characters)}
+
+    tokenizer = Tokenizer(models.WordLevel(vocab=vocab, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Split("", behavior="isolated")
+    tokenizer.decoder = decoders.Fuse()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        pad_token="<pad>",
+        bos_token="<s>",
+        eos_token="</s>",
+        unk_token="<unk>",
+        padding_side="left",
+        model_input_names=["input_ids", "attention_mask"],
+    )
+    tokenizer.chat_template = TINY_CHAT_TEMPLATE
+    return tokenizer
+
+
+def build_tiny_model(vocab_size: int, seed: int = 42) -> LlamaForCausalLM:
+    """
+    Randomly initialised causal LM with the same architecture family as the simulated models.
+    """
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=vocab_size,
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=4,
+        max_position_embeddings=4096,
+        pad_token_id=0,
+        bos_token_id=1,
+        eos_token_id=2,
+    )
+    return LlamaForCausalLM(config).eval()
+
+
+def load_benchmark_survey(
+    n_questions: int, directory: str = "data_files"
+) -> tuple[Survey, Survey]:
+    variables = pd.read_csv(os.path.join(directory, "variables", "variables.csv"))
+    variables = variables.head(n_questions)
+    return (
+        extract_user_prompts_from_survey_individual(variables, False, False),
+        extract_user_prompts_from_survey_individual(variables, False, True),
+    )
+
+
+def benchmark_config(decoding_style: str, batch_size: int, sample_size: int):
+    return ModelConfig(
+        base_model_name="llama",
+        device="cpu",
+        decoding_style=decoding_style,
+        batch_size=batch_size,
+        sample_size=sample_size,
+        hyperparams={"max_new_tokens": 16},
+    )
+
+
+def time_function(fn, repeats: int, seed: int = 42) -> tuple[float, int]:
+    """
+    Median wall time of fn over repeats (after one warm-up call) and the number of outputs.
+    """
+    torch.manual_seed(seed)
+    fn()
+    times, n_outputs = [], 0
+    for _ in range(repeats):
+        torch.manual_seed(seed)
+        start = timer()
+        n_outputs = fn()
+        times.append(timer() - start)
+    return float(np.median(times)), n_outputs
+
+
+def run_benchmarks(repeats: int = 5, directory: str = "data_files") -> dict:
+    """
+    Throughput of the decoders for a single question across batch and sample sizes, and of
+    simulate_whole_survey across survey sizes.
+    """
+    tokenizer = build_tiny_tokenizer()
+    model = build_tiny_model(len(tokenizer))
+    survey, flipped = load_benchmark_survey(max(SURVEY_SIZES), directory)
+    qnum = next(iter(survey))
+
+    results = {}
+    for decoding_style in DECODING_STYLES:
+        for batch_size in BATCH_SIZES:
+            for sample_size in SAMPLE_SIZES:
+                config = benchmark_config(decoding_style, batch_size, sample_size)
+                decoder = get_decoder(model, tokenizer, config)
+                seconds, n_outputs = time_function(
+                    lambda: len(
+                        decoder.simulate_question(qnum, survey[qnum], flipped[qnum])
+                    ),
+                    repeats,
+                )
+                name = f"question-{decoding_style}-batch{batch_size}-sample{sample_size}"
+                results[name] = _summarise(seconds, n_outputs)
+                print(f"{name}: {results[name]['sequences_per_second']:.1f} seq/s")
+
+        for n_questions in SURVEY_SIZES:
+            config = benchmark_config(decoding_style, max(BATCH_SIZES), min(SAMPLE_SIZES))
+            survey_subset = {q: survey[q] for q in list(survey)[:n_questions]}
+            seconds, n_outputs = time_function(
+                lambda: sum(
+                    len(r)
+                    for r in simulate_whole_survey(
+                        model, tokenizer, config, survey_subset, flipped
+                    ).values()
+                ),
+                repeats,
+            )
+            name = f"survey-{decoding_style}-questions{n_questions}"
+            results[name] = _summarise(seconds, n_outputs)
+            print(f"{name}: {results[name]['sequences_per_second']:.1f} seq/s")
+
+    return {"environment": _get_environment(), "results": results}
+
+
+def _summarise(seconds: float, n_outputs: int) -> dict:
+    return {
+        "seconds": seconds,
+        "sequences": n_outputs,
+        "sequences_per_second": n_outputs / seconds,
+    }
+
+
+def _get_environment() -> dict:
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+    }
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> dict:
+    """
+    Relative change in throughput for each benchmark in both results and baseline.
+    Benchmarks slower than the baseline by more than the tolerance are flagged as regressions.
+    """
+    comparison = {}
+    for name, result in results["results"].items():
+        if name not in baseline["results"]:
+            continue
+        before = baseline["results"][name]["sequences_per_second"]
+        after = result["sequences_per_second"]
+        change = after / before - 1
+        comparison[name] = {
+            "baseline": before,
+            "current": after,
+            "change": change,
+            "is_regression": change < -tolerance,
+        }
+    return comparison
+
+
+def get_environment_differences(results: dict, baseline: dict) -> dict:
+    """Environment fields that differ between results and baseline, as (baseline, current)."""
+    current, recorded = results["environment"], baseline.get("environment", {})
+    return {
+        key: (recorded.get(key), current.get(key))
+        for key in COMPARABLE_ENVIRONMENT_KEYS
+        if recorded.get(key) != current.get(key)
+    }
+
+
+def main(
+    output: str = None,
+    baseline: str = BASELINE_PATH,
+    is_save_baseline: bool = False,
+    tolerance: float = 0.3,
+    repeats: int = 5,
+    directory: str = "data_files",
+):
+    """
+    Run the simulation benchmarks on a tiny randomly initialised model on CPU, save the results as JSON
+    and compare them to the saved baseline. Exits with a non-zero status if any benchmark regressed,
+    unless the baseline was recorded in a different environment, which only prints the comparison.
+    Record a baseline on the machine that runs the comparison with --is_save_baseline.
+    """
+    hf_logging.set_verbosity_error()
+    results = run_benchmarks(repeats, directory)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+    if is_save_baseline:
+        with open(baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {baseline}")
+        return
+
+    if not os.path.exists(baseline):
+        print(f"No baseline found at {baseline}")
+        return
+    with open(baseline) as f:
+        baseline_results = json.load(f)
+    comparison = compare_to_baseline(results, baseline_results, tolerance)
+    for name, c in comparison.items():
+        flag = "REGRESSION" if c["is_regression"] else ""
+        print(f"{name}: {c['change']:+.1%} {flag}")
+
+    differences = get_environment_differences(results, baseline_results)
+    if differences:
+        for key, (recorded, current) in differences.items():
+            print(f"Warning: baseline {key} is {recorded}, current {key} is {current}")
+        print("Skipped the regression check, the baseline is from another environment")
+        return
+    if any(c["is_regression"] for c in comparison.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
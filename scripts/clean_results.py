@@ -1,48 +1,69 @@
-import ast
 import json
 import os
 import sys
 
 import fire
-import pandas as pd
 
 print("Current working directory:", os.getcwd())
 sys.path.append(os.getcwd())
 
-from src.analysis.cleaning import (
-    pipeline_clean_generated_responses,
-    remap_response_keys,
+from src.analysis.pipeline import (
+    get_manifest_path,
+    load_manifest,
+    pipeline_clean_results_incremental,
+    save_manifest,
 )
-from src.analysis.invalid_responses import pipeline_identify_invalid_responses
-from src.data.variables import responses_to_map, ResponseMap, QNum
+from src.analysis.schema import report_memory_usage
+from src.analysis.store import get_store_path, load_results, write_results_store
 from src.demographics.config import category_to_question
 from src.simulation.experiment import load_experiment
+from src.simulation.survey import load_response_maps
 
 
-def main(experiment_name: str, root_directory: str = ""):
+def main(
+    experiment_name: str,
+    root_directory: str = "",
+    n_workers: int = 1,
+    chunk_size: int = 100_000,
+    is_incremental: bool = True,
+):
     """
     Clean simulation results for analysis, identify invalid responses and
     remap response keys to original scale.
+    With n_workers > 1 (or None for all cores), results are processed in chunks of at most
+    chunk_size rows, split by question number, in parallel.
+    If is_incremental, only runs and questions that are new or changed since the last clean are
+    processed, the rest is taken from the existing clean results.
     """
     experiment = load_experiment(experiment_name, root_directory)
 
     results_directory = os.path.join(
         experiment.files["directory"], "results", experiment_name
     )
-    df = pd.read_csv(
-        os.path.join(results_directory, f"{experiment_name}-results.csv"), index_col=0
+    df = load_results(results_directory, experiment_name, "results")
+    report_memory_usage(df, "loaded results")
+
+    responses = load_response_maps(experiment, is_reverse=False)
+    responses_flipped = load_response_maps(experiment, is_reverse=True)
+    store_path = get_store_path(results_directory, experiment_name, "clean")
+    manifest_path = get_manifest_path(results_directory, experiment_name)
+    manifest = load_manifest(manifest_path) if is_incremental else None
+    previous = None
+    if manifest is not None and os.path.exists(store_path):
+        previous = load_results(results_directory, experiment_name, "clean")
+    df, manifest = pipeline_clean_results_incremental(
+        df,
+        responses,
+        responses_flipped,
+        previous,
+        manifest,
+        n_workers,
+        chunk_size,
+        copy=False,
     )
-    variables_directory = os.path.join(experiment.files["directory"], "variables")
-    variables = pd.read_csv(
-        os.path.join(variables_directory, "variables.csv"), index_col=0
-    )
-
-    responses, responses_flipped = get_response_maps_from_variables(variables)
-    save_response_maps(responses, variables_directory)
-    df = pipeline_clean_generated_responses(df)
-    df = pipeline_identify_invalid_responses(df, responses, responses_flipped)
-    df = remap_response_keys(df, "final_response")
-    df.to_csv(os.path.join(results_directory, f"{experiment_name}-clean.csv"))
+    report_memory_usage(df, "identified invalid responses")
+    write_results_store(df, store_path)
+    save_manifest(manifest, manifest_path)
 
     reasons = (
         df["reason_invalid"].value_counts(normalize=True).sort_values(ascending=False)
@@ -60,27 +81,5 @@ def main(experiment_name: str, root_directory: str = ""):
         json.dump(cat_counts, f)
 
 
-def get_response_maps_from_variables(
-    variables: pd.DataFrame,
-) -> tuple[dict[QNum, ResponseMap], dict[QNum, ResponseMap]]:
-    responses = {}
-    responses_flipped = {}
-
-    for _, row in variables.iterrows():
-        responses[row["number"]] = responses_to_map(
-            ast.literal_eval(row["responses"]), is_scale_flipped=False
-        )
-        responses_flipped[row["number"]] = responses_to_map(
-            ast.literal_eval(row["responses"]), is_scale_flipped=True
-        )
-
-    return responses, responses_flipped
-
-
-def save_response_maps(responses: dict[QNum, ResponseMap], directory: str):
-    with open(os.path.join(directory, "response_map_original.json"), "w") as f:
-        json.dump(responses, f)
-
-
 if __name__ == "__main__":
     fire.Fire(main)
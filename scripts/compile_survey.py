@@ -0,0 +1,32 @@
+import os
+import sys
+
+import fire
+
+print("Current working directory:", os.getcwd())
+sys.path.append(os.getcwd())
+
+from src.simulation.experiment import load_experiment
+from src.simulation.survey import (
+    QUESTION_FORMATS,
+    get_compiled_survey_path,
+    load_compiled_survey,
+)
+
+
+def main(experiment_name: str, root_directory: str = ""):
+    """
+    Compile the survey of an experiment for all question formats. Simulation scripts do this on demand,
+    this only makes it explicit, e.g. before submitting jobs.
+    """
+    experiment = load_experiment(experiment_name, root_directory)
+    for question_format in QUESTION_FORMATS:
+        artefact = load_compiled_survey(experiment, question_format)
+        print(
+            f"{question_format}: {len(artefact['survey'])} prompts, hash {artefact['hash'][:12]}, "
+            f"{get_compiled_survey_path(experiment, question_format)}"
+        )
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
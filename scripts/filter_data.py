@@ -1,20 +1,26 @@
 import os
+import sys
 
-import pandas as pd
+import fire
 
-from data.filtering import filter_by_subgroups
-from demographics.base import BaseSubGroup
-from demographics.config import ALL_COUNTRIES, ALL_SEXES, ALL_AGES
+sys.path.append(os.getcwd())
 
+from src.data.filtering import filter_by_subgroups
+from src.data.wvs import load_wvs
+from src.demographics.base import BaseSubGroup
+from src.demographics.config import ALL_COUNTRIES, ALL_SEXES, ALL_AGES
 
-def main(directory: str, subgroups: list[type[BaseSubGroup]]):
-    file_name = "../data_files/WV7/WVS_Cross-National_Wave_7_csv_v6_0.csv"
-    df_all = pd.read_csv(os.path.join(directory, file_name))
+
+def main(
+    directory: str = "data_files",
+    subgroups: list[type[BaseSubGroup]] = ALL_COUNTRIES + ALL_SEXES + ALL_AGES,
+):
+    df_all = load_wvs(directory)
     subgroup_dfs = {}
     for subgroup in subgroups:
         subgroup_dfs[subgroup.NAME] = filter_by_subgroups(df_all, [subgroup])
 
-    df_directory = os.path.join(directory, "dataframes")
+    df_directory = os.path.join(directory, "WV7", "dataframes")
     if not os.path.exists(df_directory):
         os.makedirs(df_directory)
 
@@ -23,6 +29,4 @@ def main(directory: str, subgroups: list[type[BaseSubGroup]]):
 
 
 if __name__ == "__main__":
-    wd = os.getcwd()  # change as needed
-    os.chdir(wd)
-    main("../data_files/WV7", ALL_COUNTRIES + ALL_SEXES + ALL_AGES)
+    fire.Fire(main)
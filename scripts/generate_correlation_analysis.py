@@ -15,7 +15,7 @@ from src.analysis.correlations import (
     upper_bound,
     compare_correlation_structures,
 )
-from src.analysis.io import load_response_maps, save_latex_table
+from src.analysis.io import prepare_analysis_response_maps, save_latex_table
 from src.analysis.responses import (
     get_support_diameter,
     get_support_minimum,
@@ -23,13 +23,16 @@ from src.analysis.responses import (
 )
 from src.analysis.results import load_data_dict
 from src.simulation.experiment import load_experiment
+from src.simulation.survey import load_response_maps
 
 
 def main(experiment_name: str, root_directory: str = ""):
     experiment = load_experiment(experiment_name, root_directory)
 
     np.random.seed(experiment.setup["random_seed"])
-    response_maps = load_response_maps(experiment.files["directory"])
+    response_maps = prepare_analysis_response_maps(
+        load_response_maps(experiment, is_reverse=False)
+    )
     diameters = sort_by_qnum_index(get_support_diameter(response_maps))
     minimums = sort_by_qnum_index(get_support_minimum(response_maps))
 
@@ -1,10 +1,8 @@
-import json
 import os
 import sys
 import time
 
 import fire
-import pandas as pd
 
 print("Current working directory:", os.getcwd())
 sys.path.append(os.getcwd())
@@ -15,7 +13,7 @@ from src.analysis.aggregations import (
     DataDict,
     persist_data_dict,
 )
-from src.analysis.io import create_subdirectory
+from src.analysis.io import create_subdirectory, prepare_analysis_response_maps
 from src.analysis.marginals import (
     generate_cross_comparison,
     save_response_distributions,
@@ -24,15 +22,21 @@ from src.analysis.marginals import (
     compare_marginal_response_dists,
 )
 from src.analysis.responses import get_base_model_responses
-from src.data.variables import remap_response_maps
+from src.analysis.schema import report_memory_usage
+from src.analysis.store import load_results
+from src.analysis.tensors import DistributionCache
+from src.data.wvs import load_wvs
 from src.demographics.config import dimensions, subgroups
 from src.simulation.experiment import load_experiment
-from src.utils import key_as_int
+from src.simulation.survey import load_response_maps
+
+# only columns used to collate responses by subgroup and model
+SIMULATION_COLUMNS = ["number", "subgroup", "is_lora", "response_key", "final_response"]
 
 # todo: currently does two jobs: collates/aggregates and runs marginal dist analysis - split?
 
 
-def main(experiment_name: str, root_directory: str = ""):
+def main(experiment_name: str, root_directory: str = "", n_bootstrap: int = 1000):
     experiment = load_experiment(experiment_name, root_directory)
 
     start = time.time()
@@ -40,31 +44,22 @@ def main(experiment_name: str, root_directory: str = ""):
     simulation_directory = os.path.join(
         experiment.files["directory"], "results", experiment_name
     )
-    sim = pd.read_csv(
-        os.path.join(simulation_directory, f"{experiment_name}-clean.csv"), index_col=0
+    sim = load_results(
+        simulation_directory, experiment_name, "clean", columns=SIMULATION_COLUMNS
     )
     if "final_response" not in sim.columns:
         sim["final_response"] = sim["response_key"]
     sim = sim.loc[sim["number"] != "Q215"]  # not asked in USA
+    report_memory_usage(sim, "loaded clean results")
     all_qnums = list(sim["number"].unique())
-    true = pd.read_csv(
-        os.path.join(
-            experiment.files["directory"], "WV7/WVS_Cross-National_Wave_7_csv_v6_0.csv"
-        ),
-        index_col=0,
+    true = load_wvs(experiment.files["directory"], experiment.files["variables"])
+    report_memory_usage(true, "loaded WVS")
+
+    response_map = prepare_analysis_response_maps(
+        load_response_maps(experiment, is_reverse=False)
     )
 
-    with open(
-        os.path.join(
-            experiment.files["directory"], "variables/response_map_original.json"
-        ),
-        "r",
-    ) as f1:
-        response_map = key_as_int(json.load(f1))
-        response_map = remap_response_maps(response_map)
-        response_map = {k: v for k, v in response_map.items() if k != "Q215"}
-
-    sim["subgroup"].fillna("none", inplace=True)
+    sim["subgroup"] = sim["subgroup"].cat.add_categories("none").fillna("none")
     base = get_base_model_responses(sim[sim["subgroup"] == "none"], all_qnums)
     print(f"Loaded data, {time.time() - start} seconds")
     subgroup_data: DataDict = {
@@ -103,22 +98,34 @@ def main(experiment_name: str, root_directory: str = ""):
         "category": category_data,
     }
 
+    # distributions are computed once and shared by all analyses below
+    cache = DistributionCache()
     for g, dd in data_dict_map.items():
         save_response_distributions(
-            dd, create_subdirectory(simulation_directory, "data"), response_map, g
+            dd,
+            create_subdirectory(simulation_directory, "data"),
+            response_map,
+            g,
+            cache,
         )
 
     for grouping, data_dict in data_dict_map.items():
 
         compare_marginal_response_dists(
-            data_dict, response_map, metrics_directory, grouping
+            data_dict,
+            response_map,
+            metrics_directory,
+            grouping,
+            cache,
+            n_bootstrap,
+            seed=experiment.setup["random_seed"],
         )
         print(
             f"Finished model comparison metrics for {grouping}, {time.time() - start} seconds"
         )
         if grouping != "category":
             generate_cross_comparison(
-                data_dict, response_map, graph_directory, grouping
+                data_dict, response_map, graph_directory, grouping, cache
             )
 
 
@@ -0,0 +1,81 @@
+import json
+import os
+import sys
+
+import fire
+
+print("Current working directory:", os.getcwd())
+sys.path.append(os.getcwd())
+
+from src.analysis.io import create_subdirectory
+from src.simulation.experiment import huggingface_login, load_experiment
+from src.simulation.models import ModelConfig, adapters, load_model, load_tokenizer
+from src.simulation.planning import plan_experiment
+from src.simulation.survey import load_survey
+
+
+def main(
+    experiment_name: str,
+    question_format: str = "individual",
+    n_runs: int = 2 * len(adapters) + 1,
+    is_benchmark: bool = True,
+    batch_sizes: list[int] = None,
+    device: str = "cuda:0",
+    root_directory: str = "",
+    **kwargs,  # additional LLM hyperparams
+):
+    """
+    Dry run of an experiment: report prompt and generated tokens, number of generate calls and,
+    if benchmarked, the estimated runtime and the batch size with the highest throughput.
+    By default n_runs matches run_all_models.py (persona runs for all subgroups + general, and all adapters).
+    """
+    experiment = load_experiment(experiment_name, root_directory)
+
+    survey_questions = load_survey(experiment, question_format, False)
+    survey_flipped = load_survey(experiment, question_format, True)
+
+    config = ModelConfig(
+        **experiment.simulation,
+        is_lora=False,
+        device=device,
+        hyperparams=kwargs,
+    )
+    if is_benchmark:
+        model, tokenizer = load_model(config)
+    else:
+        model, tokenizer = None, load_tokenizer(config)
+
+    batch_sizes = batch_sizes or [8, 16, 32, 64, 128, 256]
+    plan = plan_experiment(
+        tokenizer,
+        config,
+        survey_questions,
+        survey_flipped,
+        n_runs=n_runs,
+        model=model,
+        batch_sizes=batch_sizes + [config.batch_size],
+    )
+
+    results_directory = create_subdirectory(
+        os.path.join(experiment.files["directory"], "results"), experiment_name
+    )
+    with open(os.path.join(results_directory, f"{experiment_name}-plan.json"), "w") as f:
+        json.dump(plan.to_dict(), f, indent=2)
+
+    print_plan(plan.to_dict())
+
+
+def print_plan(plan: dict):
+    for k, v in plan.items():
+        if k == "throughput":
+            for batch_size, t in v.items():
+                print(f"throughput (batch size {batch_size}): {t:.2f} sequences/s")
+        elif k.startswith("estimated_runtime"):
+            print(f"{k}: {v / 3600:.2f} hours")
+        else:
+            print(f"{k}: {v}")
+
+
+if __name__ == "__main__":
+    huggingface_login()
+    fire.Fire(main)
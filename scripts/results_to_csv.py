@@ -1,3 +1,4 @@
+import itertools
 import os
 import sys
 
@@ -8,16 +9,37 @@ print("Current working directory:", os.getcwd())
 sys.path.append(os.getcwd())
 
 from src.analysis.results import (
-    survey_results_to_df,
+    get_results_shard_paths,
+    iter_survey_results_df,
     load_survey_results,
-    load_survey_results_batch,
-    survey_results_to_df_batch,
+    load_survey_results_context,
+    load_survey_results_df_batch,
+    survey_results_to_df,
+    survey_results_to_runs,
+)
+from src.analysis.store import (
+    get_results_schema,
+    get_store_path,
+    write_results_store,
+    write_results_store_chunks,
 )
 from src.simulation.experiment import load_experiment
 
 
-def main(experiment_name: str, root_directory: str = ""):
-    """Convert survey results from JSON to CSV format for cleaning."""
+def main(
+    experiment_name: str,
+    root_directory: str = "",
+    chunk_size: int = 100_000,
+    n_workers: int = 1,
+    is_streaming: bool = False,
+):
+    """
+    Convert survey results from JSON to the Parquet results store for cleaning.
+    Results files are loaded whole, and the shards of a folder in parallel if n_workers > 1.
+
+    :param is_streaming: stream results files instead, so at most chunk_size responses are
+        held in memory. Slower, for results that do not fit in memory.
+    """
     experiment = load_experiment(experiment_name, root_directory)
 
     simulation_directory = os.path.join(
@@ -28,17 +50,38 @@ def main(experiment_name: str, root_directory: str = ""):
             experiment.files["directory"], "variables", experiment.files["variables"]
         )
     )
+    store_path = get_store_path(simulation_directory, experiment_name, "results")
     is_folder = os.path.isdir(os.path.join(simulation_directory, experiment_name))
+    if not is_streaming:
+        if is_folder:
+            df = load_survey_results_df_batch(
+                experiment_name, simulation_directory, variables, n_workers
+            )
+        else:
+            results = load_survey_results(
+                f"{experiment_name}-results.json", simulation_directory
+            )
+            df = survey_results_to_df(results, variables)
+        write_results_store(df, store_path)
+        print(f"Saved {len(df)} responses")
+        return
     if is_folder:
-        results = load_survey_results_batch(experiment_name, simulation_directory)
-        df = survey_results_to_df_batch(results, variables)
+        paths = get_results_shard_paths(experiment_name, simulation_directory)
     else:
-        results = load_survey_results(
-            f"{experiment_name}-results.json", simulation_directory
-        )
-        df = survey_results_to_df(results, variables)
+        paths = [os.path.join(simulation_directory, f"{experiment_name}-results.json")]
 
-    df.to_csv(os.path.join(simulation_directory, f"{experiment_name}-results.csv"))
+    contexts = [load_survey_results_context(path) for path in paths]
+    runs = pd.concat([survey_results_to_runs(context) for context in contexts])
+    chunks = itertools.chain.from_iterable(
+        iter_survey_results_df(path, variables, context, chunk_size)
+        for path, context in zip(paths, contexts)
+    )
+    n_rows = write_results_store_chunks(
+        chunks,
+        store_path,
+        get_results_schema(runs),
+    )
+    print(f"Saved {n_rows} responses of {len(runs)} runs")
 
 
 if __name__ == "__main__":
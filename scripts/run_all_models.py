@@ -20,6 +20,7 @@ from src.simulation.survey import load_survey, save_results
 def main(
     experiment_name: str,
     run_id: str = None,
+    question_format: str = "individual",
     root_directory: str = "",
     **kwargs,  # additional LLM hyperparams
 ):
@@ -32,8 +33,8 @@ def main(
 
     # todo: clear cache in loop
 
-    survey_questions = load_survey(experiment, "individual", False)
-    survey_flipped = load_survey(experiment, "individual", True)
+    survey_questions = load_survey(experiment, question_format, False)
+    survey_flipped = load_survey(experiment, question_format, True)
     phi_instruct_surveys = run_phi_instruct(
         survey_questions, survey_flipped, shared_config_vars, run_id
     )
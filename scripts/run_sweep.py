@@ -0,0 +1,94 @@
+import os
+import sys
+
+import fire
+
+print("Current working directory:", os.getcwd())
+sys.path.append(os.getcwd())
+
+from src.simulation.experiment import (
+    generate_run_id,
+    huggingface_login,
+    load_experiment,
+)
+from src.simulation.models import adapters, ModelConfig, load_model
+from src.simulation.survey import load_survey, save_results
+from src.simulation.sweep import expand_grid, run_sweep
+
+
+def main(
+    experiment_name: str,
+    run_id: str = None,
+    question_format: str = "individual",
+    is_opinion_gpt: bool = True,
+    root_directory: str = "",
+    **kwargs,  # additional LLM hyperparams, shared by all points of the sweep
+):
+    """
+    Run every combination of the hyperparameter grid in the 'sweep' section of the experiment yaml,
+    e.g. sweep: {temperature: [0.6, 0.9, 1.2], top_p: [0.9, 1.0]}.
+    Each model is loaded once for the whole grid and one results file is saved per point.
+    """
+    experiment = load_experiment(experiment_name, root_directory)
+    points = expand_grid(experiment.sweep)
+    print(f"Sweeping {len(points)} points: {', '.join(points)}")
+
+    run_id = run_id or generate_run_id(experiment.simulation["base_model_name"])
+    shared_config_vars = {**experiment.simulation, "hyperparams": kwargs}
+
+    survey_questions = load_survey(experiment, question_format, False)
+    survey_flipped = load_survey(experiment, question_format, True)
+
+    # same runs as run_all_models.py: instruct model with personas, then opinion-gpt adapters
+    config = ModelConfig(
+        **shared_config_vars,
+        is_lora=False,
+        is_persona=True,
+        aggregation_by="questions",
+    )
+    model, tokenizer = load_model(config)
+    simulated_surveys = run_sweep(
+        model,
+        tokenizer,
+        config,
+        survey_questions,
+        survey_flipped,
+        points,
+        adapters + [None],
+        run_id,
+    )
+
+    if is_opinion_gpt:
+        del model
+        config = ModelConfig(
+            **shared_config_vars,
+            is_lora=True,
+            is_persona=False,
+            aggregation_by="questions",
+        )
+        model, tokenizer = load_model(config)
+        opinion_gpt_surveys = run_sweep(
+            model,
+            tokenizer,
+            config,
+            survey_questions,
+            survey_flipped,
+            points,
+            adapters,
+            run_id,
+        )
+        for name in points:
+            simulated_surveys[name].update(opinion_gpt_surveys[name])
+
+    for name, surveys in simulated_surveys.items():
+        save_results(
+            surveys,
+            experiment.files["directory"],
+            experiment.setup["name"],
+            f"{experiment.setup['name']}-{name}-results.json",
+        )
+
+
+if __name__ == "__main__":
+    huggingface_login()
+    fire.Fire(main)
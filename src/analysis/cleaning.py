@@ -3,9 +3,29 @@ import re
 import numpy as np
 import pandas as pd
 
-from src.data.variables import split_response_string, remap_outputs
+from src.data.variables import (
+    split_response_string,
+    remap_outputs,
+    is_group_key,
+    QNum,
+)
+from src.prompting.messages import extract_grouped_qnums
 
 PLACEHOLDER_TEXT = "<no_text>"  # standardised placeholder for bare key responses
+GROUPED_ITEM_PATTERN = re.compile(r"^\s*(Q\d+)\s*[:\-]\s*", re.MULTILINE)
+PROMPT_PREFIX_PATTERN = re.compile(
+    r"^\s*(your response|response|Q\d+)\s*[:\-]\s*", re.IGNORECASE
+)
+# all leading prefixes in one match, equivalent to stripping them iteratively
+PROMPT_PREFIXES_PATTERN = re.compile(
+    r"^(?:\s*(?:your response|response|Q\d+)\s*[:\-]\s*)+", re.IGNORECASE
+)
+BARE_KEY_PATTERN = re.compile(r"^\s*(\d+)\s*(?:[:\-\.]+)?\s*$")
+KEY_VALUE_PATTERN = re.compile(r"^\s*(\d+)\s*[:\-\.]+\s*(.+?)\s*$", re.DOTALL)
+# BARE_KEY_PATTERN (no text group) or else KEY_VALUE_PATTERN in a single pass
+KEY_AND_TEXT_PATTERN = re.compile(
+    r"^\s*(\d+)\s*(?:[:\-\.]*\s*$|[:\-\.]+\s*(.*\S)\s*$)", re.DOTALL
+)
 
 
 def pipeline_clean_generated_responses(results: pd.DataFrame) -> pd.DataFrame:
@@ -13,14 +33,96 @@ def pipeline_clean_generated_responses(results: pd.DataFrame) -> pd.DataFrame:
     Applies a sequence of cleaning functions to model-generated responses,
     extracting key-value structure and removing superfluous text/prompts.
     """
-    responses = results["response"]
-    responses = responses.apply(remove_prompt_prefixes)
-    responses = responses.apply(detect_bare_key_without_text)
-    responses = responses.apply(split_response_into_key_value)
-    results = add_separate_key_and_text_columns(results, responses)
+    if "number" in results.columns:
+        results = split_grouped_responses(results)
+    # parsing only depends on the response, so each distinct response is parsed once
+    codes, unique = pd.factorize(results["response"], use_na_sentinel=False)
+    parsed = parse_responses(pd.Series(unique, dtype=object)).iloc[codes]
+    results["response_key"] = parsed["response_key"].to_numpy()
+    results["response_text"] = parsed["response_text"].to_numpy()
     return results
 
 
+def parse_responses(responses: pd.Series) -> pd.DataFrame:
+    """
+    Vectorised equivalent of remove_prompt_prefixes, detect_bare_key_without_text and
+    split_response_into_key_value applied to each response.
+    """
+    responses = strip_prompt_prefixes(responses)
+    extracted = responses.str.extract(KEY_AND_TEXT_PATTERN)
+    is_bare_key = extracted[0].notna() & extracted[1].isna()
+    return pd.DataFrame(
+        {
+            # int rather than pd.to_numeric, as \d also matches non-ASCII digits
+            "response_key": pd.to_numeric(extracted[0].map(int, na_action="ignore")),
+            "response_text": extracted[1]
+            .mask(is_bare_key, PLACEHOLDER_TEXT)
+            .fillna(responses),
+        }
+    )
+
+
+def strip_prompt_prefixes(responses: pd.Series) -> pd.Series:
+    """
+    Vectorised remove_prompt_prefixes.
+    """
+    return responses.str.replace(PROMPT_PREFIXES_PATTERN, "", regex=True).str.strip()
+
+
+def split_grouped_responses(results: pd.DataFrame) -> pd.DataFrame:
+    """
+    Expands completions of grouped prompts (one completion per battery, e.g. 'Q1-Q6') into one
+    row per item, keyed by the item's question number. Rows of individual questions are unchanged.
+    """
+    is_grouped = results["number"].map(is_group_key)
+    if not is_grouped.any():
+        return results
+
+    grouped = results[is_grouped].copy()
+    grouped["response"] = [
+        list(split_grouped_response(response, extract_grouped_qnums(prompt)).items())
+        for response, prompt in zip(grouped["response"], grouped["question"])
+    ]
+    grouped = grouped.explode("response")
+    grouped["number"] = grouped["response"].str[0]
+    grouped["response"] = grouped["response"].str[1]
+
+    results = pd.concat([results[~is_grouped], grouped]).sort_index(kind="stable")
+    return results.reset_index(drop=True)
+
+
+def count_grouped_items(results: pd.DataFrame) -> np.ndarray:
+    """
+    Number of rows each row of results is expanded into by split_grouped_responses: one per
+    item of a grouped prompt, one for individual questions.
+    """
+    counts = np.ones(len(results), dtype=int)
+    is_grouped = results["number"].map(is_group_key).to_numpy(dtype=bool)
+    if is_grouped.any():
+        codes, prompts = pd.factorize(results["question"][is_grouped])
+        n_items = [len(dict.fromkeys(extract_grouped_qnums(p))) for p in prompts]
+        counts[is_grouped] = np.array(n_items, dtype=int)[codes]
+    return counts
+
+
+def split_grouped_response(response: str, qnums: list[QNum]) -> dict[QNum, str]:
+    """
+    Splits a completion of the form 'Q1: 1: Agree\nQ2: 2: Disagree' into a response per item.
+    Items without an answer are given an empty response, only the first answer per item is kept.
+    """
+    items = {qnum: "" for qnum in qnums}
+    if not isinstance(response, str):
+        return items
+
+    matches = list(GROUPED_ITEM_PATTERN.finditer(response))
+    ends = [m.start() for m in matches[1:]] + [len(response)]
+    for match, end in zip(matches, ends):
+        qnum = match.group(1)
+        if qnum in items and items[qnum] == "":
+            items[qnum] = response[match.end() : end].strip()
+    return items
+
+
 def remove_prompt_prefixes(response_string: str) -> str:
     """
     Iteratively strips leading prompts like 'Your response:', 'Q22:', etc.
@@ -29,9 +131,8 @@ def remove_prompt_prefixes(response_string: str) -> str:
     # if not isinstance(response_string, str):
     #     return response_string
 
-    pattern = re.compile(r"^\s*(your response|response|Q\d+)\s*[:\-]\s*", re.IGNORECASE)
     while True:
-        match = pattern.match(response_string)
+        match = PROMPT_PREFIX_PATTERN.match(response_string)
         if not match:
             break
         response_string = response_string[match.end() :]
@@ -42,9 +143,7 @@ def detect_bare_key_without_text(response_string: str) -> str:
     """
     Detects cases where only a key is given (e.g. '2') and fills in placeholder text.
     """
-
-    pattern = re.compile("^\s*(\d+)\s*(?:[:\-\.]+)?\s*$")
-    match = pattern.match(response_string)
+    match = BARE_KEY_PATTERN.match(response_string)
     if match:
         key = match.group(1)
         return f"{key}: {PLACEHOLDER_TEXT}"
@@ -59,9 +158,8 @@ def split_response_into_key_value(response: str) -> tuple[int | float, str]:
     if not isinstance(response, str):
         return np.nan, response
 
-    pattern = re.compile(r"^\s*(\d+)\s*[:\-\.]+\s*(.+?)\s*$", re.DOTALL)
     try:
-        return split_response_string(response, pattern)
+        return split_response_string(response, KEY_VALUE_PATTERN)
     except (AttributeError, ValueError):
         return np.nan, response
 
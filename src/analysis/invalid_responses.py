@@ -1,11 +1,13 @@
 import re
+from dataclasses import dataclass
 from enum import StrEnum
+from functools import lru_cache
 
 import numpy as np
 import pandas as pd
 
-from src.analysis.cleaning import remove_prompt_prefixes, PLACEHOLDER_TEXT
-from src.data.variables import ResponseMap, ResponseReverseMap, flip_key_value, QNum
+from src.analysis.cleaning import PLACEHOLDER_TEXT, PROMPT_PREFIXES_PATTERN
+from src.data.variables import ResponseMap, flip_key_value, QNum
 
 
 class InvalidReasons(StrEnum):
@@ -16,290 +18,309 @@ class InvalidReasons(StrEnum):
     AMBIGUOUS = "ambiguous response;"
 
 
+# the only columns the invalid-response pipeline reads
+PARSED_COLUMNS = ["number", "is_scale_flipped", "response_key", "response_text"]
+
+
 def pipeline_identify_invalid_responses(
     results: pd.DataFrame,
     responses: dict[str, ResponseMap],
     flipped_responses: dict[str, ResponseMap],
 ) -> pd.DataFrame:
-    results["reason_invalid"] = ""
-
-    results["response_text"] = results["response_text"].apply(normalise_response_text)
-    results = flip_keys_back(results, responses, flipped_responses)
-    results = extract_first_response_instance(results, responses)
-    results = identify_truncated_response(results, responses)
-    results["extra_text"] = clean_extra_text(results)
-    results = recover_keys_from_text_only(results, responses)
-    results = mark_multiple_responses(results, responses)
-    results = mark_key_value_valid_mismatch(results, responses)
-    results = mark_no_response_given(results)
-    results = mark_invalid(results)
+    """
+    Identifies invalid responses once per distinct combination of PARSED_COLUMNS and broadcasts
+    the outcome back to all rows, as sampled responses to a question are highly repetitive.
+    """
+    codes = results.groupby(
+        PARSED_COLUMNS, sort=False, dropna=False, observed=True
+    ).ngroup()
+    # with sort=False groups are numbered in order of first appearance
+    unique = results.loc[~codes.duplicated().to_numpy(), PARSED_COLUMNS]
+    parsed = identify_invalid_responses(
+        unique.reset_index(drop=True), responses, flipped_responses
+    )
+    codes = codes.to_numpy()
+    for column in [
+        "reason_invalid",
+        "response_key",
+        "response_text",
+        "extra_text",
+        "final_response",
+    ]:
+        results[column] = parsed[column].array.take(codes)
     return results
 
 
-def normalise_response_text(text: str) -> str:
-    return re.sub(r"\s+", " ", text.strip()).lower()
-
-
-def clean_extra_text(results: pd.DataFrame) -> pd.Series:
-    # run twice to catch case with both
-    extra_text = results["extra_text"]
-    return extra_text.apply(remove_prompt_prefixes)
-
-
-def flip_keys_back(
+def identify_invalid_responses(
     results: pd.DataFrame,
     responses: dict[str, ResponseMap],
     flipped_responses: dict[str, ResponseMap],
-):
-    # note: expects cleaned data; will raise KeyError if mappings are missing
-    results = results.copy()
-    value_to_key: dict[str, ResponseReverseMap] = {}
-    for q, r in responses.items():
-        value_to_key[q] = flip_key_value(r)
-
-    def _flip(qnum: str, response_key: int) -> int | type(pd.NA):
-        if pd.isna(response_key):
-            return pd.NA
-        elif response_key < 0:
-            return -1
-        else:
-            question_responses_flipped = flipped_responses[qnum]
-            response_value = question_responses_flipped.get(response_key)
-            return value_to_key[qnum].get(response_value, response_key)
-
-    original_keys = results["response_key"]
-    reverted_keys = results.apply(
-        lambda row: _flip(row["number"], row["response_key"]), axis=1
-    )
+) -> pd.DataFrame:
+    """
+    Splits each response into its leading label and any extra text, promotes truncated
+    labels, recovers the keys of text-only responses and marks ambiguous, mismatched and
+    invalid responses, in a single pass over each question.
+    """
+    results["reason_invalid"] = ""
 
-    results["response_key"] = np.where(
-        results["is_scale_flipped"], reverted_keys, original_keys
-    )
-    results["response_key"] = results["response_key"].astype("Int64")
+    results["response_text"] = normalise_response_texts(results["response_text"])
+    results = flip_keys_back(results, responses, flipped_responses)
 
+    n_rows = len(results)
+    texts = np.full(n_rows, np.nan, dtype=object)
+    extras = np.full(n_rows, np.nan, dtype=object)
+    keys = results["response_key"].to_numpy(dtype=float, na_value=np.nan)
+    reasons = np.full(n_rows, "", dtype=object)
+    response_texts = results["response_text"].to_numpy()
+    for qnum, positions in results.groupby("number", observed=True).indices.items():
+        text, extra, key, reason = _identify_invalid_question(
+            response_texts[positions],
+            keys[positions],
+            QuestionMatcher.from_response_map(responses[qnum]),
+        )
+        texts[positions] = text
+        extras[positions] = extra
+        keys[positions] = key
+        reasons[positions] = reason
+
+    results["response_text"] = texts
+    results["extra_text"] = extras
+    results["response_key"] = pd.array(keys, dtype="Int64")
+    results["reason_invalid"] = reasons
+    results = mark_no_response_given(results)
+    results = mark_invalid(results)
     return results
 
 
-def extract_first_response_instance(
-    results: pd.DataFrame, valid_responses: dict[str, ResponseMap]
-):
+class LabelTrie:
     """
-    1) Try to extract a leading valid label from response_text (primary_from_text).
-    2) If no leading label AND the text is empty/placeholder, and the key is valid,
-       then derive primary from the key (bare-key case).
-    3) Otherwise, do not override with the key (junk/contradictory text remains invalid).
-    4) extra_text gets the trailing content if extracted from text; otherwise keep original text for audit.
+    Trie over the lower-cased labels of a question. It compiles to regexes with alternatives
+    factored by common prefix, so a label is found in one scan of a string rather than by trying
+    every label in turn, and walking a string down the trie finds the labels it is a prefix of.
+    Labels with negative keys are only matched by the pattern of all labels.
     """
-    results = results.copy()
-    primaries, extras = [], []
-
-    for qnum, group in results.groupby("number"):
-        resp_map = {k: v for k, v in valid_responses[qnum].items() if k >= 0}
-        valid_keys = set(resp_map.keys())
 
-        allowed = sorted(resp_map.values(), key=len, reverse=True)
-        pat = re.compile(
-            rf"^({'|'.join(map(re.escape, allowed))})(?:\s+(.*))?",
-            flags=re.IGNORECASE | re.DOTALL,
-        )
-        extracted = group["response_text"].str.extract(pat)
-        primary_from_text = extracted[0]
-        extra_from_text = extracted[1]
-
-        text_has_leading_label = primary_from_text.notna()
-        text_is_placeholder = group["response_text"].eq(PLACEHOLDER_TEXT) | group[
-            "response_text"
-        ].eq("")
-        key_is_valid = group["response_key"].isin(valid_keys)
-
-        primary = primary_from_text.copy()
-        use_key = (~text_has_leading_label) & text_is_placeholder & key_is_valid
-        primary.loc[use_key] = group.loc[use_key, "response_key"].map(resp_map)
-
-        extra = pd.Series("", index=group.index, dtype="object")
-        # trailing only for rows where a label is extracted from text
-        has_trail = text_has_leading_label & extra_from_text.notna()
-        extra.loc[has_trail] = extra_from_text.loc[has_trail].fillna("")
-        # for non-text-extracted rows, keep original text for audit
-        keep_orig = (
-            (~text_has_leading_label)
-            & ~text_is_placeholder
-            & group["response_text"].notna()
+    def __init__(self, labels: list[str], valid_labels: list[str]):
+        self.children: list[dict[str, int]] = [{}]
+        self.is_label: list[bool] = [False]
+        self.is_valid_label: list[bool] = [False]
+        # number of valid labels (with duplicates) that start with the prefix of each node
+        self.n_completions: list[int] = [0]
+        self.completion: list[str | None] = [None]
+        for label in labels:
+            self._insert(label.lower(), is_valid=False)
+        for label in valid_labels:
+            self._insert(label.lower(), is_valid=True)
+
+    def _insert(self, label: str, is_valid: bool):
+        node = 0
+        path = [node]
+        for char in label:
+            if char not in self.children[node]:
+                self.children[node][char] = len(self.children)
+                self.children.append({})
+                self.is_label.append(False)
+                self.is_valid_label.append(False)
+                self.n_completions.append(0)
+                self.completion.append(None)
+            node = self.children[node][char]
+            path.append(node)
+        self.is_label[node] = True
+        if is_valid:
+            self.is_valid_label[node] = True
+            for n in path:
+                self.n_completions[n] += 1
+                self.completion[n] = label
+
+    def complete(self, prefix: str) -> str | None:
+        """The valid label that starts with prefix, if there is exactly one."""
+        node = 0
+        for char in prefix:
+            node = self.children[node].get(char)
+            if node is None:
+                return None
+        return self.completion[node] if self.n_completions[node] == 1 else None
+
+    def to_pattern(self, is_valid_only: bool = False, node: int = 0) -> str:
+        """
+        Regex matching exactly the labels. Optional suffixes are greedy, so the longest label
+        is tried first, as in an alternation sorted by length.
+        """
+        alternatives = [
+            re.escape(char) + self.to_pattern(is_valid_only, child)
+            for char, child in self.children[node].items()
+            if not is_valid_only or self.n_completions[child]
+        ]
+        if not alternatives:
+            return ""
+        pattern = (
+            alternatives[0]
+            if len(alternatives) == 1
+            else "(?:" + "|".join(alternatives) + ")"
         )
-        extra.loc[keep_orig] = group.loc[keep_orig, "response_text"]
-
-        primaries.append(primary.fillna(""))
-        extras.append(extra.fillna(""))
-
-    results["response_text"] = pd.concat(primaries).sort_index()
-    results["extra_text"] = pd.concat(extras).sort_index()
-    return results
+        is_label = self.is_valid_label if is_valid_only else self.is_label
+        if node and is_label[node]:
+            pattern = f"(?:{pattern})?"
+        return pattern
 
 
-def identify_truncated_response(
-    results: pd.DataFrame, valid_responses: dict[str, ResponseMap]
-):
-    results = results.copy()
-    primaries, extras = [], []
+@dataclass(frozen=True)
+class QuestionMatcher:
+    """
+    Label trie and lookups of a question, built once per response map.
+    """
 
-    for qnum, group in results.groupby("number"):
-        labels = [v.lower() for k, v in valid_responses[qnum].items() if k >= 0]
+    response_map: dict[int, str]
+    valid_map: dict[int, str]  # non-negative keys only
+    valid_lower: dict[int, str]
+    labels: LabelTrie
+    leading_label: re.Pattern
+    any_label: re.Pattern
+
+    @classmethod
+    def from_response_map(cls, response_map: ResponseMap) -> "QuestionMatcher":
+        return _build_matcher(tuple(response_map.items()))
+
+    def promote_truncated(self, extra_text: str) -> str | None:
+        """The unique label that a long trailing text is a truncation of, if any."""
+        if not isinstance(extra_text, str) or extra_text == "" or len(extra_text) < 30:
+            return None
+        return self.labels.complete(extra_text)
+
+    def recover_key(self, response_text: str) -> int | None:
+        return _try_recover_key_from_text(response_text, self.response_map)
+
+
+@lru_cache(maxsize=None)
+def _build_matcher(items: tuple[tuple[int, str], ...]) -> QuestionMatcher:
+    response_map = dict(items)
+    valid_map = {k: v for k, v in response_map.items() if k >= 0}
+    labels = LabelTrie(list(response_map.values()), list(valid_map.values()))
+    return QuestionMatcher(
+        response_map=response_map,
+        valid_map=valid_map,
+        valid_lower={k: v.lower() for k, v in valid_map.items()},
+        labels=labels,
+        leading_label=re.compile(
+            rf"^({labels.to_pattern(is_valid_only=True)})(?:\s+(.*))?",
+            flags=re.IGNORECASE | re.DOTALL,
+        ),
+        any_label=re.compile(
+            rf"(?<!\w){labels.to_pattern()}(?!\w)", flags=re.IGNORECASE
+        ),
+    )
 
-        def _promote(ext: str) -> str | None:
-            if not isinstance(ext, str) or ext == "" or len(ext) < 30:
-                return None
-            cands = [lab for lab in labels if lab.startswith(ext)]
-            return cands[0] if len(cands) == 1 else None  # only promote if unique
 
-        matches = group["extra_text"].apply(_promote)
-        primary = group["response_text"].copy()
-        extra = group["extra_text"].copy()
+def _identify_invalid_question(
+    texts: np.ndarray, keys: np.ndarray, matcher: QuestionMatcher
+) -> tuple[list, list, list, list]:
+    primaries, extras, recovered_keys, reasons = [], [], [], []
+    valid_texts = set(matcher.valid_lower.values())
+    for text, key in zip(texts, keys):
+        has_text = isinstance(text, str)
+        has_key = not np.isnan(key)
 
-        mask = matches.notna()
-        primary.loc[mask] = matches.loc[mask]
-        extra.loc[mask] = ""
+        # leading label, or label of a bare key
+        match = matcher.leading_label.search(text) if has_text else None
+        if match:
+            primary, extra = match.group(1), match.group(2) or ""
+        else:
+            is_placeholder = text == PLACEHOLDER_TEXT or text == ""
+            is_key_label = is_placeholder and has_key and key in matcher.valid_map
+            primary = matcher.valid_map[key] if is_key_label else ""
+            extra = text if has_text and not is_placeholder else ""
+
+        # truncated labels in the trailing text
+        truncated = matcher.promote_truncated(extra)
+        if truncated is not None:
+            primary, extra = truncated, ""
+        extra = PROMPT_PREFIXES_PATTERN.sub("", extra).strip()
+
+        # keys of text-only responses
+        if not has_key:
+            key = matcher.recover_key(primary)
+            has_key = key is not None
+            key = key if has_key else np.nan
+
+        has_valid_text = primary in valid_texts
+        reason = ""
+        if matcher.any_label.search(extra):
+            reason += InvalidReasons.AMBIGUOUS
+        if has_key and has_valid_text and primary != matcher.valid_lower.get(key):
+            reason += InvalidReasons.MISMATCH
+        if not has_valid_text and primary != PLACEHOLDER_TEXT:
+            reason += InvalidReasons.INVALID_TEXT
+        if has_key and key not in matcher.valid_map:
+            reason += InvalidReasons.INVALID_KEY
 
         primaries.append(primary)
         extras.append(extra)
-
-    results["response_text"] = pd.concat(primaries).sort_index()
-    results["extra_text"] = pd.concat(extras).sort_index()
-    return results
-
-
-def extract_first_response_instance1(
-    results: pd.DataFrame, valid_responses: dict[str, ResponseMap]
-):
-    primary_list = []
-    extra_list = []
-    # reason_list = []
-    for qnum, group in results.groupby("number"):
-
-        # case: llm starts generating the next question
-        allowed_responses = list(valid_responses[qnum].values())
-        allowed_responses.sort(key=len, reverse=True)
-        allowed = "|".join(map(re.escape, allowed_responses))
-        main_pattern = rf"^({allowed})(?:\s+(.*))?"
-
-        # extract valid responses
-        extracted = group["response_text"].str.extract(
-            main_pattern, flags=re.IGNORECASE | re.DOTALL
-        )
-        primary, extra = extracted[0], extracted[1]
-        # reason = group["reason_invalid"]
-
-        # identify missing response text
-        is_text_missing = primary.isna()
-        is_extra_text_missing = extra.isna()
-        extra[is_text_missing] = group["response_text"][is_text_missing]
-        primary[is_text_missing & is_extra_text_missing] = PLACEHOLDER_TEXT
-
-        # add reason for invalidity
-        # reason.update(reason[is_text_missing] + InvalidReasons.NO_RESPONSE)
-        # reason_list.append(reason)
-        primary_list.append(primary)
-        extra_list.append(extra)
-
-    results["response_text"] = pd.concat(primary_list).sort_index()
-    results["extra_text"] = pd.concat(extra_list).sort_index().fillna("")
-    # results["reason_invalid"] = pd.concat(reason_list).sort_index()
-    return results
+        recovered_keys.append(key)
+        reasons.append(reason)
+    return primaries, extras, recovered_keys, reasons
 
 
-def mark_no_response_given(results: pd.DataFrame) -> pd.DataFrame:
+def normalise_response_texts(texts: pd.Series) -> pd.Series:
     """
-    Marks responses with no response text as invalid.
+    Strips, collapses whitespace in and lower-cases each response text.
     """
-    results = results.copy()
-    is_no_response = _check_missing_text(results) & _check_missing_key(results)
-    results["reason_invalid"].update(
-        results["reason_invalid"][is_no_response] + InvalidReasons.NO_RESPONSE
-    )
-
-    return results
+    return texts.str.strip().str.replace(r"\s+", " ", regex=True).str.lower()
 
 
-def recover_keys_from_text_only(
-    results: pd.DataFrame, responses: dict[str, ResponseMap]
-) -> pd.DataFrame:
+def flip_keys_back(
+    results: pd.DataFrame,
+    responses: dict[str, ResponseMap],
+    flipped_responses: dict[str, ResponseMap],
+):
     """
-    Attempts to recover missing response_keys from text-only responses.
-    Only applies recovery if text maps uniquely to a known label for the question.
+    Maps the keys of responses given on a flipped scale back to the original scale, via the
+    label of the flipped key. Negative keys become -1, keys without a label are unchanged.
+    Modifies results in place.
     """
-    results = results.copy()
-    recovered_keys = []
-
-    for qnum, group in results.groupby("number"):
-        response_map = responses[qnum]
-        text_only = group["response_key"].isna()
-
-        recovered = group.loc[text_only, "response_text"].apply(
-            lambda text: _try_recover_key_from_text(text, response_map)
-        )
-        recovered_keys.append(recovered)
-
-    recovered_keys = pd.concat(recovered_keys).sort_index()
-    results.loc[recovered_keys.index, "response_key"] = recovered_keys
-    results["response_key"] = results["response_key"].astype("Int64")
-    return results
-
-
-def mark_multiple_responses(
-    results: pd.DataFrame, valid_responses: dict[QNum, ResponseMap]
-):
-    reason_list = []
-    for qnum, group in results.groupby("number"):
-
-        responses = list(valid_responses[qnum].values())
-        responses.sort(key=len, reverse=True)
-        all_responses = r"(?<!\w)(" + "|".join(map(re.escape, responses)) + r")(?!\w)"
-
-        is_multiple_responses = group["extra_text"].str.contains(
-            all_responses, flags=re.IGNORECASE, regex=True
-        )
-
-        reason = group["reason_invalid"].copy()
-        reason.update(reason[is_multiple_responses] + InvalidReasons.AMBIGUOUS)
-        reason_list.append(reason)
-
-    results["reason_invalid"] = pd.concat(reason_list).sort_index()
+    # note: expects cleaned data; will raise KeyError if mappings are missing
+    keys = results["response_key"].astype("Int64")
+    is_flipped = results["is_scale_flipped"].to_numpy(dtype=bool)
+    rows = np.flatnonzero(is_flipped & keys.notna().to_numpy())
+
+    codes, qnums = pd.factorize(results["number"].to_numpy()[rows])
+    table = get_flip_table(list(qnums), responses, flipped_responses)
+    flipped_keys = keys.to_numpy(dtype=np.int64, na_value=-1)[rows]
+    original_keys = flipped_keys.copy()
+    in_table = (flipped_keys >= 0) & (flipped_keys < table.shape[1])
+    original_keys[in_table] = table[codes[in_table], flipped_keys[in_table]]
+    original_keys[flipped_keys < 0] = -1
+
+    keys.iloc[rows] = original_keys
+    results["response_key"] = keys
     return results
 
 
-def mark_key_value_valid_mismatch(
-    results: pd.DataFrame, responses: dict[str, ResponseMap]
-) -> pd.DataFrame:
-
-    results = results.copy()
-    reason_list = []
-
-    for qnum, group in results.groupby("number"):
-        valid_responses = {k: v.lower() for k, v in responses[qnum].items() if k >= 0}
-        reason = group["reason_invalid"].copy()
-        valid_keys = set(valid_responses.keys())
-        valid_texts = set(valid_responses.values())
-
-        key_invalid = _check_invalid_key(group, valid_keys)
-        text_invalid = _check_invalid_text(group, valid_texts)
-        key_text_mismatch = _check_key_text_mismatch(group, valid_responses)
-
-        reason.update(reason[key_text_mismatch] + InvalidReasons.MISMATCH)
-        reason.update(reason[text_invalid] + InvalidReasons.INVALID_TEXT)
-        reason.update(reason[key_invalid] + InvalidReasons.INVALID_KEY)
-
-        reason_list.append(reason)
-
-    results["reason_invalid"] = pd.concat(reason_list).sort_index()
-    return results
+def get_flip_table(
+    qnums: list[QNum],
+    responses: dict[str, ResponseMap],
+    flipped_responses: dict[str, ResponseMap],
+) -> np.ndarray:
+    """
+    Original key of each (question, flipped key), i.e. table[i, k] for question qnums[i].
+    Flipped keys without a label in the original scale map to themselves.
+    """
+    n_keys = 1 + max((k for q in qnums for k in flipped_responses[q]), default=0)
+    table = np.tile(np.arange(n_keys), (len(qnums), 1))
+    for i, qnum in enumerate(qnums):
+        value_to_key = flip_key_value(responses[qnum])
+        for key, value in flipped_responses[qnum].items():
+            if key >= 0 and value in value_to_key:
+                table[i, key] = value_to_key[value]
+    return table
 
 
-def _check_invalid_key(df: pd.DataFrame, valid_keys: set[int]) -> pd.Series:
+def mark_no_response_given(results: pd.DataFrame) -> pd.DataFrame:
     """
-    Marks responses where the response_key is missing or not among valid keys.
+    Marks responses with no response text as invalid. Modifies results in place.
     """
-    is_text_only = _check_missing_key(df)
-    is_valid_key = df["response_key"].isin(valid_keys)
-    return ~is_text_only & ~is_valid_key
+    is_no_response = _check_missing_text(results) & _check_missing_key(results)
+    results.loc[is_no_response, "reason_invalid"] += InvalidReasons.NO_RESPONSE
+    return results
 
 
 def _check_missing_key(df: pd.DataFrame) -> pd.Series:
@@ -313,30 +334,6 @@ def _check_missing_text(df: pd.DataFrame) -> pd.Series:
     return df["response_text"] == PLACEHOLDER_TEXT
 
 
-def _check_missing_extra_text(df: pd.DataFrame) -> pd.Series:
-    return df["extra_text"] == ""
-
-
-def _check_invalid_text(group: pd.DataFrame, valid_texts: set[str]) -> pd.Series:
-    is_placeholder = _check_missing_text(group)
-    is_valid_text = group["response_text"].isin(valid_texts)
-    return ~is_valid_text & ~is_placeholder
-
-
-def _check_key_text_mismatch(
-    group: pd.DataFrame, valid_responses: ResponseMap
-) -> pd.Series:
-    """
-    Marks rows where a valid response_text does not match the label implied by response_key.
-    Ignores rows with missing keys or incomplete (placeholder) text.
-    """
-    expected_text_for_key = group["response_key"].map(valid_responses)
-
-    has_key = group["response_key"].notna()
-    has_valid_text = group["response_text"].isin(valid_responses.values())
-    return has_key & has_valid_text & (group["response_text"] != expected_text_for_key)
-
-
 def _try_recover_key_from_text(
     response_text: str, response_map: dict[int, str]
 ) -> int | None:
@@ -1,11 +1,9 @@
-import json
 import os
 
 import pandas as pd
 
 from src.analysis.visualisations import RENAME_MAP, reformat_index
 from src.data.variables import QNum, ResponseMap, remap_response_maps
-from src.utils import key_as_int
 
 
 def create_subdirectory(directory: str, subdirectory: str) -> str:
@@ -18,15 +16,15 @@ def create_subdirectory(directory: str, subdirectory: str) -> str:
     return full_path
 
 
-def load_response_maps(directory: str = "../data_files") -> dict[QNum, ResponseMap]:
-    with open(
-        os.path.join(directory, "variables/response_map_original.json"), "r"
-    ) as f1:
-        response_map = key_as_int(json.load(f1))
-        response_map = remap_response_maps(response_map)
-        response_map = {k: v for k, v in response_map.items() if k != "Q215"}
-
-    return response_map
+def prepare_analysis_response_maps(
+    response_maps: dict[QNum, ResponseMap],
+) -> dict[QNum, ResponseMap]:
+    """
+    Response maps of the original scale as used in the analysis, see
+    src.simulation.survey.load_response_maps.
+    """
+    response_maps = remap_response_maps(response_maps)
+    return {k: v for k, v in response_maps.items() if k != "Q215"}  # not asked in USA
 
 
 def save_latex_table(df: pd.DataFrame, directory: str, name: str, **kwargs):
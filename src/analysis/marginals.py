@@ -3,15 +3,20 @@ import os
 from collections import Counter
 from typing import Callable
 
+import numpy as np
 import pandas as pd
 
 from src.analysis.aggregations import DataDict, steered_models
 from src.analysis.io import save_latex_table
 from src.analysis.metrics import (
+    DISTANCE_KERNELS,
+    bootstrap_metric,
     calculate_misalignment,
+    calculate_pairwise_metric,
     calculate_variance,
     prepare_distributions_single,
 )
+from src.analysis.tensors import DistributionCache
 from src.analysis.visualisations import plot_distance_heatmap
 from src.data.variables import QNum, ResponseMap
 from src.simulation.models import ModelName, AdapterName
@@ -22,46 +27,145 @@ def compare_marginal_response_dists(
     response_map: dict[QNum, ResponseMap],
     metric_directory: str,
     grouping: str,
+    cache: DistributionCache = None,
+    n_bootstrap: int = 1000,
+    confidence: float = 0.95,
+    seed: int = None,
 ):
-
+    """
+    :param cache: distributions shared with the other analyses of the run, a new one by default.
+    :param n_bootstrap: number of bootstrap replicates of the confidence intervals of the
+        misalignment, saved as the ci_lower and ci_upper columns. Not computed if 0.
+    """
+    cache = cache or DistributionCache()
     # todo: rename to dissimilarity
     misalignment = {
-        n: get_metric(d, calculate_misalignment, response_map)
+        n: get_metric(d, calculate_misalignment, response_map, cache, (grouping, n))
+        for n, d in data_dict.items()
+    }
+    variances = {
+        n: get_variance(d, response_map, cache, (grouping, n))
         for n, d in data_dict.items()
     }
-    variances = {n: get_variance(d, response_map) for n, d in data_dict.items()}
 
     flatten_to_df_long(variances).to_csv(
         os.path.join(metric_directory, f"{grouping}-variances.csv")
     )
-    flatten_to_df_long(misalignment).to_csv(
-        os.path.join(metric_directory, f"{grouping}-misalignment.csv")
-    )
+    misalignment = flatten_to_df_long(misalignment)
+    if n_bootstrap > 0:
+        rng = np.random.default_rng(seed)
+        intervals = {
+            n: get_bootstrap_intervals(
+                d,
+                calculate_misalignment,
+                response_map,
+                n_bootstrap,
+                confidence,
+                rng,
+                cache,
+                (grouping, n),
+            )
+            for n, d in data_dict.items()
+        }
+        for bound in ["lower", "upper"]:
+            bounds = flatten_to_df_long(
+                {
+                    n: {model: ci[bound] for model, ci in models.items()}
+                    for n, models in intervals.items()
+                }
+            )
+            misalignment = misalignment.merge(
+                bounds.rename(columns={"value": f"ci_{bound}"}),
+                on=["number", "group", "model"],
+                how="left",
+            )
+    misalignment.to_csv(os.path.join(metric_directory, f"{grouping}-misalignment.csv"))
 
 
 def get_metric(
-    dfs: dict[str, pd.DataFrame], metric_fn, response_map: dict[QNum, ResponseMap]
+    dfs: dict[str, pd.DataFrame],
+    metric_fn,
+    response_map: dict[QNum, ResponseMap],
+    cache: DistributionCache = None,
+    subgroup_key: tuple[str, AdapterName] = None,
 ) -> dict[str, pd.Series]:
+    """
+    :param cache: cache of the distributions of the models, which metric_fn must accept.
+    :param subgroup_key: grouping and subgroup of dfs in the cache.
+    """
     return {
-        "opinion_gpt": pd.Series(
-            metric_fn(dfs["opinion_gpt"], dfs["true"], response_map)
-        ),
-        "persona": pd.Series(metric_fn(dfs["persona"], dfs["true"], response_map)),
-        "base": pd.Series(metric_fn(dfs["base"], dfs["true"], response_map)),
+        model: pd.Series(
+            metric_fn(
+                dfs[model],
+                dfs["true"],
+                response_map,
+                **_get_cache_kwargs(cache, subgroup_key, [model, "true"]),
+            )
+        )
+        for model in ["opinion_gpt", "persona", "base"]
+    }
+
+
+def get_bootstrap_intervals(
+    dfs: dict[str, pd.DataFrame],
+    metric_fn,
+    response_map: dict[QNum, ResponseMap],
+    n_bootstrap: int = 1000,
+    confidence: float = 0.95,
+    rng: np.random.Generator = None,
+    cache: DistributionCache = None,
+    subgroup_key: tuple[str, AdapterName] = None,
+) -> dict[str, pd.DataFrame]:
+    """Bootstrap confidence intervals of get_metric, see bootstrap_metric."""
+    return {
+        model: bootstrap_metric(
+            metric_fn,
+            dfs[model],
+            dfs["true"],
+            response_map,
+            n_bootstrap,
+            confidence,
+            rng,
+            **_get_cache_kwargs(cache, subgroup_key, [model, "true"]),
+        )
+        for model in ["opinion_gpt", "persona", "base"]
     }
 
 
 def get_variance(
-    dfs: dict[str, pd.DataFrame], response_map: dict[QNum, ResponseMap]
+    dfs: dict[str, pd.DataFrame],
+    response_map: dict[QNum, ResponseMap],
+    cache: DistributionCache = None,
+    subgroup_key: tuple[str, AdapterName] = None,
 ) -> dict[str, pd.Series]:
     return {
-        "opinion_gpt": pd.Series(calculate_variance(dfs["opinion_gpt"], response_map)),
-        "persona": pd.Series(calculate_variance(dfs["persona"], response_map)),
-        "true": pd.Series(calculate_variance(dfs["true"], response_map)),
-        "base": pd.Series(calculate_variance(dfs["base"], response_map)),
+        model: pd.Series(
+            calculate_variance(
+                dfs[model],
+                response_map,
+                **_get_cache_kwargs(cache, subgroup_key, model),
+            )
+        )
+        for model in ["opinion_gpt", "persona", "true", "base"]
     }
 
 
+def _get_cache_kwargs(
+    cache: DistributionCache | None,
+    subgroup_key: tuple[str, AdapterName],
+    models: ModelName | list[ModelName],
+) -> dict:
+    """Keyword arguments of the metrics to look up the distributions of models in cache."""
+    if cache is None:
+        return {}
+    if isinstance(models, list):
+        return {
+            "cache": cache,
+            "cache_keys": [(*subgroup_key, model) for model in models],
+        }
+    return {"cache": cache, "cache_key": (*subgroup_key, models)}
+
+
 def flatten_to_df_long(metric_results: dict[str, dict]) -> pd.DataFrame:
     records = []
     for sg, metrics in metric_results.items():
@@ -129,13 +233,16 @@ def find_degenerate_questions(
 
 
 def _get_response_distributions(
-    dfs: dict[str, pd.DataFrame], response_map: dict[QNum, ResponseMap]
+    dfs: dict[str, pd.DataFrame],
+    response_map: dict[QNum, ResponseMap],
+    cache: DistributionCache = None,
+    subgroup_key: tuple[str, AdapterName] = None,
 ):
     return {
-        "opinion_gpt": prepare_distributions_single(dfs["opinion_gpt"], response_map),
-        "persona": prepare_distributions_single(dfs["persona"], response_map),
-        "base": prepare_distributions_single(dfs["base"], response_map),
-        "true": prepare_distributions_single(dfs["true"], response_map),
+        model: prepare_distributions_single(
+            dfs[model], response_map, **_get_cache_kwargs(cache, subgroup_key, model)
+        )
+        for model in ["opinion_gpt", "persona", "base", "true"]
     }
 
 
@@ -144,9 +251,12 @@ def generate_cross_comparison(
     response_map: dict[QNum, ResponseMap],
     graph_directory: str,
     grouping: str,
+    cache: DistributionCache = None,
 ):
     name, fn, cmap = ("Dissimilarity", calculate_misalignment, "Blues")
-    cross = get_cross_distance(data_dict, fn, response_map)
+    cross = get_cross_distance(
+        data_dict, fn, response_map, cache=cache, grouping=grouping
+    )
     plot_distance_heatmap(
         cross, name, cmap=cmap, save_directory=graph_directory, grouping=grouping
     )
@@ -157,18 +267,46 @@ def get_cross_distance(
     metric_fn: Callable,
     response_map: dict[QNum, ResponseMap],
     data_name: str = "true",
+    cache: DistributionCache = None,
+    grouping: str = None,
 ) -> pd.DataFrame:
-    cross = {}
-    data_dict = data_dict.copy()
-    # data_dict["Base Phi 3"] = {data_name: base}
-    for s1, d1 in data_dict.items():
-        cross[s1] = {}
-        for s2, d2 in data_dict.items():
-            cross[s1][s2] = pd.Series(
-                metric_fn(d1[data_name], d2[data_name], response_map)
-            ).mean()
+    """
+    Mean distance over questions between the data_name responses of each pair of subgroups. The
+    distributions of each subgroup are computed once for metrics in DISTANCE_KERNELS, other
+    metrics are called for every ordered pair of subgroups.
 
-    return pd.DataFrame(cross).T.round(4)
+    :param cache: cache of the distributions of metrics in DISTANCE_KERNELS, keyed by grouping.
+    """
+    subgroups = list(data_dict)
+    if metric_fn not in DISTANCE_KERNELS:
+        cross = {
+            s1: {
+                s2: pd.Series(
+                    metric_fn(d1[data_name], d2[data_name], response_map)
+                ).mean()
+                for s2, d2 in data_dict.items()
+            }
+            for s1, d1 in data_dict.items()
+        }
+        return pd.DataFrame(cross).T.round(4)
+
+    kwargs = {}
+    if cache is not None:
+        kwargs = dict(
+            cache=cache, cache_keys=[(grouping, s, data_name) for s in subgroups]
+        )
+    _, pairwise = calculate_pairwise_metric(
+        metric_fn, [data_dict[s][data_name] for s in subgroups], response_map, **kwargs
+    )
+    # questions the metric does not apply to or either subgroup does not have are nan
+    n_qnums = (~np.isnan(pairwise)).sum(axis=2)
+    means = np.divide(
+        np.nansum(pairwise, axis=2),
+        n_qnums,
+        out=np.full(n_qnums.shape, np.nan),
+        where=n_qnums > 0,
+    )
+    return pd.DataFrame(means, index=subgroups, columns=subgroups).round(4)
 
 
 def save_response_distributions(
@@ -176,9 +314,11 @@ def save_response_distributions(
     data_directory: str,
     response_map: dict[QNum, ResponseMap],
     grouping: str,
+    cache: DistributionCache = None,
 ):
     dists = {
-        n: _get_response_distributions(d, response_map) for n, d in data_dict.items()
+        n: _get_response_distributions(d, response_map, cache, (grouping, n))
+        for n, d in data_dict.items()
     }
     with open(
         os.path.join(data_directory, f"{grouping}-response-dists.json"), "w"
@@ -1,17 +1,24 @@
+import warnings
 from typing import Callable
 
 import numpy as np
 import pandas as pd
-from scipy.spatial.distance import jensenshannon
-from scipy.stats import wasserstein_distance
-
+from src.analysis.tensors import (
+    CacheKey,
+    DistributionCache,
+    encode_responses,
+    get_distributions,
+    get_histograms,
+    histograms_to_distributions,
+    resample_histograms,
+)
 from src.analysis.responses import (
     get_response_distribution,
     FrequencyDist,
-    remove_weight_col,
     get_response_distribution_weighted,
     get_support_diameter,
     get_support_minimum,
+    to_frequency_dists,
 )
 from src.data.variables import ResponseMap, QNum, ordinal_qnums, non_ordinal_qnums
 
@@ -24,7 +31,7 @@ def calculate_jensen_shannon(
 ) -> dict[QNum, float]:
     """Calculate Jensen-Shannon distance for all questions with a non-ordinal response scale."""
     return _calculate_distance_metric(
-        jensenshannon,
+        jensen_shannon_distances,
         non_ordinal_qnums(),
         model_responses,
         true_responses,
@@ -41,7 +48,7 @@ def calculate_total_variation(
 ) -> dict[QNum, float]:
     """Calculate Total Variation distance for all questions with a non-ordinal response scale."""
     return _calculate_distance_metric(
-        total_variation_distance,
+        total_variation_distances,
         non_ordinal_qnums(),
         model_responses,
         true_responses,
@@ -66,26 +73,250 @@ def calculate_variance(
 
 
 def _calculate_distance_metric(
-    metric_fn: Callable,
+    distance_fn: Callable,
     qnum_subset: list[QNum],
     model_responses: pd.DataFrame,
     true_responses: pd.DataFrame,
     response_maps: dict[QNum, ResponseMap],
     **kwargs
-):
+) -> dict[QNum, float]:
     """Calculate a distance metric for all questions in the given subset."""
-    model_dists, true_dists = prepare_distributions(
+    dists = prepare_aligned_distributions(
         model_responses, true_responses, response_maps, **kwargs
     )
-    qnums = set(model_dists.keys()).intersection(true_dists).intersection(qnum_subset)
+    return apply_distance_metric(distance_fn, qnum_subset, *dists)
 
-    distances = {}
-    for qnum in qnums:
-        _, model_weights, true_weights = get_sorted_support_and_obs(
-            model_dists[qnum], true_dists[qnum]
+
+def apply_distance_metric(
+    distance_fn: Callable,
+    qnum_subset: list[QNum],
+    qnums: list[QNum],
+    model_dists: np.ndarray,
+    true_dists: np.ndarray,
+    support: np.ndarray,
+) -> dict[QNum, float]:
+    """
+    Calculate a distance metric for all questions in the given subset at once.
+
+    :param distance_fn: function of both distributions and their support (questions × support)
+        returning the distance for each question, e.g. wasserstein_distances.
+    """
+    is_subset = np.isin(qnums, list(qnum_subset))
+    distances = distance_fn(
+        model_dists[is_subset], true_dists[is_subset], support[is_subset]
+    )
+    return dict(zip(np.array(qnums)[is_subset].tolist(), distances.tolist()))
+
+
+def prepare_aligned_distributions(
+    model_responses: pd.DataFrame,
+    true_responses: pd.DataFrame,
+    response_maps: dict[QNum, ResponseMap],
+    **kwargs
+) -> tuple[list[QNum], np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Distributions of both sets of responses over the valid support of the questions they have in
+    common, using survey weights if present.
+
+    :returns: the questions, both distributions and the support (questions × support), with
+        distributions padded with 0 and the support padded with nan.
+    """
+    qnums, dists, support = prepare_distribution_tensor(
+        [model_responses, true_responses], response_maps, **kwargs
+    )
+    is_common = ~np.isnan(dists[:, :, 0]).any(axis=0)
+    qnums = np.array(qnums)[is_common].tolist()
+    return qnums, dists[0, is_common], dists[1, is_common], support[is_common]
+
+
+def prepare_distribution_tensor(
+    responses: list[pd.DataFrame],
+    response_maps: dict[QNum, ResponseMap],
+    cache: DistributionCache = None,
+    cache_keys: list[CacheKey] = None,
+    **kwargs
+) -> tuple[list[QNum], np.ndarray, np.ndarray]:
+    """
+    Distributions of each set of responses over the valid support of every question any of them
+    has, using survey weights if present.
+
+    :param cache: cache of the distributions of each set of responses, keyed by cache_keys.
+        All metrics and prepare_distributions_single accept these parameters as keyword
+        arguments.
+    :returns: the questions in order of appearance, the distributions (sets × questions ×
+        support) padded with 0 and nan for questions a set does not have, and the support
+        (questions × support) padded with nan.
+    """
+    default_kwargs = dict(is_normalize=True, is_include_invalid=False)
+    kwargs = {**default_kwargs, **kwargs}
+    if cache is None:
+        tensors = [encode_responses(df, response_maps) for df in responses]
+        tensor_dists = [get_distributions(tensor, **kwargs) for tensor in tensors]
+    else:
+        tensors, tensor_dists = zip(
+            *[
+                cache.get_distributions(key, df, response_maps, **kwargs)
+                for key, df in zip(cache_keys, responses)
+            ]
+        )
+    qnums = list(dict.fromkeys(qnum for tensor in tensors for qnum in tensor.qnums))
+    support = get_support(qnums, response_maps)
+
+    position = {qnum: i for i, qnum in enumerate(qnums)}
+    dists = np.zeros((len(tensors), *support.shape))
+    is_present = np.zeros((len(tensors), len(qnums)), dtype=bool)
+    for i, (tensor, dist) in enumerate(zip(tensors, tensor_dists)):
+        rows = [position[qnum] for qnum in tensor.qnums]
+        dists[i, rows, : dist.shape[1]] = dist
+        is_present[i, rows] = True
+    dists[:, np.isnan(support)] = 0
+    dists[~is_present] = np.nan
+    return qnums, dists, support
+
+
+def get_support(
+    qnums: list[QNum], response_maps: dict[QNum, ResponseMap]
+) -> np.ndarray:
+    """Valid response keys of each question in ascending order (questions × support)."""
+    keys = [sorted(response_maps[qnum]) for qnum in qnums]
+    support = np.full((len(qnums), max(map(len, keys), default=0)), np.nan)
+    for i, qnum_keys in enumerate(keys):
+        support[i, : len(qnum_keys)] = qnum_keys
+    # invalid keys are not part of the support, even if they are in the response map
+    support[support <= -1] = np.nan
+    return support
+
+
+def calculate_pairwise_distances(
+    distance_fn: Callable, dists: np.ndarray, support: np.ndarray
+) -> np.ndarray:
+    """
+    Distance between the distributions of each pair of sets for each question (sets × sets ×
+    questions), computed in one call for all pairs. Distances are symmetric, so each unordered
+    pair is only computed once.
+
+    :param dists: distributions as returned by prepare_distribution_tensor.
+    """
+    n_sets, n_qnums, width = dists.shape
+    rows, columns = np.triu_indices(n_sets)
+    distances = distance_fn(
+        dists[rows].reshape(-1, width),
+        dists[columns].reshape(-1, width),
+        np.tile(support, (len(rows), 1)),
+    ).reshape(len(rows), n_qnums)
+    pairwise = np.empty((n_sets, n_sets, n_qnums))
+    pairwise[rows, columns] = distances
+    pairwise[columns, rows] = distances
+    return pairwise
+
+
+def calculate_pairwise_metric(
+    metric_fn: Callable,
+    responses: list[pd.DataFrame],
+    response_maps: dict[QNum, ResponseMap],
+    **kwargs
+) -> tuple[list[QNum], np.ndarray]:
+    """
+    A metric in DISTANCE_KERNELS between each pair of sets of responses, from the distributions
+    of each set computed once.
+
+    :returns: the questions and the distances (sets × sets × questions), nan for questions the
+        metric does not apply to or one of the sets does not have.
+    """
+    qnums, dists, support = prepare_distribution_tensor(
+        responses, response_maps, **kwargs
+    )
+    pairwise = np.full((len(responses), len(responses), len(qnums)), np.nan)
+    for distance_fn, get_qnum_subset in DISTANCE_KERNELS[metric_fn]:
+        is_subset = np.isin(qnums, get_qnum_subset())
+        pairwise[:, :, is_subset] = calculate_pairwise_distances(
+            distance_fn, dists[:, is_subset], support[is_subset]
+        )
+    return qnums, pairwise
+
+
+def bootstrap_metric(
+    metric_fn: Callable,
+    model_responses: pd.DataFrame,
+    true_responses: pd.DataFrame,
+    response_maps: dict[QNum, ResponseMap],
+    n_replicates: int = 1000,
+    confidence: float = 0.95,
+    rng: np.random.Generator = None,
+    max_nan_fraction: float = 0.01,
+    cache: DistributionCache = None,
+    cache_keys: list[CacheKey] = None,
+    **kwargs
+) -> pd.DataFrame:
+    """
+    Percentile bootstrap confidence interval of a metric in DISTANCE_KERNELS for each question,
+    resampling the respondents of both sets of responses independently, see
+    resample_histograms. The distances of all replicates are computed at once.
+
+    :param max_nan_fraction: largest fraction of replicates without a distance, e.g. without
+        valid responses, for which the interval of a question is computed from the others.
+        Questions with more, or without a distance themselves, have nan bounds.
+    :param cache: cache of the coded responses, keyed by cache_keys.
+    :returns: the lower and upper bound of each question the metric applies to, by question.
+    """
+    default_kwargs = dict(is_normalize=True, is_include_invalid=False)
+    kwargs = {**default_kwargs, **kwargs}
+    rng = rng or np.random.default_rng()
+    if cache is None:
+        model = encode_responses(model_responses, response_maps)
+        true = encode_responses(true_responses, response_maps)
+    else:
+        model, true = [
+            cache.get_tensor(key, df, response_maps)
+            for key, df in zip(cache_keys, [model_responses, true_responses])
+        ]
+    qnums = [qnum for qnum in model.qnums if qnum in set(true.qnums)]
+    model, true = model.select(qnums), true.select(qnums)
+    support = get_support(qnums, response_maps)
+
+    # replicates × questions × support, preceded by the distributions of the responses
+    model_dists, true_dists = [
+        histograms_to_distributions(
+            np.concatenate(
+                [
+                    get_histograms(tensor)[None],
+                    resample_histograms(tensor, n_replicates, rng),
+                ]
+            ),
+            tensor,
+            **kwargs
         )
-        distances[qnum] = metric_fn(model_weights, true_weights)
-    return distances
+        for tensor in [model, true]
+    ]
+    model_dists[:, np.isnan(support)] = 0
+    true_dists[:, np.isnan(support)] = 0
+
+    alpha = (1 - confidence) / 2
+    intervals = []
+    for distance_fn, get_qnum_subset in DISTANCE_KERNELS[metric_fn]:
+        is_subset = np.isin(qnums, get_qnum_subset())
+        width = support.shape[1]
+        distances = distance_fn(
+            model_dists[:, is_subset].reshape(-1, width),
+            true_dists[:, is_subset].reshape(-1, width),
+            np.tile(support[is_subset], (n_replicates + 1, 1)),
+        ).reshape(n_replicates + 1, -1)
+        point, distances = distances[0], distances[1:]
+        with warnings.catch_warnings():
+            # questions without valid responses have no distance in any replicate
+            warnings.simplefilter("ignore", RuntimeWarning)
+            bounds = np.nanquantile(distances, [alpha, 1 - alpha], axis=0)
+        is_valid = ~np.isnan(point)
+        is_valid &= np.isnan(distances).mean(axis=0) <= max_nan_fraction
+        bounds[:, ~is_valid] = np.nan
+        intervals.append(
+            pd.DataFrame(
+                bounds.T,
+                index=np.array(qnums)[is_subset],
+                columns=["lower", "upper"],
+            )
+        )
+    return pd.concat(intervals)
 
 
 def calculate_wasserstein(
@@ -95,60 +326,70 @@ def calculate_wasserstein(
     **kwargs
 ) -> dict[QNum, float]:
     """Calculate Wasserstein distance for all questions with an ordinal response scale."""
+    return _calculate_distance_metric(
+        wasserstein_distances,
+        ordinal_qnums(),
+        model_responses,
+        true_responses,
+        response_maps,
+        **kwargs
+    )
 
-    model_dists, true_dists = prepare_distributions(
-        model_responses, true_responses, response_maps, **kwargs
+
+def wasserstein_distances(
+    p: np.ndarray, q: np.ndarray, support: np.ndarray
+) -> np.ndarray:
+    """
+    1-D Wasserstein distance between each pair of rows of p and q, weights of the response keys
+    in support (questions × support, ascending and padded with nan), normalised by the diameter
+    of the support. Equivalent to scipy's wasserstein_distance and normalise_distance for each
+    question. Questions where either distribution has no weight are nan.
+    """
+    p_sums, q_sums = p.sum(axis=1), q.sum(axis=1)
+    is_valid = (p_sums > 0) & (q_sums > 0) & np.isfinite(p_sums) & np.isfinite(q_sums)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cdf_differences = np.cumsum(p / p_sums[:, None] - q / q_sums[:, None], axis=1)
+    # steps between consecutive keys, nan at and beyond the end of the support
+    steps = np.diff(support, axis=1)
+    distances = np.nansum(np.abs(cdf_differences[:, :-1]) * steps, axis=1)
+
+    diameters = np.nanmax(support, axis=1, initial=-np.inf) - np.nanmin(
+        support, axis=1, initial=np.inf
     )
-    qnums = (
-        set(true_dists.keys())
-        .intersection(model_dists.keys())
-        .intersection(ordinal_qnums())
+    distances = np.divide(
+        distances, diameters, out=np.zeros_like(distances), where=diameters > 0
     )
-    distances = {}
+    return np.where(is_valid, distances, np.nan)
 
-    for qnum in qnums:
-        try:
-            support, model_weights, true_weights = get_sorted_support_and_obs(
-                model_dists[qnum], true_dists[qnum]
-            )
-        except KeyError:
-            print(qnum)
-            support, model_weights, true_weights = get_sorted_support_and_obs(
-                model_dists[qnum], true_dists[qnum]
-            )
-        # todo: clean up
-        if _weights_are_invalid(model_weights, true_weights):
-            distances[qnum] = np.nan
-        else:
-            distance = wasserstein_distance(
-                support, support, u_weights=model_weights, v_weights=true_weights
-            )
-            distances[qnum] = normalise_distance(distance, support, 1)
-    return distances
-
-
-def _weights_are_invalid(model_weights, true_weights) -> bool:
-    """Check if weights are invalid for Wasserstein distance calculation."""
-    return (
-        len(model_weights) == 0
-        or len(true_weights) == 0
-        or not np.isfinite(model_weights).all()
-        or not np.isfinite(true_weights).all()
-        or np.sum(model_weights) <= 0
-        or np.sum(true_weights) <= 0
-    )
+
+def total_variation_distances(
+    p: np.ndarray, q: np.ndarray, support: np.ndarray = None
+) -> np.ndarray:
+    """
+    Total Variation distance between each pair of rows of p and q, probability vectors padded
+    with 0. Questions where either row does not sum to 1 are nan.
+    """
+    is_valid = np.isclose(p.sum(axis=1), 1) & np.isclose(q.sum(axis=1), 1)
+    return np.where(is_valid, 0.5 * np.abs(p - q).sum(axis=1), np.nan)
 
 
-def total_variation_distance(p: np.ndarray, q: np.ndarray) -> float:
-    """Compute Total Variation distance between two distributions.
-    Parameters
-    ----------
-    p, q : array_like
-        Probability vectors (must sum to 1).
+def jensen_shannon_distances(
+    p: np.ndarray, q: np.ndarray, support: np.ndarray = None
+) -> np.ndarray:
+    """
+    Jensen-Shannon distance (natural logarithm) between each pair of rows of p and q, weights
+    padded with 0 and normalised to sum to 1 as in scipy's jensenshannon. Questions where
+    either distribution has no weight are nan.
     """
-    if not np.isclose(p.sum(), 1) or not np.isclose(q.sum(), 1):
-        raise ValueError("Inputs must sum to 1.")
-    return 0.5 * np.abs(p - q).sum()
+    p_sums, q_sums = p.sum(axis=1, keepdims=True), q.sum(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p, q = p / p_sums, q / q_sums
+        m = (p + q) / 2
+        divergence = np.where(p > 0, p * np.log(p / m), 0) + np.where(
+            q > 0, q * np.log(q / m), 0
+        )
+    distances = np.sqrt(divergence.sum(axis=1) / 2)
+    return np.where((p_sums[:, 0] > 0) & (q_sums[:, 0] > 0), distances, np.nan)
 
 
 def calculate_misalignment(
@@ -157,11 +398,16 @@ def calculate_misalignment(
     response_maps: dict[QNum, ResponseMap],
     **kwargs
 ) -> dict[QNum, float]:
-    wasserstein = calculate_wasserstein(
+    """
+    Wasserstein distance for questions with an ordinal response scale and Total Variation
+    distance for the others, from the same distributions.
+    """
+    dists = prepare_aligned_distributions(
         model_responses, true_responses, response_maps, **kwargs
     )
-    total_variation = calculate_total_variation(
-        model_responses, true_responses, response_maps, **kwargs
+    wasserstein = apply_distance_metric(wasserstein_distances, ordinal_qnums(), *dists)
+    total_variation = apply_distance_metric(
+        total_variation_distances, non_ordinal_qnums(), *dists
     )
     return {**wasserstein, **total_variation}
 
@@ -197,28 +443,32 @@ def calculate_difference_in_means(
     return model_means - true_means
 
 
-def prepare_distributions(
-    model_responses: pd.DataFrame,
-    true_responses: pd.DataFrame,
+def prepare_distributions_single(
+    responses: pd.DataFrame,
     response_maps: dict[QNum, ResponseMap],
+    cache: DistributionCache = None,
+    cache_key: CacheKey = None,
     **kwargs
-) -> tuple:
-
-    model_dists = prepare_distributions_single(model_responses, response_maps, **kwargs)
-    true_dists = prepare_distributions_single(true_responses, response_maps, **kwargs)
-
-    return model_dists, true_dists
-
-
-def prepare_distributions_single(
-    responses: pd.DataFrame, response_maps: dict[QNum, ResponseMap], **kwargs
 ) -> dict[QNum, FrequencyDist]:
     """
     Prepare response distributions from responses DataFrame, using survey weights is present.
+
+    :param cache: cache of the distributions of the responses, keyed by cache_key.
     """
     default_kwargs = dict(is_normalize=True, is_include_invalid=False)
     kwargs = {**default_kwargs, **kwargs}
 
+    if cache is not None:
+        tensor, dists = cache.get_distributions(
+            cache_key, responses, response_maps, **kwargs
+        )
+        return to_frequency_dists(
+            dists,
+            tensor,
+            response_maps,
+            kwargs["is_normalize"],
+            kwargs["is_include_invalid"],
+        )
     if "weight" in responses.columns:
         dists = get_response_distribution_weighted(responses, response_maps, **kwargs)
     else:
@@ -227,13 +477,6 @@ def prepare_distributions_single(
     return dists
 
 
-def get_sorted_support_and_obs(a: FrequencyDist, b: FrequencyDist) -> tuple:
-    support = _get_support_from_dist(a)
-    weights_a = _get_weights_for_support(a, support)
-    weights_b = _get_weights_for_support(b, support)
-    return support, weights_a, weights_b
-
-
 def get_sorted_support_and_obs_single(a: FrequencyDist) -> tuple:
     support = _get_support_from_dist(a)
     weights_a = _get_weights_for_support(a, support)
@@ -283,3 +526,15 @@ def normalise_responses(
     responses -= mins
     responses /= diameter
     return responses
+
+
+# batched distance functions of each metric and the questions they apply to
+DISTANCE_KERNELS = {
+    calculate_misalignment: [
+        (wasserstein_distances, ordinal_qnums),
+        (total_variation_distances, non_ordinal_qnums),
+    ],
+    calculate_wasserstein: [(wasserstein_distances, ordinal_qnums)],
+    calculate_total_variation: [(total_variation_distances, non_ordinal_qnums)],
+    calculate_jensen_shannon: [(jensen_shannon_distances, non_ordinal_qnums)],
+}
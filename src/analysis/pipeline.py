@@ -0,0 +1,319 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from src.analysis import cleaning, invalid_responses
+from src.analysis.cleaning import (
+    count_grouped_items,
+    pipeline_clean_generated_responses,
+    remap_response_keys,
+)
+from src.analysis.invalid_responses import pipeline_identify_invalid_responses
+from src.analysis.schema import apply_results_schema
+from src.data.variables import QNum, ResponseMap
+
+ROW_COLUMN = "_row"
+PARTITION_COLUMN = "_partition"
+POSITION_COLUMN = "_position"
+_HASH_MULTIPLIER = np.uint64(1_000_003)
+# results are cleaned incrementally by run and question
+PARTITION_KEYS = ["model", "number"]
+# bump when the output of the clean stage changes in a way the source files do not capture
+CLEANING_PIPELINE_VERSION = 1
+PIPELINE_SOURCE_FILES = [cleaning.__file__, invalid_responses.__file__, __file__]
+
+Manifest = dict  # {"pipeline": hash, "partitions": {model: {number: {"hash", "numbers"}}}}
+
+
+def pipeline_clean_results(
+    results: pd.DataFrame,
+    responses: dict[QNum, ResponseMap],
+    flipped_responses: dict[QNum, ResponseMap],
+    n_workers: int = 1,
+    chunk_size: int = 100_000,
+    copy: bool = True,
+) -> pd.DataFrame:
+    """
+    The clean stage: clean responses, identify invalid ones and remap response keys to the
+    original scale.
+
+    :param copy: if False, the stages modify results instead of a copy of it, so results must
+        not be used afterwards.
+    """
+    results = pipeline_clean_and_identify_invalid(
+        results, responses, flipped_responses, n_workers, chunk_size, copy
+    )
+    results = remap_response_keys(results, "final_response")
+    return apply_results_schema(results, copy=False)
+
+
+def pipeline_clean_results_incremental(
+    results: pd.DataFrame,
+    responses: dict[QNum, ResponseMap],
+    flipped_responses: dict[QNum, ResponseMap],
+    previous: pd.DataFrame = None,
+    manifest: Manifest = None,
+    n_workers: int = 1,
+    chunk_size: int = 100_000,
+    copy: bool = True,
+) -> tuple[pd.DataFrame, Manifest]:
+    """
+    The clean stage, only for partitions (runs and questions) of the results that are new or
+    changed since previous was cleaned, as recorded by its manifest. Rows of unchanged partitions
+    are taken from previous, rows of partitions no longer in the results are dropped. The output
+    is in the same order as pipeline_clean_results of all results.
+
+    :param copy: if False and all partitions are new, the stages modify results instead of a
+        copy of it, so results must not be used afterwards.
+    :returns: the clean results and their manifest.
+    """
+    pipeline_hash = get_pipeline_hash(responses, flipped_responses)
+    if results.empty:
+        clean = pipeline_clean_results(
+            results, responses, flipped_responses, n_workers, chunk_size, copy
+        )
+        return clean, {"pipeline": pipeline_hash, "partitions": {}}
+
+    codes, keys, hashes = get_partition_hashes(results)
+    if previous is None or manifest is None or manifest["pipeline"] != pipeline_hash:
+        manifest = {"partitions": {}}
+    cleaned = {
+        (model, number): partition
+        for model, partitions in manifest["partitions"].items()
+        for number, partition in partitions.items()
+    }
+    is_new = np.array([cleaned.get(k, {}).get("hash") != h for k, h in zip(keys, hashes)])
+
+    kept = []
+    if previous is not None and not is_new.all():
+        df = _take_kept_partitions(results, codes, keys, is_new, cleaned, previous)
+        if df is None:
+            # the previous clean results do not match their manifest
+            is_new[:] = True
+        else:
+            kept.append(df)
+
+    new, numbers = [], {}
+    if is_new.any():
+        is_new_row = is_new[codes]
+        if is_new.all() and not copy:
+            df = results
+        else:
+            df = results.take(np.flatnonzero(is_new_row))
+        # the rows to clean are copied once, the stages then modify them in place
+        df[PARTITION_COLUMN] = codes[is_new_row]
+        df[POSITION_COLUMN] = np.flatnonzero(is_new_row)
+        df = pipeline_clean_results(
+            df, responses, flipped_responses, n_workers, chunk_size, copy=False
+        )
+        numbers = df.groupby(PARTITION_COLUMN)["number"].unique().to_dict()
+        new.append(df)
+
+    frames = kept + new
+    clean = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    # rows in the order of the results, with the items of a grouped prompt in place
+    position = clean[POSITION_COLUMN].to_numpy()
+    if (np.diff(position) < 0).any():
+        clean = clean.take(np.argsort(position, kind="stable"))
+    clean.index = pd.RangeIndex(len(clean))
+    del clean[PARTITION_COLUMN]
+    del clean[POSITION_COLUMN]
+    clean = apply_results_schema(clean, copy=False)
+
+    partitions = {}
+    for code, (k, h) in enumerate(zip(keys, hashes)):
+        n = numbers[code] if is_new[code] else cleaned[k]["numbers"]
+        partitions.setdefault(k[0], {})[k[1]] = {
+            "hash": h,
+            "numbers": [str(number) for number in n],
+        }
+    return clean, {"pipeline": pipeline_hash, "partitions": partitions}
+
+
+def _take_kept_partitions(
+    results: pd.DataFrame,
+    codes: np.ndarray,
+    keys: list[tuple[str, QNum]],
+    is_new: np.ndarray,
+    cleaned: dict,
+    previous: pd.DataFrame,
+) -> pd.DataFrame | None:
+    """
+    Rows of previous of the partitions that are not new, with the partition code and the
+    position in results of the row each was cleaned from. None if the number of rows of a
+    partition does not match the rows it was cleaned from.
+    """
+    # clean rows of grouped questions are keyed by item, not by the number of the battery
+    to_partition = {
+        (k[0], number): code
+        for code, k in enumerate(keys)
+        if not is_new[code]
+        for number in cleaned[k]["numbers"]
+    }
+    partition = np.full(len(previous), -1)
+    groups = previous.groupby(PARTITION_KEYS, observed=True, sort=False).indices
+    for k, positions in groups.items():
+        partition[positions] = to_partition.get(k, -1)
+    is_kept = partition >= 0
+
+    # rows of a partition keep their order when cleaned, so the rows of each kept
+    # partition in results map in order onto its rows in previous, expanded into items
+    rows = np.flatnonzero(~is_new[codes])
+    rows = rows[np.argsort(codes[rows], kind="stable")]
+    n_items = count_grouped_items(results.iloc[rows])
+    kept_rows = np.flatnonzero(is_kept)
+    kept_rows = kept_rows[np.argsort(partition[kept_rows], kind="stable")]
+    expected = np.bincount(codes[rows], weights=n_items, minlength=len(keys))
+    actual = np.bincount(partition[kept_rows], minlength=len(keys))
+    if (expected != actual).any():
+        return None
+    positions = np.repeat(rows, n_items)
+
+    df = previous.take(kept_rows)
+    df[PARTITION_COLUMN] = partition[kept_rows]
+    df[POSITION_COLUMN] = positions
+    return df
+
+
+def get_partition_hashes(
+    results: pd.DataFrame,
+) -> tuple[np.ndarray, list[tuple[str, QNum]], list[str]]:
+    """
+    Content hash of the rows of each partition of the results.
+
+    :returns: partition code of each row, and the key and hash of each partition, in order of
+        first appearance.
+    """
+    codes = (
+        results.groupby(PARTITION_KEYS, observed=True, sort=False).ngroup().to_numpy()
+    )
+    first = np.unique(codes, return_index=True)[1]
+    keys = [tuple(map(str, k)) for k in results[PARTITION_KEYS].iloc[first].to_numpy()]
+
+    # hashed one column at a time, so that the results are never copied as a whole
+    row_hashes = np.zeros(len(results), dtype=np.uint64)
+    for column in results.columns:
+        values = results[column]
+        if values.dtype == object:
+            # object columns may hold unhashable run metadata, e.g. hyperparams
+            values = values.astype(str).to_numpy(dtype=object)
+            column_hashes = pd.util.hash_array(values)
+        else:
+            column_hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+        row_hashes = row_hashes * _HASH_MULTIPLIER ^ column_hashes
+    order = np.argsort(codes, kind="stable")
+    bounds = np.cumsum(np.bincount(codes))[:-1]
+    hashes = [
+        hashlib.sha256(row_hashes[positions].tobytes()).hexdigest()
+        for positions in np.split(order, bounds)
+    ]
+    return codes, keys, hashes
+
+
+def get_pipeline_hash(
+    responses: dict[QNum, ResponseMap], flipped_responses: dict[QNum, ResponseMap]
+) -> str:
+    sha = hashlib.sha256(f"{CLEANING_PIPELINE_VERSION}".encode())
+    for path in PIPELINE_SOURCE_FILES:
+        with open(path, "rb") as f:
+            sha.update(f.read())
+    sha.update(json.dumps([responses, flipped_responses], sort_keys=True).encode())
+    return sha.hexdigest()
+
+
+def get_manifest_path(directory: str, experiment_name: str) -> str:
+    return os.path.join(directory, f"{experiment_name}-clean-manifest.json")
+
+
+def load_manifest(path: str) -> Manifest | None:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: Manifest, path: str):
+    with open(path, "w") as f:
+        json.dump(manifest, f)
+
+
+def pipeline_clean_and_identify_invalid(
+    results: pd.DataFrame,
+    responses: dict[QNum, ResponseMap],
+    flipped_responses: dict[QNum, ResponseMap],
+    n_workers: int = 1,
+    chunk_size: int = 100_000,
+    copy: bool = True,
+) -> pd.DataFrame:
+    """
+    Clean responses and identify invalid ones, in chunks of whole questions processed in parallel.
+    Chunks are concatenated in the original row order, so the output does not depend on the
+    number of workers or the chunk size.
+
+    :param n_workers: number of processes, all cores if None; 1 processes the results in one go.
+    :param chunk_size: maximum number of rows per chunk, unless a single question has more.
+    :param copy: if False, the stages modify results instead of a copy of it, so results must
+        not be used afterwards.
+    """
+    process = partial(
+        _clean_and_identify_invalid,
+        responses=responses,
+        flipped_responses=flipped_responses,
+    )
+    if copy:
+        results = results.copy()
+    results.index = pd.RangeIndex(len(results))
+    n_workers = n_workers or os.cpu_count()
+    if n_workers <= 1:
+        return process(results)
+
+    results[ROW_COLUMN] = np.arange(len(results))
+    chunks = [results.iloc[rows] for rows in split_by_question(results, chunk_size)]
+    del results
+    with ProcessPoolExecutor(max_workers=min(n_workers, len(chunks))) as executor:
+        processed = list(executor.map(process, chunks))
+    del chunks
+
+    results = pd.concat(processed, ignore_index=True)
+    del processed
+    results = results.take(np.argsort(results[ROW_COLUMN].to_numpy(), kind="stable"))
+    results.index = pd.RangeIndex(len(results))
+    del results[ROW_COLUMN]
+    return results
+
+
+def split_by_question(results: pd.DataFrame, chunk_size: int) -> list[np.ndarray]:
+    """
+    Positions of the rows in each chunk. Questions are never split across chunks, so that
+    patterns built per question and deduplication stay within a chunk.
+    """
+    codes, _ = pd.factorize(results["number"])
+    order = np.argsort(codes, kind="stable")
+    sizes = np.bincount(codes)
+
+    chunks, current, n_rows = [], [], 0
+    start = 0
+    for size in sizes:
+        if current and n_rows + size > chunk_size:
+            chunks.append(np.concatenate(current))
+            current, n_rows = [], 0
+        current.append(order[start : start + size])
+        n_rows += size
+        start += size
+    if current:
+        chunks.append(np.concatenate(current))
+    return chunks
+
+
+def _clean_and_identify_invalid(
+    results: pd.DataFrame,
+    responses: dict[QNum, ResponseMap],
+    flipped_responses: dict[QNum, ResponseMap],
+) -> pd.DataFrame:
+    results = pipeline_clean_generated_responses(results)
+    return pipeline_identify_invalid_responses(results, responses, flipped_responses)
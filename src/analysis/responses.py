@@ -1,5 +1,11 @@
+import numpy as np
 import pandas as pd
 
+from src.analysis.tensors import (
+    ResponseTensor,
+    encode_responses,
+    get_distributions,
+)
 from src.data.variables import QNum, ResponseMap, ordinal_qnums
 from src.demographics.base import BaseSubGroup
 
@@ -36,7 +42,7 @@ def get_model_responses_for_subgroup(
 
 def get_base_model_responses(df_sim: pd.DataFrame, qnums: list[QNum]) -> pd.DataFrame:
     df = df_sim.loc[df_sim["number"].isin(qnums), ["number", "final_response"]].copy()
-    df["idx"] = df.groupby("number").cumcount()
+    df["idx"] = df.groupby("number", observed=True).cumcount()
 
     out = df.pivot(
         index="idx",
@@ -79,23 +85,13 @@ def get_response_distribution(
     is_normalize: bool = True,
     is_include_invalid: bool = False,
 ) -> dict[QNum, FrequencyDist]:
-
-    dists = {}
-    for qnum in set(responses.columns).intersection(response_maps.keys()):
-        observations = responses[qnum]
-        support = list(response_maps[qnum].keys())
-
-        if not is_include_invalid:
-            support = [x for x in support if x > -1]
-            observations = observations[observations > -1]
-
-        counts = observations.value_counts(normalize=is_normalize, sort=False)
-        counts = counts.reindex(support, fill_value=0)
-        dists[qnum] = {
-            int(k): float(v) if is_normalize else int(v) for k, v in counts.items()
-        }
-
-    return dists
+    tensor = encode_responses(responses, response_maps)
+    dists = get_distributions(
+        tensor, is_normalize, is_include_invalid, is_weighted=False
+    )
+    return to_frequency_dists(
+        dists, tensor, response_maps, is_normalize, is_include_invalid
+    )
 
 
 def get_response_distribution_weighted(
@@ -104,38 +100,38 @@ def get_response_distribution_weighted(
     is_normalize: bool = True,
     is_include_invalid: bool = False,
 ) -> dict[QNum, FrequencyDist]:
-
-    dists = {}
-    weights = responses["weight"]
-    for qnum in set(responses.columns).intersection(response_maps.keys()) - {"weight"}:
-        observations = responses[qnum]
-        support = list(response_maps[qnum].keys())
-
-        if not is_include_invalid:
-            support = [x for x in support if x > -1]
-            mask = observations > -1
-            observations = observations[mask]
-            weights = weights[mask]
-
-        # counts = observations.value_counts(normalize=is_normalize, sort=False)
-        counts = get_weighted_value_counts(observations, weights, is_normalize)
-        counts = counts.reindex(support, fill_value=0)
-        dists[qnum] = {
-            int(k): float(v) if is_normalize else int(v) for k, v in counts.items()
-        }
-
-    return dists
+    tensor = encode_responses(responses, response_maps)
+    if tensor.weights is None:
+        raise KeyError("weight")
+    dists = get_distributions(
+        tensor, is_normalize, is_include_invalid, is_weighted=True
+    )
+    return to_frequency_dists(
+        dists, tensor, response_maps, is_normalize, is_include_invalid
+    )
 
 
-def get_weighted_value_counts(
-    observations: pd.Series, weights: pd.Series, is_normalize: bool
-) -> pd.Series:
-    counts = (
-        pd.DataFrame({"resp": observations, "w": weights}).groupby("resp")["w"].sum()
-    )
-    if is_normalize:
-        counts = counts / counts.sum()
-    return counts
+def to_frequency_dists(
+    dists: np.ndarray,
+    tensor: ResponseTensor,
+    response_maps: dict[QNum, ResponseMap],
+    is_normalize: bool = True,
+    is_include_invalid: bool = False,
+) -> dict[QNum, FrequencyDist]:
+    """
+    Dict view of the distributions of get_distributions, keyed by question and response key in
+    the order of the response maps.
+    """
+    frequency_dists = {}
+    for i, qnum in enumerate(tensor.qnums):
+        keys = tensor.keys[i, : tensor.support_sizes[i]].astype(int).tolist()
+        support = dict(zip(keys, dists[i].tolist()))
+        frequency_dists[qnum] = {
+            k: float(support[k]) if is_normalize else int(support[k])
+            for k in response_maps[qnum]
+            if is_include_invalid or k > -1
+        }
+    return frequency_dists
 
 
 def remove_weight_col(qnums: list[str]) -> list[str]:
@@ -1,22 +1,68 @@
 import glob
 import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable, Iterator
 
+import ijson
+import numpy as np
 import pandas as pd
 
+from src.data.variables import first_qnum, is_group_key
 from src.demographics.config import dimensions
 from src.simulation.models import ModelName, adapters
 
 
 def load_survey_results_batch(
-    files_folder: str, directory: str
+    files_folder: str, directory: str, n_workers: int = 1
 ) -> list[dict[str, dict]]:
-    results = []
-    folder_path = os.path.join(directory, files_folder)
-    for path in glob.glob(os.path.join(folder_path, "*.json")):
-        with open(path) as f:
-            results.append(json.load(f))
-    return results
+    """
+    Load all results files (shards) in a folder, in order of file name.
+
+    :param n_workers: number of processes parsing shards concurrently, all cores if None; 1
+        parses them in this process.
+    """
+    paths = get_results_shard_paths(files_folder, directory)
+    return _map_shards(_load_json, paths, n_workers)
+
+
+def get_results_shard_paths(files_folder: str, directory: str) -> list[str]:
+    return sorted(glob.glob(os.path.join(directory, files_folder, "*.json")))
+
+
+def load_survey_results_df_batch(
+    files_folder: str, directory: str, variables: pd.DataFrame, n_workers: int = 1
+) -> pd.DataFrame:
+    """
+    Parse and convert all results files in a folder with survey_results_to_df in parallel.
+    Only the DataFrames are sent back from the workers, and they are concatenated in order
+    of file name, so the result does not depend on the number of workers.
+
+    :param n_workers: number of processes, all cores if None; 1 converts the shards in this
+        process.
+    """
+    paths = get_results_shard_paths(files_folder, directory)
+    convert = partial(_load_json_as_df, variables=variables)
+    dfs = _map_shards(convert, paths, n_workers)
+    return pd.concat(dfs).reset_index(drop=True) if dfs else pd.DataFrame()
+
+
+def _map_shards(fn: Callable, paths: list[str], n_workers: int | None) -> list:
+    n_workers = min(n_workers or os.cpu_count(), len(paths))
+    if n_workers <= 1:
+        return [fn(path) for path in paths]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(fn, paths))
+
+
+def _load_json(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def _load_json_as_df(path: str, variables: pd.DataFrame) -> pd.DataFrame:
+    return survey_results_to_df(_load_json(path), variables)
 
 
 def load_survey_results(file_name: str, directory: str) -> dict[str, dict]:
@@ -25,6 +71,86 @@ def load_survey_results(file_name: str, directory: str) -> dict[str, dict]:
         return json.load(f)
 
 
+# sections of a run with one list per question and sample, streamed instead of loaded
+STREAMED_SECTIONS = ["responses", "is_scale_flipped"]
+_OPENING_EVENTS = ("start_map", "start_array", "map_key")
+
+
+def load_survey_results_context(path: str) -> dict[str, dict]:
+    """
+    Load everything in a results file except the responses, i.e. the metadata, prompts and choices
+    of each run, by parsing the file incrementally. Memory scales with the survey, not the samples.
+    """
+    context = {}
+    builder, section_prefix = None, None
+    with open(path, "rb") as f:
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if builder is not None:
+                builder.event(event, value)
+                if prefix == section_prefix and event not in _OPENING_EVENTS:
+                    run, section = section_prefix.split(".")
+                    context[run][section] = builder.value
+                    builder = None
+            elif event == "map_key" and prefix and "." not in prefix:
+                context.setdefault(prefix, {})
+                if value not in STREAMED_SECTIONS:
+                    builder, section_prefix = ijson.ObjectBuilder(), f"{prefix}.{value}"
+    return context
+
+
+def iter_survey_results_df(
+    path: str,
+    variables: pd.DataFrame,
+    context: dict[str, dict] = None,
+    chunk_size: int = 100_000,
+) -> Iterator[pd.DataFrame]:
+    """
+    Stream a results file as DataFrames of roughly chunk_size rows (whole questions), with the same
+    columns as survey_results_to_df. Only one chunk of responses is held in memory at a time.
+
+    :param context: output of load_survey_results_context, loaded from path if not given.
+    """
+    context = context or load_survey_results_context(path)
+    responses = _iter_streamed_lists(path, "responses")
+    flags = _iter_streamed_lists(path, "is_scale_flipped")
+
+    chunk, n_rows = {}, 0
+    for (run, num, run_responses), (flag_run, flag_num, is_flipped) in zip(
+        responses, flags
+    ):
+        if (run, num) != (flag_run, flag_num):
+            raise ValueError(
+                f"Responses and is_scale_flipped are not in the same order in {path}"
+            )
+        if run not in chunk:
+            chunk[run] = {**context[run], "responses": {}, "is_scale_flipped": {}}
+        chunk[run]["responses"][num] = run_responses
+        chunk[run]["is_scale_flipped"][num] = is_flipped
+        n_rows += len(run_responses)
+        if n_rows >= chunk_size:
+            yield survey_results_to_df(chunk, variables)
+            chunk, n_rows = {}, 0
+    if chunk:
+        yield survey_results_to_df(chunk, variables)
+
+
+def _iter_streamed_lists(path: str, section: str) -> Iterator[tuple[str, str, list]]:
+    """Yields (run, number, values) for every list in the given section of each run."""
+    values, list_prefix = None, None
+    with open(path, "rb") as f:
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if values is not None:
+                if prefix == list_prefix and event == "end_array":
+                    run, _, num = list_prefix.split(".")
+                    yield run, num, values
+                    values = None
+                else:
+                    values.append(value)
+            elif event == "start_array" and prefix.count(".") == 2:
+                if prefix.split(".")[1] == section:
+                    values, list_prefix = [], prefix
+
+
 def load_data_dict(
     filename: str,
     root_directory: str,
@@ -64,29 +190,88 @@ def survey_results_to_df_batch(
 
 
 def survey_results_to_df(
-    survey_results: dict[str, dict], variables: pd.DataFrame
+    survey_results: dict[str, dict],
+    variables: pd.DataFrame,
+    is_metadata_joined: bool = True,
 ) -> pd.DataFrame:
-    rows = []
-    for model, results in survey_results.items():
-        for num, responses in results["responses"].items():
-            variable = variables[variables["number"] == num]
-            for response, is_flipped in zip(
-                responses, results["is_scale_flipped"][num]
-            ):
-                suffix = "_flipped" if is_flipped else ""
-                row = {
-                    "model": model,
-                    "number": num,
-                    "group": variable["group"].item(),
-                    "subtopic": variable["subtopic"].item(),
-                    "question": results[f"questions{suffix}"][num],
-                    "choices": results[f"choices{suffix}"][num],
-                    "response": response,
-                    "is_scale_flipped": is_flipped,
-                    **results["metadata"],
-                }
-                rows.append(row)
-    return pd.DataFrame(rows)
+    """
+    One row per simulated response. Columns are built per run with repeat/take on arrays instead of
+    a dict per row, and the metadata of each run is joined from the runs table at the end.
+
+    :param is_metadata_joined: if False only the model column links rows to survey_results_to_runs.
+    """
+    variables = variables.drop_duplicates("number").set_index("number")
+    columns = [
+        _run_to_columns(model, results, variables)
+        for model, results in survey_results.items()
+    ]
+    columns = [c for c in columns if len(c["model"])]
+    if not columns:
+        return pd.DataFrame()
+    df = pd.DataFrame(
+        {k: np.concatenate([c[k] for c in columns]) for k in columns[0]}
+    )
+    if not is_metadata_joined:
+        return df
+    runs = survey_results_to_runs(survey_results)
+    metadata = runs.iloc[runs.index.get_indexer(df["model"])].reset_index(drop=True)
+    return pd.concat([df, metadata], axis=1)
+
+
+def survey_results_to_runs(survey_results: dict[str, dict]) -> pd.DataFrame:
+    """Metadata of each run, indexed by run name."""
+    return pd.DataFrame(
+        [results["metadata"] for results in survey_results.values()],
+        index=pd.Index(list(survey_results), name="model"),
+    )
+
+
+def _run_to_columns(
+    model: str, results: dict, variables: pd.DataFrame
+) -> dict[str, np.ndarray]:
+    nums = list(results["responses"])
+    responses, is_flipped, lengths = [], [], []
+    for num in nums:
+        pairs = list(zip(results["responses"][num], results["is_scale_flipped"][num]))
+        responses.extend(r for r, _ in pairs)
+        is_flipped.extend(f for _, f in pairs)
+        lengths.append(len(pairs))
+
+    idx = np.repeat(np.arange(len(nums)), lengths)
+    is_flipped = np.array(is_flipped, dtype=bool)
+    variable = variables.loc[[first_qnum(num) for num in nums]]
+    subtopics = [
+        None if is_group_key(num) else s for num, s in zip(nums, variable["subtopic"])
+    ]
+
+    def take(values: list) -> np.ndarray:
+        return _to_object_array(values)[idx]
+
+    def take_by_order(key: str) -> np.ndarray:
+        values = take([results[key][num] for num in nums])
+        if is_flipped.any():
+            flipped = take([results[f"{key}_flipped"][num] for num in nums])
+            values[is_flipped] = flipped[is_flipped]
+        return values
+
+    return {
+        "model": np.full(len(idx), model, dtype=object),
+        "number": take(nums),
+        "group": take(list(variable["group"])),
+        "subtopic": take(subtopics),
+        "question": take_by_order("questions"),
+        "choices": take_by_order("choices"),
+        "response": _to_object_array(responses),
+        "is_scale_flipped": is_flipped,
+    }
+
+
+def _to_object_array(values: list) -> np.ndarray:
+    # assigned element-wise so that lists (e.g. choices) are kept as single objects
+    array = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        array[i] = v
+    return array
 
 
 def get_nth_newest_file(n: int, directory: str):
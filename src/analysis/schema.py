@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+# low-cardinality columns of the results: runs, questions, prompts and run metadata
+CATEGORICAL_COLUMNS = [
+    "model",
+    "number",
+    "group",
+    "subtopic",
+    "question",
+    "choices",
+    "run_id",
+    "base_model_name",
+    "subgroup",
+    "device",
+    "aggregation_by",
+    "decoding_style",
+    "system_prompt",
+    "reason_invalid",
+]
+# response keys are small integers, nullable as responses may not contain a key
+INTEGER_COLUMNS = {"response_key": "Int16", "final_response": "Int16"}
+
+
+def apply_results_schema(df: pd.DataFrame, copy: bool = True) -> pd.DataFrame:
+    """
+    Assign compact dtypes to the columns of the results that are present: categoricals for
+    repeated strings and nullable small integers for response keys. Columns that already have
+    the dtype are left as they are, so this can be applied again after every pipeline stage.
+    Choices are stored as the string of the list, as in the CSV results.
+
+    :param copy: if False, the columns of df are replaced instead of those of a copy.
+    """
+    if copy:
+        df = df.copy()
+    for column in CATEGORICAL_COLUMNS:
+        if column not in df.columns or isinstance(df[column].dtype, pd.CategoricalDtype):
+            continue
+        if column == "choices":
+            df[column] = df[column].map(_choices_to_str)
+        df[column] = df[column].astype("category")
+    for column, dtype in INTEGER_COLUMNS.items():
+        if column in df.columns and df[column].dtype != dtype:
+            df[column] = pd.to_numeric(df[column]).astype(dtype)
+    return df
+
+
+def report_memory_usage(df: pd.DataFrame, stage: str) -> float:
+    """Print and return the memory used by the DataFrame in MB, including string contents."""
+    mb = df.memory_usage(deep=True).sum() / 2**20
+    print(f"{stage}: {len(df)} rows, {mb:.1f} MB")
+    return mb
+
+
+def _choices_to_str(choices) -> str:
+    if isinstance(choices, (list, tuple, np.ndarray)):
+        return str([str(c) for c in choices])
+    return choices
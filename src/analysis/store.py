@@ -0,0 +1,154 @@
+import os
+import shutil
+from typing import Iterable
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src.analysis.schema import apply_results_schema
+
+# run_name; see write_results_store for why questions are not a partition level by default
+PARTITION_COLUMNS = ["model"]
+# columns of survey_results_to_df before the metadata of each run
+RESPONSE_FIELDS = [
+    pa.field("model", pa.string()),
+    pa.field("number", pa.string()),
+    pa.field("group", pa.string()),
+    pa.field("subtopic", pa.string()),
+    pa.field("question", pa.string()),
+    pa.field("choices", pa.list_(pa.string())),
+    pa.field("response", pa.string()),
+    pa.field("is_scale_flipped", pa.bool_()),
+]
+
+
+def get_store_path(directory: str, experiment_name: str, stage: str) -> str:
+    """Path of the results of a stage of the evaluation, e.g. 'results' or 'clean'."""
+    return os.path.join(directory, f"{experiment_name}-{stage}.parquet")
+
+
+def write_results_store(
+    df: pd.DataFrame, path: str, partition_columns: list[str] = None
+) -> None:
+    """
+    Write results as a Parquet dataset partitioned by run (hive-style, e.g. model=phi-instruct-.../),
+    replacing any existing dataset at path. String columns are dictionary encoded, so prompts and
+    choices repeated on every row are stored once per row group, and the index is kept.
+    Partitioning additionally by number is possible, but yields thousands of files of a few KB.
+    """
+    partition_columns = partition_columns or PARTITION_COLUMNS
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    pq.write_to_dataset(
+        table,
+        path,
+        partition_cols=partition_columns,
+        use_dictionary=True,
+        compression="zstd",
+        existing_data_behavior="delete_matching",
+    )
+
+
+def write_results_store_chunks(
+    chunks: Iterable[pd.DataFrame],
+    path: str,
+    schema: pa.Schema,
+    partition_columns: list[str] = None,
+) -> int:
+    """
+    Write results to a Parquet dataset one chunk at a time, e.g. from iter_survey_results_df,
+    replacing any existing dataset at path. Chunks are cast to a fixed schema, as a single chunk
+    may not contain every column or may only contain nulls, and indexed consecutively.
+
+    :returns: number of rows written.
+    """
+    partition_columns = partition_columns or PARTITION_COLUMNS
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    n_rows = 0
+    for i, chunk in enumerate(chunks):
+        chunk = chunk.reindex(columns=schema.names)
+        chunk.index = pd.RangeIndex(n_rows, n_rows + len(chunk))
+        n_rows += len(chunk)
+        table = pa.Table.from_pandas(chunk, preserve_index=True)
+        index_fields = [table.schema.field(n) for n in table.schema.names[len(schema) :]]
+        table = table.cast(
+            pa.schema(list(schema) + index_fields, metadata=table.schema.metadata)
+        )
+        pq.write_to_dataset(
+            table,
+            path,
+            partition_cols=partition_columns,
+            use_dictionary=True,
+            compression="zstd",
+            basename_template=f"part-{i}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+    return n_rows
+
+
+def get_results_schema(runs: pd.DataFrame) -> pa.Schema:
+    """Schema of survey_results_to_df for the runs table of survey_results_to_runs."""
+    names = [f.name for f in RESPONSE_FIELDS]
+    metadata = pa.Schema.from_pandas(runs, preserve_index=False)
+    return pa.schema(RESPONSE_FIELDS + [f for f in metadata if f.name not in names])
+
+
+def read_results_store(
+    path: str, columns: list[str] = None, filters: list[tuple] = None
+) -> pd.DataFrame:
+    """
+    Read results from a Parquet dataset in their original row order.
+
+    :param columns: only read these columns (projection), all by default.
+    :param filters: row filters pushed down to the partitions/row groups, e.g. [("model", "in", runs)].
+    """
+    table = pq.read_table(
+        path,
+        columns=columns,
+        filters=filters,
+        partitioning="hive",
+        use_pandas_metadata=True,
+    )
+    # partition columns are read back as dictionaries, i.e. categoricals
+    schema = pa.schema(
+        [
+            f.with_type(f.type.value_type) if pa.types.is_dictionary(f.type) else f
+            for f in table.schema
+        ],
+        metadata=table.schema.metadata,
+    )
+    df = table.cast(schema).to_pandas()
+    # partition columns are appended last, restore the order the columns were written in
+    order = columns or [c["name"] for c in table.schema.pandas_metadata["columns"]]
+    df = df[[c for c in order if c in df.columns]]
+    return df.sort_index(kind="stable")
+
+
+def read_results_columns(path: str) -> list[str]:
+    return ds.dataset(path, partitioning="hive").schema.names
+
+
+def load_results(
+    directory: str, experiment_name: str, stage: str, columns: list[str] = None
+) -> pd.DataFrame:
+    """
+    Load the results of a stage from the Parquet store, falling back to the CSV written by
+    earlier versions of the evaluation scripts, with the compact dtypes of apply_results_schema.
+
+    :param columns: only load these columns if present, all by default.
+    """
+    path = get_store_path(directory, experiment_name, stage)
+    if os.path.exists(path):
+        if columns:
+            columns = [c for c in columns if c in read_results_columns(path)]
+        df = read_results_store(path, columns)
+    else:
+        df = pd.read_csv(
+            os.path.join(directory, f"{experiment_name}-{stage}.csv"), index_col=0
+        )
+        df = df[[c for c in columns if c in df.columns]] if columns else df
+    return apply_results_schema(df, copy=False)
@@ -0,0 +1,274 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from src.data.variables import QNum, ResponseMap
+from src.simulation.models import AdapterName, ModelName
+
+MISSING_CODE = -1
+# codes are stored as int8
+MAX_BINS = np.iinfo(np.int8).max + 1
+
+
+@dataclass
+class ResponseTensor:
+    """
+    Responses of one source (a model or the survey) to a set of questions, coded as integers so
+    that metrics can be computed for all questions at once.
+
+    The bins of each question are the keys of its response map in ascending order (its support),
+    followed by any other keys observed in the responses in ascending order, so that the support
+    of a question is aligned across tensors.
+    """
+
+    codes: np.ndarray  # int8, observations × questions: bin of each response or MISSING_CODE
+    qnums: list[QNum]
+    keys: np.ndarray  # float, questions × bins: key of each bin, padded with nan
+    support_sizes: np.ndarray  # int, questions: number of bins in the response map
+    weights: np.ndarray | None = None  # survey weight of each observation
+
+    @property
+    def n_bins(self) -> np.ndarray:
+        return (~np.isnan(self.keys)).sum(axis=1)
+
+    def select(self, qnums: list[QNum]) -> "ResponseTensor":
+        """The tensor of a subset of the questions, in the given order."""
+        position = {qnum: i for i, qnum in enumerate(self.qnums)}
+        columns = [position[qnum] for qnum in qnums]
+        return ResponseTensor(
+            codes=self.codes[:, columns],
+            qnums=list(qnums),
+            keys=self.keys[columns],
+            support_sizes=self.support_sizes[columns],
+            weights=self.weights,
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        The response keys as a DataFrame of observations × questions, with missing responses as
+        nan and a weight column if weighted, i.e. the inverse of encode_responses.
+        """
+        codes = self.codes.astype(np.intp)
+        keys = np.take_along_axis(
+            self.keys.T, np.where(codes == MISSING_CODE, 0, codes), axis=0
+        )
+        keys[codes == MISSING_CODE] = np.nan
+        df = pd.DataFrame(keys, columns=self.qnums)
+        if self.weights is not None:
+            df["weight"] = self.weights
+        return df
+
+
+TensorDict = dict[AdapterName, dict[ModelName, ResponseTensor]]  # as DataDict
+CacheKey = tuple[str, AdapterName, ModelName]  # grouping, subgroup and model
+
+
+def encode_responses(
+    responses: pd.DataFrame, response_maps: dict[QNum, ResponseMap]
+) -> ResponseTensor:
+    """
+    Code the responses (observations × questions, with an optional weight column) to the
+    questions that have a response map.
+    """
+    qnums = [c for c in responses.columns if c in response_maps and c != "weight"]
+    values = responses[qnums].to_numpy(dtype=float, na_value=np.nan)
+    supports = [np.array(sorted(response_maps[qnum]), dtype=float) for qnum in qnums]
+    support_sizes = np.array([len(support) for support in supports], dtype=int)
+
+    # position of each response among all listed or observed keys, after them if missing
+    value_codes, observed = pd.factorize(values.ravel())
+    all_keys = np.unique(np.concatenate([observed, *supports]))
+    positions = np.append(np.searchsorted(all_keys, observed), len(all_keys))
+    positions = positions[value_codes].reshape(values.shape)
+
+    # bin of each question and key: listed keys first, then the other observed keys
+    shape = (len(qnums), len(all_keys) + 1)
+    is_listed = np.zeros(shape, dtype=bool)
+    listed_bins = np.zeros(shape, dtype=int)
+    for i, support in enumerate(supports):
+        support_positions = np.searchsorted(all_keys, support)
+        is_listed[i, support_positions] = True
+        listed_bins[i, support_positions] = np.arange(len(support))
+    offsets = np.arange(len(qnums)) * shape[1]
+    is_present = np.bincount(
+        (positions + offsets).ravel(), minlength=shape[0] * shape[1]
+    ).reshape(shape)
+    is_unlisted = (is_present > 0) & ~is_listed
+    is_unlisted[:, -1] = False
+    unlisted_bins = support_sizes[:, None] + np.cumsum(is_unlisted, axis=1) - 1
+    bins = np.where(is_listed, listed_bins, unlisted_bins)
+    bins[:, -1] = MISSING_CODE
+
+    n_bins = support_sizes + is_unlisted.sum(axis=1)
+    if (n_bins > MAX_BINS).any():
+        qnum = qnums[np.argmax(n_bins)]
+        raise ValueError(f"{qnum} has more than {MAX_BINS} distinct responses")
+    codes = bins.astype(np.int8).ravel()[positions + offsets]
+
+    keys = np.full((len(qnums), n_bins.max(initial=0)), np.nan)
+    for i, support in enumerate(supports):
+        keys[i, : len(support)] = support
+    unlisted_qnums, unlisted_positions = np.nonzero(is_unlisted)
+    keys[unlisted_qnums, unlisted_bins[is_unlisted]] = all_keys[unlisted_positions]
+    return ResponseTensor(
+        codes=codes,
+        qnums=qnums,
+        keys=keys,
+        support_sizes=support_sizes,
+        weights=(
+            responses["weight"].to_numpy(dtype=float)
+            if "weight" in responses.columns
+            else None
+        ),
+    )
+
+
+def get_histograms(tensor: ResponseTensor, is_weighted: bool = True) -> np.ndarray:
+    """
+    Number of responses in each bin of each question (questions × bins), or their total weight
+    if is_weighted and the tensor has weights, counted for all questions in a single bincount.
+    """
+    n_qnums, n_bins = tensor.keys.shape
+    is_observed = tensor.codes != MISSING_CODE
+    # the bins of question i are numbered from i * n_bins
+    bins = (tensor.codes + np.arange(n_qnums) * n_bins)[is_observed]
+    weights = None
+    if is_weighted and tensor.weights is not None:
+        weights = np.broadcast_to(tensor.weights[:, None], tensor.codes.shape)
+        weights = weights[is_observed]
+    counts = np.bincount(bins, weights, minlength=n_qnums * n_bins)
+    return counts.reshape(n_qnums, n_bins)
+
+
+def get_distributions(
+    tensor: ResponseTensor,
+    is_normalize: bool = True,
+    is_include_invalid: bool = False,
+    is_weighted: bool = True,
+) -> np.ndarray:
+    """
+    Response distribution of each question over its support (questions × largest support),
+    padded with 0. Responses with keys outside the support count towards the total, invalid
+    (negative) keys are left out unless is_include_invalid. Questions without any counted
+    responses have a distribution of 0.
+    """
+    histograms = get_histograms(tensor, is_weighted)
+    return histograms_to_distributions(
+        histograms, tensor, is_normalize, is_include_invalid
+    )
+
+
+def histograms_to_distributions(
+    histograms: np.ndarray,
+    tensor: ResponseTensor,
+    is_normalize: bool = True,
+    is_include_invalid: bool = False,
+) -> np.ndarray:
+    """
+    Distributions of histograms over the bins of tensor (... × questions × bins), e.g.
+    replicates of resample_histograms, see get_distributions.
+    """
+    is_counted = ~np.isnan(tensor.keys)
+    if not is_include_invalid:
+        is_counted &= tensor.keys > -1
+    histograms = np.where(is_counted, histograms, 0)
+
+    width = tensor.support_sizes.max(initial=0)
+    is_support = np.arange(width) < tensor.support_sizes[:, None]
+    dists = np.where(is_support, histograms[..., :width], 0)
+    if not is_normalize:
+        return dists
+    totals = histograms.sum(axis=-1, keepdims=True)
+    return np.divide(dists, totals, out=np.zeros(dists.shape), where=totals > 0)
+
+
+def resample_histograms(
+    tensor: ResponseTensor,
+    n_replicates: int,
+    rng: np.random.Generator,
+    is_weighted: bool = True,
+) -> np.ndarray:
+    """
+    Histograms of bootstrap replicates of the respondents (replicates × questions × bins), drawn
+    for each question from a multinomial over its bins and missing responses instead of resampling
+    the respondents themselves. With survey weights, the draws follow the weighted histogram and
+    their size is the effective sample size of the weights (Kish), rounded.
+    """
+    n_observations = tensor.codes.shape[0]
+    histograms = get_histograms(tensor, is_weighted)
+    if is_weighted and tensor.weights is not None:
+        total = tensor.weights.sum()
+        n_draws = round(total**2 / (tensor.weights**2).sum()) if total > 0 else 0
+    else:
+        total, n_draws = n_observations, n_observations
+    # missing responses are a bin of their own, so that the draws keep the sample size
+    missing = total - histograms.sum(axis=1, keepdims=True)
+    pvals = np.concatenate([histograms, np.maximum(missing, 0)], axis=1)
+    pvals = np.divide(pvals, total, out=np.zeros(pvals.shape), where=total > 0)
+    counts = rng.multinomial(n_draws, pvals, size=(n_replicates, len(tensor.qnums)))
+    return counts[..., :-1]
+
+
+@dataclass
+class DistributionCache:
+    """
+    Coded responses and response distributions of each grouping, subgroup and model of an
+    analysis run, computed the first time a metric needs them and shared by all metrics after.
+    The responses of a key must not change during the run.
+    """
+
+    tensors: dict[CacheKey, ResponseTensor] = field(default_factory=dict)
+    # keyed by CacheKey and the is_normalize, is_include_invalid and is_weighted flags
+    distributions: dict[tuple, np.ndarray] = field(default_factory=dict)
+
+    def get_tensor(
+        self,
+        key: CacheKey,
+        responses: pd.DataFrame,
+        response_maps: dict[QNum, ResponseMap],
+    ) -> ResponseTensor:
+        if key not in self.tensors:
+            self.tensors[key] = encode_responses(responses, response_maps)
+        return self.tensors[key]
+
+    def get_distributions(
+        self,
+        key: CacheKey,
+        responses: pd.DataFrame,
+        response_maps: dict[QNum, ResponseMap],
+        is_normalize: bool = True,
+        is_include_invalid: bool = False,
+        is_weighted: bool = True,
+    ) -> tuple[ResponseTensor, np.ndarray]:
+        """The coded responses of key and their distributions, see get_distributions."""
+        tensor = self.get_tensor(key, responses, response_maps)
+        # unweighted tensors have the same distributions either way
+        is_weighted = is_weighted and tensor.weights is not None
+        flags = (is_normalize, is_include_invalid, is_weighted)
+        if (key, flags) not in self.distributions:
+            self.distributions[key, flags] = get_distributions(tensor, *flags)
+        return tensor, self.distributions[key, flags]
+
+
+def encode_data_dict(
+    data_dict: dict[AdapterName, dict[ModelName, pd.DataFrame]],
+    response_maps: dict[QNum, ResponseMap],
+) -> TensorDict:
+    """Code the responses of each subgroup and model of a DataDict."""
+    return {
+        subgroup: {
+            model: encode_responses(df, response_maps) for model, df in models.items()
+        }
+        for subgroup, models in data_dict.items()
+    }
+
+
+def decode_data_dict(
+    tensors: TensorDict,
+) -> dict[AdapterName, dict[ModelName, pd.DataFrame]]:
+    """The DataDict of coded responses, with response keys as floats."""
+    return {
+        subgroup: {model: tensor.to_frame() for model, tensor in models.items()}
+        for subgroup, models in tensors.items()
+    }
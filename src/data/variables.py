@@ -135,6 +135,21 @@ def responses_to_map(
     return dict(zip(keys, values))
 
 
+def group_key(numbers: list[QNum]) -> QNum:
+    """
+    Survey key for a battery of questions asked in a single prompt, e.g. ['Q1', ..., 'Q6'] -> 'Q1-Q6'
+    """
+    return numbers[0] if len(numbers) == 1 else f"{numbers[0]}-{numbers[-1]}"
+
+
+def is_group_key(qnum: QNum) -> bool:
+    return "-" in qnum
+
+
+def first_qnum(qnum: QNum) -> QNum:
+    return qnum.split("-")[0]
+
+
 def flip_key_value(mapping: dict[Any, Any]) -> dict[Any, Any]:
     return {v: k for k, v in mapping.items()}
 
@@ -0,0 +1,93 @@
+import hashlib
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.demographics.config import ALL_AGES, ALL_COUNTRIES, ALL_LEANINGS, ALL_SEXES
+
+WVS_FILE = os.path.join("WV7", "WVS_Cross-National_Wave_7_csv_v6_0.csv")
+WEIGHT_COLUMN = "W_WEIGHT"
+# bump when the columns or dtypes of the cache change
+WVS_CACHE_VERSION = 1
+_HASH_CHUNK_SIZE = 1 << 24
+
+
+def get_demographic_columns() -> list[str]:
+    """Columns of the WVS used to filter respondents by subgroup, see src/demographics."""
+    subgroups = ALL_COUNTRIES + ALL_SEXES + ALL_AGES + ALL_LEANINGS
+    # Over30 additionally filters on year of birth
+    return list(dict.fromkeys([s.COLUMN for s in subgroups] + ["Q261"]))
+
+
+def load_wvs(
+    directory: str, variables_file: str = "variables.csv", columns: list[str] = None
+) -> pd.DataFrame:
+    """
+    Load the WVS wave 7 responses to the questions in variables_file, the survey weight and the
+    demographic columns. The CSV is converted once into a Parquet cache with compact dtypes,
+    which is rebuilt when the CSV or variables_file change.
+
+    :param directory: data directory containing WV7/ and variables/
+    :param columns: subset of the cached columns to load, all if None
+    """
+    path = get_wvs_cache_path(directory, variables_file)
+    wvs_hash = get_wvs_hash(directory, variables_file)
+    if not _is_cache_valid(path, wvs_hash):
+        df = compile_wvs(directory, variables_file)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata(
+            {**table.schema.metadata, b"hash": wvs_hash.encode()}
+        )
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pq.write_table(table, path, compression="zstd")
+        print(f"Cached WVS to {path}")
+        if columns is None:
+            return df
+    return pq.read_table(path, columns=columns).to_pandas()
+
+
+def compile_wvs(directory: str, variables_file: str = "variables.csv") -> pd.DataFrame:
+    """
+    Read the question, weight and demographic columns of the WVS CSV. Responses are integer codes
+    (negative for missing) and are stored with the smallest integer dtype that holds them.
+    """
+    variables = pd.read_csv(os.path.join(directory, "variables", variables_file))
+    wanted = set(variables["number"]) | {WEIGHT_COLUMN, *get_demographic_columns()}
+    df = pd.read_csv(
+        os.path.join(directory, WVS_FILE), usecols=lambda c: c in wanted
+    )
+    for column in df.columns:
+        if pd.api.types.is_integer_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast="integer")
+        elif df[column].dtype == object:
+            df[column] = df[column].astype("category")
+    return df
+
+
+def get_wvs_hash(directory: str, variables_file: str = "variables.csv") -> str:
+    sha = hashlib.sha256(f"{WVS_CACHE_VERSION}".encode())
+    for path in [
+        os.path.join(directory, WVS_FILE),
+        os.path.join(directory, "variables", variables_file),
+    ]:
+        with open(path, "rb") as f:
+            while chunk := f.read(_HASH_CHUNK_SIZE):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+
+def get_wvs_cache_path(directory: str, variables_file: str = "variables.csv") -> str:
+    wvs = os.path.splitext(os.path.basename(WVS_FILE))[0]
+    variables = os.path.splitext(variables_file)[0]
+    return os.path.join(
+        directory, os.path.dirname(WVS_FILE), "compiled", f"{wvs}-{variables}.parquet"
+    )
+
+
+def _is_cache_valid(path: str, wvs_hash: str) -> bool:
+    if not os.path.exists(path):
+        return False
+    metadata = pq.read_schema(path).metadata or {}
+    return metadata.get(b"hash") == wvs_hash.encode()
@@ -1,8 +1,10 @@
+import os
+import re
 from ast import literal_eval
 
 import pandas as pd
 
-from src.data.variables import responses_to_map, ResponseMap, QNum
+from src.data.variables import responses_to_map, ResponseMap, QNum, group_key
 from src.simulation.models import ModelConfig
 
 Prompt = str
@@ -10,6 +12,8 @@ Messages = list[dict[str, Prompt]]
 ResponseList = list[str]
 Survey = dict[QNum, tuple[Prompt, ResponseList]]
 
+ASPECTS_HEADER = "The aspects are:"
+
 
 def extract_user_prompts_from_survey_grouped(
     survey_df: pd.DataFrame, is_reverse: bool
@@ -24,29 +28,50 @@ def extract_user_prompts_from_survey_grouped(
     for group in survey_df["group"].dropna().unique():
         # todo: handle case where no subtopics only a single question; 'group' column is currently empty so it currently skips
 
-        question_group = survey_df[survey_df["group"] == group]
-        item_stem = question_group["item_stem"].unique().item()
-        numbers = question_group["number"].values
-        responses = literal_eval(question_group["responses"].unique().item())
-        # todo: literal_eval might be inefficient here / might be redundantly repeated
-
-        key = (
-            numbers.min()
-            if numbers.shape[0] == 1
-            else f"{numbers.min()}-{numbers.max()}"
-        )
-        response_map = responses_to_map(responses, is_reverse)
-        response_list = format_responses(response_map)
-        prompts[key] = (
-            build_user_prompt_message_grouped(
-                item_stem, response_list, numbers, question_group["subtopic"].values
-            ),
-            response_list,
-        )
+        for question_group in split_group_by_response_scale(
+            survey_df[survey_df["group"] == group]
+        ):
+            item_stem = get_common_item_stem(list(question_group["item_stem"]))
+            numbers = question_group["number"].values
+            responses = literal_eval(question_group["responses"].iloc[0])
+            # todo: literal_eval might be inefficient here / might be redundantly repeated
+
+            key = group_key(list(numbers))
+            response_map = responses_to_map(responses, is_reverse)
+            response_list = format_responses(response_map)
+            prompts[key] = (
+                build_user_prompt_message_grouped(
+                    item_stem, response_list, numbers, question_group["subtopic"].values
+                ),
+                response_list,
+            )
 
     return prompts
 
 
+def split_group_by_response_scale(question_group: pd.DataFrame) -> list[pd.DataFrame]:
+    """
+    Splits a group of questions into batteries sharing the same (valid) response scale,
+    so that each battery can be asked in a single prompt.
+    """
+    scales = question_group["responses"].map(
+        lambda r: tuple(responses_to_map(literal_eval(r), False).items())
+    )
+    return [battery for _, battery in question_group.groupby(scales, sort=False)]
+
+
+def get_common_item_stem(item_stems: list[str]) -> str:
+    """
+    Extracts the shared item stem of a battery, where the stem of each item may end with its subtopic,
+    e.g. 'How important is it in your life? – Family' -> 'How important is it in your life?'
+    """
+    if len(set(item_stems)) == 1:
+        return item_stems[0]
+    prefix = os.path.commonprefix(item_stems)
+    end = max(prefix.rfind(c) for c in "?.:–")
+    return prefix[: end + 1].rstrip(" \n–-:")
+
+
 def extract_user_prompts_from_survey_individual(
     survey_df: pd.DataFrame, is_subtopic_separate: bool, is_reverse: bool
 ) -> Survey:
@@ -69,7 +94,6 @@ def extract_user_prompts_from_survey_individual(
             build_user_prompt_message_individual(item, response_list, qnum),
             response_list,
         )
-        print(f"successfully loaded {qnum}")
 
     return prompts
 
@@ -87,6 +111,8 @@ def build_user_prompt_message_grouped(
 
 {format_response_message(responses)}
 
+{format_grouped_instruction(numbers, responses)}
+
 Your response:
 """
 
@@ -118,12 +144,27 @@ def format_subtopics(numbers: list[QNum], subtopics: list[str] | None) -> str:
     if subtopics is None:
         return "\n"
     else:
-        message = """The aspects are:"""
+        message = ASPECTS_HEADER
         for n, s in zip(numbers, subtopics):
             message += f"\n{n}: {s}"
         return message
 
 
+def format_grouped_instruction(numbers: list[QNum], responses: ResponseList) -> str:
+    return f"Answer each aspect on a separate line, starting with its number, e.g. '{numbers[0]}: {responses[0]}'"
+
+
+def extract_grouped_qnums(prompt: Prompt) -> list[QNum]:
+    """
+    Recovers the question numbers listed in the aspects block of a grouped prompt.
+    Returns an empty list for prompts of individual questions.
+    """
+    if ASPECTS_HEADER not in prompt:
+        return []
+    aspects = prompt.split(ASPECTS_HEADER, 1)[1].split("\n\n", 1)[0]
+    return re.findall(r"^(Q\d+): ", aspects, flags=re.MULTILINE)
+
+
 def batch_messages(user_prompts: list[Prompt], config: ModelConfig) -> list[Messages]:
     """
     takes a list of user prompts and returns a list of alternative Messages
@@ -1,8 +1,10 @@
 import re
+from dataclasses import dataclass, field
 from typing import Any, Generator, Literal
 
 import outlines
 import torch
+from outlines.types import Regex
 from tqdm import tqdm
 from transformers import PreTrainedTokenizer, PreTrainedModel
 
@@ -12,11 +14,24 @@ from src.prompting.messages import (
     Prompt,
     ResponseList,
     format_messages,
+    extract_grouped_qnums,
 )
 from src.data.variables import QNum
 from src.simulation.models import ModelConfig
 
 
+@dataclass
+class DecoderCache:
+    """
+    Prompt encodings and compiled output constraints that are independent of the generation
+    hyperparameters, so they can be shared by all decoders running on the same loaded model.
+    """
+
+    encodings: dict[tuple, list[int]] = field(default_factory=dict)
+    processors: dict[tuple, Any] = field(default_factory=dict)
+    llm: Any = None
+
+
 class BaseDecoder:
     """
     Abstract base class for LLM decoders.
@@ -30,6 +45,7 @@ class BaseDecoder:
         model: PreTrainedModel,
         tokenizer: PreTrainedTokenizer,
         config: ModelConfig,
+        cache: DecoderCache = None,
     ):
         """
         Initialise the decoder
@@ -37,10 +53,12 @@ class BaseDecoder:
         :param model: The underlying language model
         :param tokenizer: The tokeniser corresponding to the model
         :param config: Configuration object with generation parameters
+        :param cache: Cache shared with other decoders on the same model, a new one by default
         """
         self.model = model
         self.tokenizer = tokenizer
         self.config = config
+        self.cache = cache or DecoderCache()
 
     def generate_responses(self) -> list[str]:
         """
@@ -67,6 +85,20 @@ class BaseDecoder:
         """
         raise NotImplementedError
 
+    def _get_hyperparams(self, prompt: Prompt) -> dict:
+        """
+        Get the generation hyperparameters for a prompt. For grouped prompts the token budget is
+        scaled by the number of items so that every item in the battery can be answered.
+
+        :param prompt: The user prompt for the question (or group of questions).
+        :returns: Hyperparameters for generation.
+        """
+        hyperparams = dict(self.config.hyperparams)
+        n_items = len(extract_grouped_qnums(prompt))
+        if n_items > 1:
+            hyperparams["max_new_tokens"] = hyperparams["max_new_tokens"] * n_items
+        return hyperparams
+
 
 class UnconstrainedDecoder(BaseDecoder):
     """
@@ -83,11 +115,12 @@ class UnconstrainedDecoder(BaseDecoder):
         messages_batched = batch_messages(
             [question[0], question_flipped[0]], self.config
         )
+        hyperparams = self._get_hyperparams(question[0])
 
         for batch in tqdm(
             self._get_batches(messages_batched), desc=f"{qnum}-batch", leave=False
         ):
-            batch_kwargs = self._init_generation_params(batch)
+            batch_kwargs = self._init_generation_params(batch, hyperparams)
             batch_kwargs["num_return_sequences"] = 1  # todo: might be redundant
             response_batch = self.generate_responses(batch_kwargs)
             responses.extend(response_batch)
@@ -108,25 +141,40 @@ class UnconstrainedDecoder(BaseDecoder):
                 outputs[:, input_len:], skip_special_tokens=True
             )
 
-    def _init_generation_params(self, messages: Messages | list[Messages]):
+    def _init_generation_params(
+        self, messages: Messages | list[Messages], hyperparams: dict = None
+    ):
         """
         Prepare generation parameters for HuggingFace model.
 
         :param messages: Messages to format as prompt.
+        :param hyperparams: Generation hyperparameters, defaults to those in the config.
         :returns: Generation parameters including input tensors and hyperparameters.
         """
         if self.tokenizer.pad_token is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
 
-        inputs = self.tokenizer.apply_chat_template(
-            messages,
-            tokenize=True,
-            return_tensors="pt",
-            add_generation_prompt=True,
-            return_dict=True,
+        if messages and isinstance(messages[0], dict):
+            messages = [messages]
+        inputs = self.tokenizer.pad(
+            {"input_ids": [self._encode(m) for m in messages]}, return_tensors="pt"
         )
         inputs = {k: v.to(self.config.device) for k, v in inputs.items()}
-        return {**inputs, **self.config.hyperparams}
+        return {**inputs, **(hyperparams or self.config.hyperparams)}
+
+    def _encode(self, messages: Messages) -> list[int]:
+        """
+        Apply the chat template and tokenise a conversation, reusing the cached encoding if seen before.
+
+        :param messages: Messages to format as prompt.
+        :returns: Token ids of the formatted prompt.
+        """
+        key = tuple((m["role"], m["content"]) for m in messages)
+        if key not in self.cache.encodings:
+            self.cache.encodings[key] = self.tokenizer.apply_chat_template(
+                messages, tokenize=True, add_generation_prompt=True
+            )
+        return self.cache.encodings[key]
 
     def _get_batches(
         self, messages: list[Messages]
@@ -151,6 +199,7 @@ class ConstrainedDecoder(BaseDecoder):
         model: PreTrainedModel,  # huggingface object
         tokenizer: PreTrainedTokenizer,
         config: ModelConfig,
+        cache: DecoderCache = None,
     ):
         """
         Initialize the constrained decoder with Outlines.
@@ -158,9 +207,12 @@ class ConstrainedDecoder(BaseDecoder):
         :param model: The underlying language HuggingFace model.
         :param tokenizer: The tokeniser corresponding to the model.
         :param config: Configuration object with generation parameters.
+        :param cache: Cache shared with other decoders on the same model, a new one by default.
         """
-        super().__init__(model, tokenizer, config)
-        self.llm = outlines.from_transformers(self.model, self.tokenizer)
+        super().__init__(model, tokenizer, config, cache)
+        if self.cache.llm is None:
+            self.cache.llm = outlines.from_transformers(self.model, self.tokenizer)
+        self.llm = self.cache.llm
 
     def simulate_question(
         self,
@@ -179,33 +231,73 @@ class ConstrainedDecoder(BaseDecoder):
         # choices_list = [
         #     self._prepare_choices(qnum, ch) for _, ch in [question, question_flipped]
         # ]
-        choices_list = [question[1], question_flipped[1]]
+        generators = [
+            self._get_generator(pr, ch) for pr, ch in [question, question_flipped]
+        ]
+        hyperparams = self._get_hyperparams(question[0])
         responses_per_prompt = [
             self.generate_responses(
-                prompt, choices, f"{qnum}-batch-{'orig'if i==0 else 'flipped'}"
+                prompt,
+                generator,
+                f"{qnum}-batch-{'orig'if i==0 else 'flipped'}",
+                hyperparams,
             )
-            for i, (prompt, choices) in enumerate(zip(prompts, choices_list))
+            for i, (prompt, generator) in enumerate(zip(prompts, generators))
         ]
         return self._interleave(responses_per_prompt)
 
     def generate_responses(
-        self, prompt: Prompt, choices: ResponseList, desc: str
+        self, prompt: Prompt, generator: Any, desc: str, hyperparams: dict = None
     ) -> list[str]:
         """
         Generate a batch of responses from the model using Outlines constrained decoding.
 
         :param prompt: The formatted prompt string.
-        :param choices: regex for valid response choices for constrained decoding.
+        :param generator: Outlines generator restricting the valid responses.
+        :param desc: Description for the progress bar.
+        :param hyperparams: Generation hyperparameters, defaults to those in the config.
         :returns: List of generated responses.
         """
-        generator = outlines.Generator(self.llm, Literal[*choices])
+        hyperparams = hyperparams or self.config.hyperparams
         prompt_responses = []
         for n in tqdm(self._get_batch_sizes(), desc=desc, leave=False):
-            batch_responses = generator([prompt] * n, **self.config.hyperparams)
+            batch_responses = generator([prompt] * n, **hyperparams)
             prompt_responses.extend(batch_responses)
 
         return prompt_responses
 
+    def _get_generator(self, prompt: Prompt, choices: ResponseList) -> Any:
+        """
+        Get an Outlines generator for the output type of a prompt. Compiling the constraint is
+        expensive, so it is cached by the grouped items and choices it restricts to. The logits
+        processor keeps track of the prompt length, hence every generator gets a fresh copy.
+
+        :param prompt: The user prompt for the question (or group of questions).
+        :param choices: List of valid choice strings.
+        :returns: Outlines generator.
+        """
+        key = (tuple(extract_grouped_qnums(prompt)), tuple(choices))
+        if key not in self.cache.processors:
+            output_type = self._get_output_type(prompt, choices)
+            generator = outlines.Generator(self.llm, output_type)
+            self.cache.processors[key] = generator.logits_processor
+        processor = self.cache.processors[key].copy()
+        return outlines.Generator(self.llm, processor=processor)
+
+    def _get_output_type(self, prompt: Prompt, choices: ResponseList) -> Any:
+        """
+        Get the output type for constrained decoding. Individual questions are restricted to
+        a single choice, grouped prompts to one line per item.
+
+        :param prompt: The user prompt for the question (or group of questions).
+        :param choices: List of valid choice strings.
+        :returns: Outlines output type.
+        """
+        qnums = extract_grouped_qnums(prompt)
+        if len(qnums) > 1:
+            return Regex(self._prepare_grouped_choices(qnums, choices))
+        return Literal[*choices]
+
     def _prepare_inputs(self, prompt: Prompt) -> str:
         """
         Format the prompt using the tokeniser's chat template for constrained decoding.
@@ -232,6 +324,18 @@ class ConstrainedDecoder(BaseDecoder):
         patterns = [rf"\s*{prefix_pattern}{re.escape(choice)}\s*" for choice in choices]
         return r"(?i)" + "|".join(patterns)
 
+    @staticmethod
+    def _prepare_grouped_choices(qnums: list[QNum], choices: ResponseList) -> str:
+        """
+        Build a regex pattern to match one choice per item of a grouped prompt, one item per line.
+
+        :param qnums: The question numbers of the items in the group.
+        :param choices: List of valid choice strings (e.g., ["1: agree", "2: not sure"]).
+        :returns: Regex pattern string for use with outlines.
+        """
+        options = "|".join([re.escape(choice) for choice in choices])
+        return "\n".join([rf"{qnum}: (?:{options})" for qnum in qnums])
+
     def _get_batch_sizes(self) -> list[int]:
         """
         Compute the batch sizes for sampling, ensuring memory efficiency.
@@ -1,5 +1,5 @@
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 
 import yaml
@@ -28,6 +28,7 @@ class Experiment:
     setup: dict
     files: dict
     simulation: dict
+    sweep: dict = field(default_factory=dict)  # hyperparam -> list of values
 
 
 def load_experiment(experiment_name: str, root_directory: str) -> Experiment:
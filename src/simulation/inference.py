@@ -10,6 +10,7 @@ from src.simulation.decoders import (
     ConstrainedDecoder,
     UnconstrainedDecoder,
     BaseDecoder,
+    DecoderCache,
 )
 from src.simulation.models import ModelConfig
 from src.utils import mark_is_scale_flipped
@@ -24,11 +25,12 @@ def run_single(
     survey_questions: Survey,
     survey_flipped: Survey,
     run_id: str,
+    cache: DecoderCache = None,
 ):
     start = timer()
     logging.debug(model)
     outputs = simulate_whole_survey(
-        model, tokenizer, config, survey_questions, survey_flipped
+        model, tokenizer, config, survey_questions, survey_flipped, cache
     )
     end = timer()
     return {
@@ -54,9 +56,10 @@ def simulate_whole_survey(
     config: ModelConfig,
     survey: Survey,
     flipped: Survey,
+    cache: DecoderCache = None,
 ) -> dict[str, list[str]]:
     logger.debug(model)
-    decoder = get_decoder(model, tokenizer, config)
+    decoder = get_decoder(model, tokenizer, config, cache)
     responses: dict[str, list[str]] = {}
     for qnum, question in tqdm(survey.items(), desc=decoder.config.run_name):
         responses[qnum] = decoder.simulate_question(qnum, survey[qnum], flipped[qnum])
@@ -64,12 +67,15 @@ def simulate_whole_survey(
 
 
 def get_decoder(
-    model: PreTrainedModel, tokenizer: PreTrainedTokenizer, config: ModelConfig
+    model: PreTrainedModel,
+    tokenizer: PreTrainedTokenizer,
+    config: ModelConfig,
+    cache: DecoderCache = None,
 ) -> BaseDecoder:
     if config.decoding_style == "constrained":
-        return ConstrainedDecoder(model, tokenizer, config)
+        return ConstrainedDecoder(model, tokenizer, config, cache)
     elif config.decoding_style == "unconstrained":
-        return UnconstrainedDecoder(model, tokenizer, config)
+        return UnconstrainedDecoder(model, tokenizer, config, cache)
     else:
         raise ValueError(f"Unknown decoding style: {config.decoding_style}")
 
@@ -125,13 +125,17 @@ def _get_lora_id(base_model_name: str) -> str:
 
 def load_base(config: ModelConfig) -> tuple[PreTrainedModel, PreTrainedTokenizer]:
     model = AutoModelForCausalLM.from_pretrained(config.model_id, torch_dtype="auto")
-    tokenizer = AutoTokenizer.from_pretrained(config.model_id, padding_side="left")
+    tokenizer = load_tokenizer(config)
     # if is_phi_model(model_id):
     #     tokenizer.chat_template = PHI_TOKENIZER_FORMAT
     logger.info(f"Successfully loaded model: {config.model_id}")
     return model, tokenizer
 
 
+def load_tokenizer(config: ModelConfig) -> PreTrainedTokenizer:
+    return AutoTokenizer.from_pretrained(config.model_id, padding_side="left")
+
+
 def change_subgroup(
     model: PreTrainedModel | PeftModel, config: ModelConfig, new_subgroup: str
 ) -> tuple[PreTrainedModel | PeftModel, ModelConfig]:
@@ -0,0 +1,199 @@
+import logging
+import math
+from dataclasses import dataclass, field, asdict
+from timeit import default_timer as timer
+
+import numpy as np
+import torch
+from transformers import PreTrainedModel, PreTrainedTokenizer
+
+from src.data.variables import QNum
+from src.prompting.messages import Survey, Prompt, format_messages
+from src.simulation.decoders import BaseDecoder
+from src.simulation.inference import get_decoder
+from src.simulation.models import ModelConfig
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ExperimentPlan:
+    """
+    Expected cost of simulating a survey, per run and in total across all runs of an experiment.
+    """
+
+    n_runs: int
+    n_questions: int
+    sequences_per_run: int
+    generate_calls_per_run: int
+    prompt_tokens_per_run: int
+    padded_prompt_tokens_per_run: int
+    max_generated_tokens_per_run: int
+    expected_generated_tokens_per_run: int | None = None
+    throughput: dict[int, float] = field(default_factory=dict)  # sequences / second
+    batch_size: int | None = None
+    best_batch_size: int | None = None
+
+    def estimate_runtime(self, batch_size: int = None) -> float:
+        """Estimated runtime of the whole experiment in seconds, NaN if not benchmarked."""
+        throughput = self.throughput.get(batch_size or self.batch_size, np.nan)
+        return self.n_runs * self.sequences_per_run / throughput
+
+    def to_dict(self) -> dict:
+        return {
+            **asdict(self),
+            "estimated_runtime": self.estimate_runtime(),
+            "estimated_runtime_best": self.estimate_runtime(self.best_batch_size),
+        }
+
+
+def plan_experiment(
+    tokenizer: PreTrainedTokenizer,
+    config: ModelConfig,
+    survey: Survey,
+    flipped: Survey,
+    n_runs: int = 1,
+    model: PreTrainedModel = None,
+    batch_sizes: list[int] = None,
+) -> ExperimentPlan:
+    """
+    Plan a simulation without running it: count prompt tokens, generated tokens and generate calls
+    for the configured decoder. If a model is given, a micro-benchmark is run on the question with the
+    median prompt length to estimate throughput for each batch size.
+    """
+    decoder = BaseDecoder(model, tokenizer, config)
+    prompt_lengths = count_prompt_tokens(tokenizer, config, survey, flipped)
+    n_sequences = count_sequences_per_question(config)
+
+    plan = ExperimentPlan(
+        n_runs=n_runs,
+        n_questions=len(survey),
+        sequences_per_run=n_sequences * len(survey),
+        generate_calls_per_run=count_generate_calls_per_question(config) * len(survey),
+        prompt_tokens_per_run=sum(
+            n_sequences * (orig + fl) // 2 for orig, fl in prompt_lengths.values()
+        ),
+        padded_prompt_tokens_per_run=sum(
+            n_sequences * max(lengths) for lengths in prompt_lengths.values()
+        ),
+        max_generated_tokens_per_run=sum(
+            n_sequences * decoder._get_hyperparams(prompt)["max_new_tokens"]
+            for prompt, _ in survey.values()
+        ),
+        batch_size=config.batch_size,
+    )
+
+    if model is not None:
+        qnum = get_median_length_question(prompt_lengths)
+        batch_sizes = sorted(set(batch_sizes or [config.batch_size]))
+        plan.throughput, tokens_per_response = benchmark_batch_sizes(
+            model, tokenizer, config, qnum, survey[qnum], flipped[qnum], batch_sizes
+        )
+        plan.expected_generated_tokens_per_run = round(
+            tokens_per_response * plan.sequences_per_run
+        )
+        plan.best_batch_size = get_best_batch_size(plan.throughput)
+
+    return plan
+
+
+def count_prompt_tokens(
+    tokenizer: PreTrainedTokenizer, config: ModelConfig, survey: Survey, flipped: Survey
+) -> dict[QNum, tuple[int, int]]:
+    """
+    Number of tokens of the chat-formatted prompt for the original and flipped ordering of each question.
+    """
+    return {
+        qnum: (
+            _count_tokens(tokenizer, config, prompt),
+            _count_tokens(tokenizer, config, flipped[qnum][0]),
+        )
+        for qnum, (prompt, _) in survey.items()
+    }
+
+
+def _count_tokens(
+    tokenizer: PreTrainedTokenizer, config: ModelConfig, prompt: Prompt
+) -> int:
+    input_ids = tokenizer.apply_chat_template(
+        format_messages(prompt, config), tokenize=True, add_generation_prompt=True
+    )
+    return len(input_ids)
+
+
+def count_sequences_per_question(config: ModelConfig) -> int:
+    # note: if config.sample_size is odd then actual number of outputs will be config.sample_size - 1
+    return (config.sample_size // 2) * 2
+
+
+def count_generate_calls_per_question(config: ModelConfig) -> int:
+    """
+    Number of calls to the model per question, mirroring the batching of the configured decoder.
+    """
+    if config.decoding_style == "constrained":
+        per_prompt = config.sample_size // 2
+        batch_size = min(config.batch_size, per_prompt)
+        return 2 * math.ceil(per_prompt / batch_size)
+    return math.ceil(count_sequences_per_question(config) / config.batch_size)
+
+
+def get_median_length_question(prompt_lengths: dict[QNum, tuple[int, int]]) -> QNum:
+    qnums = sorted(prompt_lengths, key=lambda q: max(prompt_lengths[q]))
+    return qnums[len(qnums) // 2]
+
+
+def benchmark_batch_sizes(
+    model: PreTrainedModel,
+    tokenizer: PreTrainedTokenizer,
+    config: ModelConfig,
+    qnum: QNum,
+    question: tuple[Prompt, list[str]],
+    question_flipped: tuple[Prompt, list[str]],
+    batch_sizes: list[int],
+) -> tuple[dict[int, float], float]:
+    """
+    Time a single batch of the configured decoder for each batch size on the current machine.
+    Batch sizes that run out of memory (and all larger ones) are given a throughput of NaN.
+
+    :returns: sequences per second for each batch size and the mean number of tokens per response.
+    """
+    throughput, n_tokens = {}, []
+    _simulate_single_batch(model, tokenizer, config, qnum, question, question_flipped, 2)
+    for batch_size in batch_sizes:
+        try:
+            start = timer()
+            responses = _simulate_single_batch(
+                model, tokenizer, config, qnum, question, question_flipped, batch_size
+            )
+            throughput[batch_size] = len(responses) / (timer() - start)
+            n_tokens.extend(len(tokenizer.encode(r, add_special_tokens=False)) for r in responses)
+        except torch.OutOfMemoryError:
+            logger.info(f"Batch size {batch_size} does not fit in memory")
+            throughput.update({b: np.nan for b in batch_sizes if b >= batch_size})
+            torch.cuda.empty_cache()
+            break
+        logger.info(f"Batch size {batch_size}: {throughput[batch_size]:.2f} sequences/s")
+    return throughput, float(np.mean(n_tokens)) if n_tokens else np.nan
+
+
+def _simulate_single_batch(
+    model: PreTrainedModel,
+    tokenizer: PreTrainedTokenizer,
+    config: ModelConfig,
+    qnum: QNum,
+    question: tuple[Prompt, list[str]],
+    question_flipped: tuple[Prompt, list[str]],
+    batch_size: int,
+) -> list[str]:
+    # constrained decoding generates each ordering separately, i.e. two calls of batch_size
+    sample_size = batch_size * 2 if config.decoding_style == "constrained" else batch_size
+    bench_config = config.model_copy(
+        update={"batch_size": batch_size, "sample_size": sample_size}
+    )
+    decoder = get_decoder(model, tokenizer, bench_config)
+    return decoder.simulate_question(qnum, question, question_flipped)
+
+
+def get_best_batch_size(throughput: dict[int, float]) -> int | None:
+    valid = {b: t for b, t in throughput.items() if np.isfinite(t)}
+    return max(valid, key=valid.get) if valid else None
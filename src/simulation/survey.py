@@ -1,9 +1,14 @@
+import hashlib
 import json
 import os
+from ast import literal_eval
 
 import pandas as pd
 
 from src.analysis.io import create_subdirectory
+from src.data import variables as variables_module
+from src.data.variables import QNum, ResponseMap, responses_to_map
+from src.prompting import messages as messages_module
 from src.simulation.experiment import Experiment
 from src.prompting.messages import (
     Survey,
@@ -11,38 +16,138 @@ from src.prompting.messages import (
     extract_user_prompts_from_survey_individual,
 )
 
+# bump when the structure of the compiled survey changes
+SURVEY_ARTEFACT_VERSION = 1
+# prompts are rebuilt when the source of the templates or the response parsing changes
+PROMPT_TEMPLATE_FILES = [messages_module.__file__, variables_module.__file__]
+QUESTION_FORMATS = ["individual", "grouped"]
+
 
 def load_survey(
     experiment: Experiment, question_format: str, is_reverse: bool
 ) -> Survey:
-
-    survey_df = pd.read_csv(
-        os.path.join(
-            experiment.files["directory"], "variables", experiment.files["variables"]
-        )
+    artefact = load_compiled_survey(experiment, question_format)
+    survey = artefact["flipped" if is_reverse else "survey"]
+    print(
+        f"Successfully loaded survey in {'reverse' if is_reverse else 'normal'} order!"
     )
-    with open(
-        os.path.join(
-            experiment.files["directory"], "variables", experiment.files["subset"]
-        ),
-        "r",
-    ) as f:
-        subsets = json.load(f)
-    survey_df = filter_survey_subset(survey_df, subsets)
+    return {qnum: tuple(question) for qnum, question in survey.items()}
+
+
+def load_response_maps(
+    experiment: Experiment, is_reverse: bool
+) -> dict[QNum, ResponseMap]:
+    """Response maps of the questions of the experiment, from its compiled survey."""
+    artefact = load_compiled_survey(experiment, "individual")
+    response_maps = artefact["response_maps_flipped" if is_reverse else "response_maps"]
+    return {
+        qnum: {int(k): label for k, label in response_map.items()}
+        for qnum, response_map in response_maps.items()
+    }
+
+
+def load_compiled_survey(experiment: Experiment, question_format: str) -> dict:
+    """
+    Load the compiled survey of an experiment, compiling it first if it does not exist or if
+    variables.csv, the subset or the prompt templates changed since it was compiled.
+    """
+    path = get_compiled_survey_path(experiment, question_format)
+    survey_hash = get_survey_hash(experiment, question_format)
+    if os.path.exists(path):
+        with open(path) as f:
+            artefact = json.load(f)
+        if artefact.get("hash") == survey_hash:
+            return artefact
+
+    artefact = compile_survey(experiment, question_format)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # written in full before it replaces the old one, so an interrupted compile leaves no
+    # truncated artefact behind
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "w") as f:
+            json.dump(artefact, f)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    print(f"Compiled survey to {path}")
+    return artefact
+
+
+def compile_survey(experiment: Experiment, question_format: str) -> dict:
+    """
+    Build the prompts and choices of the survey in both response orders, along with the response
+    map of every question, stamped with the hash of everything they are built from.
+    """
+    if question_format not in QUESTION_FORMATS:
+        raise ValueError(f"Invalid question format: {question_format}")
+    survey_df = read_survey_subset(experiment)
 
     if question_format == "grouped":
-        survey = extract_user_prompts_from_survey_grouped(survey_df, is_reverse)
-    elif question_format == "individual":
-        survey = extract_user_prompts_from_survey_individual(
-            survey_df, False, is_reverse
-        )
+        survey, flipped = [
+            extract_user_prompts_from_survey_grouped(survey_df.copy(), is_reverse)
+            for is_reverse in [False, True]
+        ]
     else:
-        raise ValueError(f"Invalid question format: {question_format}")
+        survey, flipped = [
+            extract_user_prompts_from_survey_individual(survey_df, False, is_reverse)
+            for is_reverse in [False, True]
+        ]
+    responses = dict(zip(survey_df["number"], survey_df["responses"].map(literal_eval)))
 
-    print(
-        f"Successfully loaded survey in {'reverse' if is_reverse else 'normal'} order!"
+    return {
+        "version": SURVEY_ARTEFACT_VERSION,
+        "hash": get_survey_hash(experiment, question_format),
+        "question_format": question_format,
+        "survey": survey,
+        "flipped": flipped,
+        "response_maps": {
+            qnum: responses_to_map(r, False) for qnum, r in responses.items()
+        },
+        "response_maps_flipped": {
+            qnum: responses_to_map(r, True) for qnum, r in responses.items()
+        },
+    }
+
+
+def read_survey_subset(experiment: Experiment) -> pd.DataFrame:
+    survey_df = pd.read_csv(_get_variables_path(experiment))
+    with open(_get_subset_path(experiment), "r") as f:
+        subsets = json.load(f)
+    return filter_survey_subset(survey_df, subsets)
+
+
+def get_survey_hash(experiment: Experiment, question_format: str) -> str:
+    sha = hashlib.sha256(f"{SURVEY_ARTEFACT_VERSION}-{question_format}".encode())
+    sources = [_get_variables_path(experiment), _get_subset_path(experiment)]
+    for path in sources + PROMPT_TEMPLATE_FILES:
+        with open(path, "rb") as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def get_compiled_survey_path(experiment: Experiment, question_format: str) -> str:
+    variables = os.path.splitext(experiment.files["variables"])[0]
+    subset = os.path.splitext(experiment.files["subset"])[0]
+    return os.path.join(
+        experiment.files["directory"],
+        "variables",
+        "compiled",
+        f"{variables}-{subset}-{question_format}.json",
+    )
+
+
+def _get_variables_path(experiment: Experiment) -> str:
+    return os.path.join(
+        experiment.files["directory"], "variables", experiment.files["variables"]
+    )
+
+
+def _get_subset_path(experiment: Experiment) -> str:
+    return os.path.join(
+        experiment.files["directory"], "variables", experiment.files["subset"]
     )
-    return survey
 
 
 def filter_survey_subset(survey: pd.DataFrame, subsets: dict) -> pd.DataFrame:
@@ -52,12 +157,15 @@ def filter_survey_subset(survey: pd.DataFrame, subsets: dict) -> pd.DataFrame:
 
 
 def save_results(
-    simulated_survey: dict[str, dict], directory: str, experiment_name: str
+    simulated_survey: dict[str, dict],
+    directory: str,
+    experiment_name: str,
+    filename: str = None,
 ):
     results_directory = create_subdirectory(
         os.path.join(directory, "results"), experiment_name
     )
-    filename = f"{experiment_name}-results.json"
+    filename = filename or f"{experiment_name}-results.json"
     with open(os.path.join(results_directory, filename), "w") as f:
         json.dump(simulated_survey, f)
         print(f"Successfully saved simulated responses as {filename}!")
@@ -0,0 +1,72 @@
+import itertools
+import logging
+from typing import Any
+
+from peft import PeftModel
+from transformers import PreTrainedModel, PreTrainedTokenizer
+
+from src.prompting.messages import Survey
+from src.simulation.decoders import DecoderCache
+from src.simulation.inference import run_single
+from src.simulation.models import AdapterName, ModelConfig, change_subgroup
+
+logger = logging.getLogger(__name__)
+
+SweepPoint = dict[str, Any]
+
+
+def expand_grid(grid: dict[str, list]) -> dict[str, SweepPoint]:
+    """
+    All combinations of the hyperparameter values in the grid, keyed by a name for each point.
+
+    :param grid: hyperparameter name -> list of values, e.g. {"temperature": [0.6, 0.9]}.
+    :returns: point name -> hyperparameters, e.g. {"temperature-0.6": {"temperature": 0.6}, ...}.
+    """
+    if not grid:
+        raise ValueError("Sweep grid is empty")
+    names = list(grid)
+    values = [v if isinstance(v, list) else [v] for v in grid.values()]
+    points = [dict(zip(names, c)) for c in itertools.product(*values)]
+    return {get_point_name(point): point for point in points}
+
+
+def get_point_name(point: SweepPoint) -> str:
+    return "_".join(f"{k}-{v}" for k, v in point.items())
+
+
+def run_sweep(
+    model: PeftModel | PreTrainedModel,
+    tokenizer: PreTrainedTokenizer,
+    config: ModelConfig,
+    survey_questions: Survey,
+    survey_flipped: Survey,
+    points: dict[str, SweepPoint],
+    subgroups: list[AdapterName | None],
+    run_id: str,
+) -> dict[str, dict[str, dict]]:
+    """
+    Simulate the survey for every subgroup and every point of the sweep on an already loaded model.
+    Subgroups are the outer loop so that each adapter is activated once, and prompt encodings and
+    compiled constraints are shared across all points, as they do not depend on the hyperparameters.
+
+    :returns: point name -> run name -> simulated survey.
+    """
+    cache = DecoderCache()
+    simulated_surveys = {name: {} for name in points}
+    for subgroup in subgroups:
+        model, config = change_subgroup(model, config, subgroup)
+        for name, point in points.items():
+            logger.info(f"Sweep point {name} for {config.run_name}")
+            point_config = config.model_copy(
+                update={"hyperparams": {**config.hyperparams, **point}}
+            )
+            simulated_surveys[name][config.run_name] = run_single(
+                model,
+                tokenizer,
+                point_config,
+                survey_questions,
+                survey_flipped,
+                run_id,
+                cache,
+            )
+    return simulated_surveys
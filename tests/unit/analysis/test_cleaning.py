@@ -11,6 +11,8 @@ from src.analysis.cleaning import (
     add_separate_key_and_text_columns,
     pipeline_clean_generated_responses,
     remap_response_keys,
+    split_grouped_response,
+    split_grouped_responses,
 )
 
 
@@ -146,3 +148,59 @@ def test_remap_response_keys_default_column():
 
     # Index/order should be preserved
     pdt.assert_frame_equal(out.reset_index(drop=True), expected)
+
+
+def test_split_grouped_response():
+    response = "Q1: 1: Very important\nQ3: 2: Rather important\nQ1: 3: Not important\nQ9: 1"
+    items = split_grouped_response(response, ["Q1", "Q2", "Q3"])
+    assert items == {"Q1": "1: Very important", "Q2": "", "Q3": "2: Rather important"}
+
+
+def test_split_grouped_responses():
+    grouped_prompt = "The aspects are:\nQ1: Family\nQ2: Friends\n\nYour response:"
+    results = pd.DataFrame(
+        {
+            "number": ["Q1-Q2", "Q3", "Q1-Q2"],
+            "question": [grouped_prompt, "Q3: Work", grouped_prompt],
+            "response": ["Q1: 1: agree\nQ2: 2: disagree", "1: agree", "Q2: 1: agree"],
+            "is_scale_flipped": [False, False, True],
+        }
+    )
+    out = split_grouped_responses(results)
+    expected = pd.DataFrame(
+        {
+            "number": ["Q1", "Q2", "Q3", "Q1", "Q2"],
+            "question": [grouped_prompt] * 2 + ["Q3: Work"] + [grouped_prompt] * 2,
+            "response": ["1: agree", "2: disagree", "1: agree", "", "1: agree"],
+            "is_scale_flipped": [False, False, False, True, True],
+        }
+    )
+    pdt.assert_frame_equal(out, expected)
+
+
+def test_clean_generated_responses_matches_scalar_functions():
+    responses = [
+        "Your response: 1: vAlue",
+        "response: Response - Q3: 2.- Agree strongly",
+        "Q1:Q2: 3",
+        "  7 .. ",
+        "12:\n\nNot sure\n",
+        "Your response:",
+        "Q10",
+        "4: a: b",
+        "",
+        " 2 - Disagree 3: Agree ",
+    ]
+    results = pipeline_clean_generated_responses(pd.DataFrame({"response": responses}))
+    expected = pd.DataFrame(
+        [
+            split_response_into_key_value(
+                detect_bare_key_without_text(remove_prompt_prefixes(r))
+            )
+            for r in responses
+        ],
+        columns=["response_key", "response_text"],
+    )
+    pdt.assert_frame_equal(
+        results[["response_key", "response_text"]], expected, check_dtype=False
+    )
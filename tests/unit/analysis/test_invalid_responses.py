@@ -1,3 +1,6 @@
+import re
+from unittest.mock import patch
+
 import numpy as np
 import pandas as pd
 import pytest
@@ -5,11 +8,10 @@ import pytest
 from src.analysis.cleaning import PLACEHOLDER_TEXT
 from src.analysis.invalid_responses import (
     flip_keys_back,
-    extract_first_response_instance,
-    mark_multiple_responses,
-    mark_key_value_valid_mismatch,
-    recover_keys_from_text_only,
+    get_flip_table,
     pipeline_identify_invalid_responses,
+    identify_invalid_responses,
+    LabelTrie,
 )
 from src.data.variables import ResponseMap
 
@@ -26,7 +28,18 @@ def test_flip_keys_back(mock_response_results, responses, responses_flipped):
     )
 
 
-def test_extract_first_response_instance():
+def test_get_flip_table(responses, responses_flipped):
+    table = get_flip_table(["Q2", "Q1"], responses, responses_flipped)
+    np.testing.assert_array_equal(table, [[0, 3, 2, 1], [0, 2, 1, 3]])
+
+
+def identify_unflipped(results: pd.DataFrame, valid: dict) -> pd.DataFrame:
+    results = results.astype({"response_key": "Int64"})
+    results["is_scale_flipped"] = False
+    return identify_invalid_responses(results, valid, valid)
+
+
+def test_identify_invalid_responses_first_response_instance():
     numbers = ["Q1"] * 7 + ["Q2"] * 6
     valid = {
         "Q1": {1: "agree", 2: "agree strongly", 3: "disagree"},
@@ -55,48 +68,27 @@ def test_extract_first_response_instance():
             "response_key": [1, pd.NA, 1, pd.NA, 3, 3, 1] + [3, 3, pd.NA, pd.NA, 1, pd.NA],
         }
     )
-    expected = pd.DataFrame(
-        {
-            "number": numbers,
-            "response_text": [
-                "agree",
-                "agree",
-                "agree strongly",
-                "",
-                "disagree",
-                "",
-                "agree",
-            ]
-            + ["3", "3", "", "2", "1", "1"],
-            "response_key": [1, pd.NA, 1, pd.NA, 3, 3, 1] + [3, 3, pd.NA, pd.NA, 1, pd.NA],
-            "extra_text": [
-                "Q2: what",
-                "3: disagree",
-                "",
-                "no idea",
-                "sorry I cannot",
-                "2: Disagree\n\n\nQ42: Do you agree",
-                "Q2: response: hello",
-            ]
-            + [
-                "Q3: hi",
-                "Response: hello",
-                "disagree  I am an AI",
-                "3: 3",
-                "your response: hello",
-                "your response: 2",
-            ],
-        }
-    )
-    out = extract_first_response_instance(results, valid)
-    print(out[out.columns[1:]])
-    pd.testing.assert_frame_equal(out, expected)
+    expected_text = ["agree", "agree", "agree strongly", "", "disagree", "", "agree"]
+    expected_text += ["3", "3", "", "2", "1", "1"]
+    expected_extra_text = [
+        "what",
+        "3: disagree",
+        "",
+        "no idea",
+        "sorry i cannot",
+        "2: disagree q42: do you agree",
+        "hello",
+    ]
+    expected_extra_text += ["hi", "hello", "disagree i am an ai", "3: 3", "hello", "2"]
+
+    out = identify_unflipped(results, valid)
+    assert out["response_text"].tolist() == expected_text
+    assert out["extra_text"].tolist() == expected_extra_text
 
 
-def test_mark_multiple_responses():
-    reason = "ambiguous response;"
+def test_identify_invalid_responses_multiple_responses():
+    reason = "ambiguous response;invalid text;"
     numbers = ["Q1"] * 6 + ["Q2"] * 6
-    n = len(numbers)
     valid = {
         "Q1": {1: "agree", 2: "disagree", 3: "strongly disagree"},
         "Q2": {1: "1", 2: "2", 3: "3"},
@@ -112,44 +104,41 @@ def test_mark_multiple_responses():
         "Q3: hi",
         "Q3: 3",
         "disagree  I am an AI",
-        "3: 3",
+        "3: 3",  # the leading key is the response
         "your response: hello",
         "your response: 2",
     ]
     results = pd.DataFrame(
-        {"number": numbers, "reason_invalid": [""] * n, "extra_text": response_text}
+        {"number": numbers, "response_key": pd.NA, "response_text": response_text}
     )
-    expected = pd.DataFrame(
-        {
-            "number": numbers,
-            "reason_invalid": ["", reason, reason, "", "", reason]
-            + ["", reason, "", reason, "", reason],
-            "extra_text": response_text,
-        }
-    )
-    out = mark_multiple_responses(results, valid)
-    print(out)
-    pd.testing.assert_frame_equal(out, expected)
+    expected_reason = ["invalid text;", reason, reason] + ["invalid text;"] * 2
+    expected_reason += [reason, "invalid text;", reason, "invalid text;", "valid"]
+    expected_reason += ["invalid text;", reason]
+
+    out = identify_unflipped(results, valid)
+    assert out["reason_invalid"].tolist() == expected_reason
 
 
-def test_mark_is_key_value_valid_match(mock_response_results, responses):
-    mock_response_results["reason_invalid"] = ""
+def test_identify_invalid_responses_key_value_mismatch(
+    mock_response_results, responses, responses_flipped
+):
     reason1 = "key text mismatch;"
     reason2 = "invalid text;"
     reason3 = "invalid key;"
 
     # last response hardcoded as -1, missing
-    results_out = mark_key_value_valid_mismatch(mock_response_results, responses)
+    results_out = identify_invalid_responses(
+        mock_response_results, responses, responses_flipped
+    )
     expected_reason = pd.Series(
-        ["", "", reason1, "", "", reason2]
-        + [reason2, reason2, "", reason1, reason1 + reason3, reason1 + reason3],
+        ["valid"] * 6
+        + [reason2, reason2, "valid", "valid", reason1 + reason3, reason1 + reason3],
         name="reason_invalid",
     )
-    results_out["reason_expected"] = expected_reason
     pd.testing.assert_series_equal(results_out["reason_invalid"], expected_reason)
 
 
-def test_recover_keys_from_text_only():
+def test_identify_invalid_responses_recovers_text_only_keys():
     responses = {"Q1": {1: "agree", 2: "disagree"}, "Q2": {1: "1", 2: "2", 3: "3"}}
     df = pd.DataFrame(
         {
@@ -162,7 +151,7 @@ def test_recover_keys_from_text_only():
     expected_keys = pd.Series(
         [1, np.nan, 1, 2, 3, np.nan, 2], dtype="Int64", name="response_key"
     )
-    output_df = recover_keys_from_text_only(df, responses)
+    output_df = identify_unflipped(df, responses)
     pd.testing.assert_series_equal(output_df["response_key"], expected_keys)
 
 
@@ -226,6 +215,82 @@ def test_pipeline_comprehensive_invalid_reasons(mock_df, responses, responses_fl
     pd.testing.assert_series_equal(out["reason_invalid"], expected_reasons)
 
 
+def test_identify_invalid_responses_edge_cases(mock_df, responses, responses_flipped):
+    responses["Q3"] = {1: "a really long response text that may get truncated"}
+    responses_flipped["Q3"] = {1: "a really long response text that may get truncated"}
+    responses["Q1"][-1] = "Don't know"
+    extra_rows = pd.DataFrame(
+        {
+            "number": ["Q1", "Q1", "Q1", "Q2"],
+            "response_key": [pd.NA, 1, -1, 7],
+            "response_text": ["don't know", "", "Agree Your response: agree", "2"],
+            "is_scale_flipped": [False, True, True, False],
+        }
+    ).astype({"response_key": "Int64"})
+    df = pd.concat([mock_df, extra_rows], ignore_index=True)
+
+    out = identify_invalid_responses(df.copy(), responses, responses_flipped)
+    expected = df.iloc[len(mock_df) :].assign(
+        response_key=pd.array([pd.NA, 2, -1, 7], dtype="Int64"),
+        response_text=["", "disagree", "agree", "2"],
+        reason_invalid=[
+            "ambiguous response;invalid text;",
+            "valid",
+            "ambiguous response;key text mismatch;invalid key;",
+            "key text mismatch;invalid key;",
+        ],
+        extra_text=["don't know", "", "agree", ""],
+        final_response=[-1.0, 2.0, -1.0, -1.0],
+    )
+    pd.testing.assert_frame_equal(out.iloc[len(mock_df) :], expected)
+
+
+def test_label_trie():
+    labels = ["Agree", "Agree strongly", "Disagree", "Don't know"]
+    trie = LabelTrie(labels, valid_labels=labels[:3])
+
+    leading = re.compile(f"^({trie.to_pattern(is_valid_only=True)})", re.IGNORECASE)
+    assert leading.match("agree strongly, or not").group(1) == "agree strongly"
+    assert leading.match("agreed").group(1) == "agree"
+    assert leading.match("don't know") is None
+
+    anywhere = re.compile(rf"(?<!\w){trie.to_pattern()}(?!\w)", re.IGNORECASE)
+    assert anywhere.search("i don't know")
+    assert not anywhere.search("disagreeable")
+
+    assert trie.complete("agree str") == "agree strongly"
+    assert trie.complete("agree") is None  # two labels start with it
+    assert trie.complete("don't") is None  # not a valid label
+    assert trie.complete("strongly") is None
+
+
+def test_pipeline_parses_duplicates_once(mock_df, responses, responses_flipped):
+    responses["Q3"] = {1: "a really long response text that may get truncated"}
+    responses_flipped["Q3"] = {1: "a really long response text that may get truncated"}
+    df = pd.concat([mock_df, mock_df.iloc[::-1]], ignore_index=True)
+    df["response"] = "raw"
+
+    with patch(
+        "src.analysis.invalid_responses.identify_invalid_responses",
+        wraps=identify_invalid_responses,
+    ) as identify:
+        out = pipeline_identify_invalid_responses(
+            df.copy(), responses, responses_flipped
+        )
+    assert len(identify.call_args.args[0]) == len(mock_df)
+
+    once = pipeline_identify_invalid_responses(
+        mock_df.copy(), responses, responses_flipped
+    )
+    expected = pd.concat([once, once.iloc[::-1]], ignore_index=True)
+    assert list(out.columns) == list(df.columns) + [
+        "reason_invalid",
+        "extra_text",
+        "final_response",
+    ]
+    pd.testing.assert_frame_equal(out.drop(columns="response"), expected)
+
+
 @pytest.fixture
 def responses() -> dict[str, ResponseMap]:
     return {
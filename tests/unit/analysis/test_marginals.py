@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.analysis.marginals import (
+    compare_marginal_response_dists,
+    get_cross_distance,
+    save_response_distributions,
+)
+from src.analysis.metrics import calculate_misalignment
+from src.analysis.tensors import DistributionCache
+
+
+def test_cross_distance_matches_pairwise_calls(data_dict, response_maps):
+    data_dict["subgroup3"]["true"] = data_dict["subgroup3"]["true"][["Q1"]]
+
+    cross = get_cross_distance(data_dict, calculate_misalignment, response_maps)
+    # a metric without batched distances is called for every pair
+    expected = get_cross_distance(
+        data_dict, lambda *args: calculate_misalignment(*args), response_maps
+    )
+    pd.testing.assert_frame_equal(cross, expected)
+    assert (np.diag(cross) == 0).all()
+    assert (cross.to_numpy() == cross.to_numpy().T).all()
+
+
+def test_analyses_share_distribution_cache(data_dict, response_maps, tmp_path):
+    uncached, cached = tmp_path / "uncached", tmp_path / "cached"
+    uncached.mkdir()
+    cached.mkdir()
+    cache = DistributionCache()
+    for directory, c in [(uncached, None), (cached, cache)]:
+        save_response_distributions(
+            data_dict, directory, response_maps, "subgroup", c
+        )
+        compare_marginal_response_dists(
+            data_dict, response_maps, directory, "subgroup", c, n_bootstrap=100, seed=0
+        )
+        get_cross_distance(
+            data_dict, calculate_misalignment, response_maps, cache=c, grouping="subgroup"
+        )
+
+    for name in [
+        "subgroup-response-dists.json",
+        "subgroup-misalignment.csv",
+        "subgroup-variances.csv",
+    ]:
+        assert (uncached / name).read_text() == (cached / name).read_text()
+    # one entry per grouping, subgroup and model, shared by all analyses
+    assert len(cache.tensors) == 4 * 4
+    assert len(cache.distributions) == len(cache.tensors)
+
+
+def test_misalignment_confidence_intervals(data_dict, response_maps, tmp_path):
+    compare_marginal_response_dists(
+        data_dict, response_maps, tmp_path, "subgroup", n_bootstrap=500, seed=0
+    )
+    misalignment = pd.read_csv(tmp_path / "subgroup-misalignment.csv", index_col=0)
+    assert len(misalignment) == 4 * 3 * 2
+    assert (misalignment["ci_lower"] < misalignment["ci_upper"]).all()
+    is_covered = misalignment["value"].between(
+        misalignment["ci_lower"], misalignment["ci_upper"]
+    )
+    assert is_covered.mean() > 0.9
+
+    compare_marginal_response_dists(
+        data_dict, response_maps, tmp_path, "subgroup", n_bootstrap=0
+    )
+    misalignment = pd.read_csv(tmp_path / "subgroup-misalignment.csv", index_col=0)
+    assert list(misalignment.columns) == ["number", "group", "model", "value"]
+
+
+@pytest.fixture
+def response_maps():
+    return {
+        "Q1": {-1: "M", 1: "A", 2: "B", 3: "C", 4: "D"},
+        "Q7": {1: "X", 2: "Y", 3: "Z"},
+    }
+
+
+@pytest.fixture
+def data_dict():
+    rng = np.random.default_rng(0)
+
+    def _responses(n: int) -> pd.DataFrame:
+        return pd.DataFrame(
+            {
+                "Q1": rng.choice([-1, 1, 2, 3, 4], n).astype(float),
+                "Q7": rng.choice([1, 2, 3], n).astype(float),
+            }
+        )
+
+    return {
+        f"subgroup{i}": {
+            "opinion_gpt": _responses(30),
+            "persona": _responses(30),
+            "base": _responses(30),
+            "true": _responses(50).assign(weight=rng.random(50)),
+        }
+        for i in range(4)
+    }
@@ -2,7 +2,20 @@ import pytest
 import pandas as pd
 import numpy as np
 
-from src.analysis.metrics import calculate_wasserstein, calculate_jensen_shannon
+from scipy.spatial.distance import jensenshannon
+from scipy.stats import wasserstein_distance
+
+from src.analysis.metrics import (
+    bootstrap_metric,
+    calculate_jensen_shannon,
+    calculate_misalignment,
+    calculate_pairwise_metric,
+    calculate_total_variation,
+    calculate_wasserstein,
+    jensen_shannon_distances,
+    total_variation_distances,
+    wasserstein_distances,
+)
 
 
 @pytest.mark.skip(reason="JS distance no longer used in project")
@@ -53,6 +66,120 @@ def test_wasserstein_normalization(extreme_responses, response_maps):
     assert np.isclose(result["Q1"], 1)
 
 
+def test_batched_distances_match_scipy():
+    rng = np.random.default_rng(0)
+    sizes = [2, 4, 5, 10]
+    support = np.full((len(sizes), max(sizes)), np.nan)
+    p, q = np.zeros(support.shape), np.zeros(support.shape)
+    for i, size in enumerate(sizes):
+        support[i, :size] = np.sort(rng.choice(20, size, replace=False))
+        p[i, :size], q[i, :size] = rng.dirichlet(np.ones(size), 2)
+
+    wasserstein = wasserstein_distances(p, q, support)
+    js = jensen_shannon_distances(p, q, support)
+    for i, size in enumerate(sizes):
+        keys = support[i, :size]
+        expected = wasserstein_distance(keys, keys, p[i, :size], q[i, :size])
+        expected /= keys.max() - keys.min()
+        assert np.isclose(wasserstein[i], expected)
+        assert np.isclose(js[i], jensenshannon(p[i, :size], q[i, :size]))
+
+
+def test_batched_distances_empty():
+    support = np.array([[1.0, 2.0, 3.0], [1.0, 2.0, 3.0]])
+    p = np.array([[0.0, 0.0, 0.0], [0.5, 0.5, 0.0]])
+    q = np.array([[0.2, 0.3, 0.5], [0.0, 0.5, 0.5]])
+    for distance_fn in [
+        wasserstein_distances,
+        total_variation_distances,
+        jensen_shannon_distances,
+    ]:
+        distances = distance_fn(p, q, support)
+        assert np.isnan(distances[0])
+        assert not np.isnan(distances[1])
+    assert np.isclose(total_variation_distances(p, q, support)[1], 0.5)
+    assert np.isclose(wasserstein_distances(p, q, support)[1], 0.5)
+
+
+def test_total_variation(all_responses, response_maps):
+    model, true = all_responses
+    result = calculate_total_variation(model, true, response_maps)
+    assert result == {}  # Q1 and Q2 have an ordinal scale
+
+    maps = {"Q7": response_maps["Q2"]}
+    result = calculate_total_variation(
+        model[["Q2"]].set_axis(["Q7"], axis=1),
+        true[["Q2"]].set_axis(["Q7"], axis=1),
+        maps,
+    )
+    # model 1/5, 0, 3/5, 1/5 and true 3/5, 0, 0, 2/5
+    assert np.isclose(result["Q7"], 0.6)
+
+
+def test_misalignment(all_responses, response_maps):
+    model, true = all_responses
+    result = calculate_misalignment(model, true, response_maps)
+    assert result == calculate_wasserstein(model, true, response_maps)
+
+
+def test_pairwise_metric(all_responses, response_maps):
+    model, true = all_responses
+    responses = [model, true, model[["Q2"]]]
+    qnums, pairwise = calculate_pairwise_metric(
+        calculate_wasserstein, responses, response_maps
+    )
+    assert qnums == ["Q1", "Q2"]
+    assert pairwise.shape == (3, 3, 2)
+    for i, a in enumerate(responses):
+        for j, b in enumerate(responses):
+            expected = calculate_wasserstein(a, b, response_maps)
+            result = dict(zip(qnums, pairwise[i, j]))
+            for qnum in qnums:
+                if qnum in expected:
+                    assert np.isclose(result[qnum], expected[qnum])
+                else:
+                    assert np.isnan(result[qnum])
+
+
+def test_bootstrap_metric(all_responses, response_maps):
+    model, true = all_responses
+    intervals = bootstrap_metric(
+        calculate_wasserstein,
+        model,
+        true,
+        response_maps,
+        n_replicates=2000,
+        rng=np.random.default_rng(0),
+    )
+    assert list(intervals.index) == ["Q1", "Q2"]
+    point = calculate_wasserstein(model, true, response_maps)
+    for qnum, (lower, upper) in intervals.iterrows():
+        assert 0 <= lower <= point[qnum] <= upper <= 1
+
+    # responses without variation have the same distance in every replicate
+    extreme = pd.DataFrame({"Q1": [1] * 10}), pd.DataFrame({"Q1": [4] * 10})
+    intervals = bootstrap_metric(calculate_wasserstein, *extreme, response_maps)
+    np.testing.assert_allclose(intervals.loc["Q1"], [1, 1])
+
+
+def test_bootstrap_metric_without_distance(response_maps):
+    maps = {"Q7": response_maps["Q2"]}
+    # the key 99 outside the support, so the distribution does not sum to 1
+    model = pd.DataFrame({"Q7": [1] * 60 + [2] * 39 + [99]})
+    true = pd.DataFrame({"Q7": [1, 2, 3, 4] * 25})
+    assert np.isnan(calculate_total_variation(model, true, maps)["Q7"])
+    intervals = bootstrap_metric(
+        calculate_total_variation,
+        model,
+        true,
+        maps,
+        n_replicates=1000,
+        rng=np.random.default_rng(0),
+    )
+    # about a third of the replicates draw no 99, their distances are not reported
+    assert intervals.loc["Q7"].isna().all()
+
+
 @pytest.fixture
 def response_maps():
     return {
@@ -0,0 +1,141 @@
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+from src.analysis import pipeline
+from src.analysis.pipeline import (
+    pipeline_clean_and_identify_invalid,
+    pipeline_clean_results,
+    pipeline_clean_results_incremental,
+    split_by_question,
+)
+
+RESPONSES = {q: {1: "agree", 2: "disagree"} for q in ["Q1", "Q2", "Q3"]}
+FLIPPED = {q: {1: "disagree", 2: "agree"} for q in ["Q1", "Q2", "Q3"]}
+
+
+def test_split_by_question():
+    results = pd.DataFrame({"number": ["Q1", "Q2", "Q1", "Q3", "Q3", "Q3", "Q2"]})
+    chunks = split_by_question(results, chunk_size=4)
+    assert [list(c) for c in chunks] == [[0, 2, 1, 6], [3, 4, 5]]
+    # questions larger than a chunk are not split
+    chunks = split_by_question(results, chunk_size=1)
+    assert [list(c) for c in chunks] == [[0, 2], [1, 6], [3, 4, 5]]
+
+
+def test_pipeline_clean_and_identify_invalid_in_parallel():
+    grouped_prompt = "The aspects are:\nQ1: Family\nQ2: Friends\n\nYour response:"
+    results = pd.DataFrame(
+        {
+            "number": ["Q1-Q2", "Q3", "Q1", "Q3", "Q1-Q2", "Q1"],
+            "question": [grouped_prompt, "Q3", "Q1", "Q3", grouped_prompt, "Q1"],
+            "response": [
+                "Q1: 1: agree\nQ2: 2: disagree",
+                "2: disagree",
+                "Your response: 1",
+                "agree",
+                "Q2: 1: agree",
+                "1: disagree",
+            ],
+            "is_scale_flipped": [False, False, True, True, True, False],
+        },
+        index=np.arange(6)[::-1],
+    )
+    serial = pipeline_clean_and_identify_invalid(
+        results.copy(), RESPONSES, FLIPPED, n_workers=1
+    )
+    parallel = pipeline_clean_and_identify_invalid(
+        results.copy(), RESPONSES, FLIPPED, n_workers=2, chunk_size=2
+    )
+    pd.testing.assert_frame_equal(serial, parallel)
+    assert list(serial["number"]) == ["Q1", "Q2", "Q3", "Q1", "Q3", "Q1", "Q2", "Q1"]
+    assert list(serial["final_response"]) == [1, 2, 2, 2, 1, -1, -1, -1]
+
+
+def get_results(model: str, responses: list[str]) -> pd.DataFrame:
+    grouped_prompt = "The aspects are:\nQ1: Family\nQ2: Friends\n\nYour response:"
+    return pd.DataFrame(
+        {
+            "model": model,
+            "number": ["Q1-Q2", "Q1-Q2", "Q3", "Q3"],
+            "question": [grouped_prompt] * 2 + ["Q3"] * 2,
+            "response": responses,
+            "is_scale_flipped": [False, True, False, True],
+        }
+    )
+
+
+def test_pipeline_clean_results_incremental():
+    responses = ["Q1: 1: agree\nQ2: 2", "Q2: 1", "2: disagree", "agree"]
+    results = pd.concat(
+        [get_results("run0", responses), get_results("run1", responses)],
+        ignore_index=True,
+    )
+    previous, manifest = pipeline_clean_results_incremental(results, RESPONSES, FLIPPED)
+    assert manifest["partitions"]["run0"]["Q1-Q2"]["numbers"] == ["Q1", "Q2"]
+    pd.testing.assert_frame_equal(
+        previous, pipeline_clean_results(results.copy(), RESPONSES, FLIPPED)
+    )
+
+    # run0 is dropped, Q3 of run1 changes and run2 is added
+    changed = get_results("run1", responses[:2] + ["1: agree", "1"])
+    topped_up = pd.concat(
+        [changed, get_results("run2", responses)], ignore_index=True
+    )
+    with patch.object(
+        pipeline, "pipeline_clean_results", wraps=pipeline_clean_results
+    ) as clean:
+        incremental, manifest = pipeline_clean_results_incremental(
+            topped_up, RESPONSES, FLIPPED, previous, manifest
+        )
+    assert len(clean.call_args.args[0]) == 6
+    assert list(manifest["partitions"]) == ["run1", "run2"]
+    pd.testing.assert_frame_equal(
+        incremental, pipeline_clean_results(topped_up.copy(), RESPONSES, FLIPPED)
+    )
+
+
+def test_pipeline_clean_results_incremental_interleaved():
+    responses = ["Q1: 1: agree\nQ2: 2", "Q2: 1", "2: disagree", "agree"]
+    run0, run1 = get_results("run0", responses), get_results("run1", responses[::-1])
+    # rows of the runs alternate
+    results = pd.concat([run0, run1]).sort_index(kind="stable").reset_index(drop=True)
+    previous, manifest = pipeline_clean_results_incremental(results, RESPONSES, FLIPPED)
+    expected = pipeline_clean_results(results.copy(), RESPONSES, FLIPPED)
+    assert list(expected["model"][:4]) == ["run0", "run0", "run1", "run1"]
+    pd.testing.assert_frame_equal(previous, expected)
+
+    # only Q3 of run1 changes, the rows of the other partitions come from previous
+    is_changed = (results["model"] == "run1") & (results["number"] == "Q3")
+    results.loc[is_changed, "response"] = "1"
+    incremental, _ = pipeline_clean_results_incremental(
+        results, RESPONSES, FLIPPED, previous, manifest
+    )
+    pd.testing.assert_frame_equal(
+        incremental, pipeline_clean_results(results.copy(), RESPONSES, FLIPPED)
+    )
+
+
+def test_pipeline_clean_results_incremental_empty():
+    results = get_results("run0", ["1"] * 4).iloc[:0]
+    clean, manifest = pipeline_clean_results_incremental(results, RESPONSES, FLIPPED)
+    pd.testing.assert_frame_equal(
+        clean, pipeline_clean_results(results.copy(), RESPONSES, FLIPPED)
+    )
+    assert manifest["partitions"] == {}
+
+
+def test_pipeline_clean_results_copies_once():
+    responses = ["Q1: 1: agree\nQ2: 2", "Q2: 1", "2: disagree", "agree"]
+    results = get_results("run0", responses).set_axis([3, 2, 1, 0])
+    results = results[results["number"] == "Q3"]
+    original = results.copy()
+
+    clean = pipeline_clean_results(results, RESPONSES, FLIPPED)
+    pd.testing.assert_frame_equal(results, original)
+
+    # without a copy, the stages modify the results
+    in_place = pipeline_clean_results(results, RESPONSES, FLIPPED, copy=False)
+    assert "response_key" in results.columns
+    pd.testing.assert_frame_equal(in_place, clean)
@@ -6,6 +6,7 @@ from src.analysis.responses import (
     get_true_responses_for_subgroup,
     get_model_responses_for_subgroup,
     get_response_distribution,
+    get_response_distribution_weighted,
 )
 from src.demographics.country import Germany
 from src.data.variables import ResponseMap
@@ -75,6 +76,23 @@ def test_get_response_distribution(
     assert response_dists == expected
 
 
+def test_get_response_distribution_weighted(expected_true_responses, response_maps):
+    response_dists = get_response_distribution_weighted(
+        pd.DataFrame(expected_true_responses), response_maps
+    )
+    # respondents with an invalid response to one question count for the others
+    expected = {
+        "Q20": {1: 0.1 / 0.9, 2: 0.3 / 0.9, 3: 0.5 / 0.9, 4: 0.0},
+        "Q21": {1: 0.1 / 0.7, 2: 0.4 / 0.7, 3: 0.2 / 0.7, 4: 0.0, 5: 0.0},
+    }
+    assert response_dists.keys() == expected.keys()
+    for qnum, dist in expected.items():
+        assert list(response_dists[qnum]) == list(dist)
+        np.testing.assert_allclose(
+            list(response_dists[qnum].values()), list(dist.values())
+        )
+
+
 @pytest.fixture
 def mock_true_results() -> pd.DataFrame:
     return pd.DataFrame(
@@ -6,8 +6,13 @@ import pytest
 
 from src.analysis.results import (
     get_nth_newest_file,
+    iter_survey_results_df,
+    load_survey_results_batch,
+    load_survey_results_context,
+    load_survey_results_df_batch,
     print_results_single,
     survey_results_to_df,
+    survey_results_to_runs,
 )
 
 
@@ -32,6 +37,70 @@ def test_survey_results_to_df():
     pd.testing.assert_frame_equal(df, pd.DataFrame(expected))
 
 
+def test_survey_results_to_df_flipped_and_runs():
+    variables = pd.read_csv("test_data_files/sample_variables_grouped.csv")
+    survey_results = {
+        f"run{i}": {
+            "metadata": {"run_id": f"run{i}"},
+            "questions": {"Q1": "q", "Q1-Q2": "group"},
+            "choices": {"Q1": ["1: a", "2: b"], "Q1-Q2": ["1: a", "2: b"]},
+            "questions_flipped": {"Q1": "q flipped", "Q1-Q2": "group flipped"},
+            "choices_flipped": {"Q1": ["1: b", "2: a"], "Q1-Q2": ["1: b", "2: a"]},
+            "responses": {"Q1": ["1: a", "1: b"], "Q1-Q2": ["Q1: 1: a"]},
+            "is_scale_flipped": {"Q1": [False, True], "Q1-Q2": [True]},
+        }
+        for i in range(2)
+    }
+    df = survey_results_to_df(survey_results, variables, is_metadata_joined=False)
+    assert list(df["model"]) == ["run0"] * 3 + ["run1"] * 3
+    assert list(df["question"][:3]) == ["q", "q flipped", "group flipped"]
+    assert list(df["choices"][:3]) == [["1: a", "2: b"], ["1: b", "2: a"], ["1: b", "2: a"]]
+    assert list(df["subtopic"][:3]) == ["Family", "Family", None]
+    assert "run_id" not in df
+
+    runs = survey_results_to_runs(survey_results)
+    assert list(runs.index) == ["run0", "run1"]
+    joined = survey_results_to_df(survey_results, variables)
+    assert list(joined["run_id"]) == ["run0"] * 3 + ["run1"] * 3
+
+
+def test_load_survey_results_context():
+    context = load_survey_results_context("test_data_files/results/20250428_results.json")
+    assert list(context) == ["llama-general"]
+    assert set(context["llama-general"]) == {"metadata", "questions", "choices"}
+    assert context["llama-general"]["choices"]["Q2"] == ["1: agree", "2: disagree"]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 100])
+def test_iter_survey_results_df(chunk_size):
+    path = "test_data_files/results/20250428_results.json"
+    variables = pd.read_csv("test_data_files/sample_variables_grouped.csv")
+    chunks = list(iter_survey_results_df(path, variables, chunk_size=chunk_size))
+    assert len(chunks) == {1: 2, 3: 1, 100: 1}[chunk_size]
+    pd.testing.assert_frame_equal(
+        pd.concat(chunks, ignore_index=True),
+        survey_results_to_df(json.load(open(path)), variables),
+    )
+
+
+def test_load_survey_results_df_batch():
+    variables = pd.read_csv("test_data_files/sample_variables_grouped.csv")
+    serial = load_survey_results_df_batch(
+        "results", "test_data_files", variables, n_workers=1
+    )
+    parallel = load_survey_results_df_batch(
+        "results", "test_data_files", variables, n_workers=2
+    )
+    pd.testing.assert_frame_equal(serial, parallel)
+    assert list(serial["run_id"].unique()) == ["20250428", "20250429"]
+
+    results = load_survey_results_batch("results", "test_data_files", n_workers=2)
+    assert [next(iter(r.values()))["metadata"]["run_id"] for r in results] == [
+        "20250428",
+        "20250429",
+    ]
+
+
 @pytest.mark.parametrize(
     "idx, expected", [(0, "20250429_results.json"), (1, "20250428_results.json")]
 )
@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+from src.analysis.schema import apply_results_schema, report_memory_usage
+
+
+def test_apply_results_schema():
+    df = pd.DataFrame(
+        {
+            "number": ["Q1", "Q1", "Q2"],
+            "choices": [["1: a", "2: b"], np.array(["1: a", "2: b"]), "['1: a']"],
+            "response": ["1: a", "2: b", "1: a"],
+            "response_key": [1.0, np.nan, 2.0],
+            "final_response": pd.array([1, -1, 2], dtype="Int64"),
+        }
+    )
+    typed = apply_results_schema(df)
+
+    assert isinstance(typed["number"].dtype, pd.CategoricalDtype)
+    assert list(typed["choices"]) == ["['1: a', '2: b']"] * 2 + ["['1: a']"]
+    assert typed["response"].dtype == object
+    assert typed["response_key"].dtype == "Int16"
+    assert typed["response_key"].isna().tolist() == [False, True, False]
+    assert typed["final_response"].dtype == "Int16"
+    pd.testing.assert_frame_equal(apply_results_schema(typed), typed)
+    assert report_memory_usage(typed, "test") < report_memory_usage(df, "test")
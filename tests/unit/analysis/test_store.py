@@ -0,0 +1,65 @@
+import pandas as pd
+
+from src.analysis.store import (
+    get_results_schema,
+    get_store_path,
+    load_results,
+    read_results_store,
+    write_results_store,
+    write_results_store_chunks,
+)
+
+
+def get_results_df() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "model": ["phi-general", "llama-general", "phi-general", "llama-general"],
+            "number": ["Q1", "Q1", "Q2", "Q2"],
+            "question": ["Q1: prompt", "Q1: prompt", "Q2: prompt", "Q2: prompt"],
+            "response": ["1: agree", "2: disagree", "1: agree", None],
+            "is_scale_flipped": [False, True, False, True],
+            "subgroup": [None, None, "men", "men"],
+        },
+        index=[3, 1, 2, 0],
+    )
+
+
+def test_write_and_read_results_store(tmp_path):
+    df = get_results_df()
+    path = get_store_path(str(tmp_path), "unit_test", "results")
+    write_results_store(df, path)
+    write_results_store(df, path)  # overwrites
+
+    pd.testing.assert_frame_equal(read_results_store(path), df.sort_index())
+
+    projected = read_results_store(path, columns=["number", "response"])
+    assert list(projected.columns) == ["number", "response"]
+    assert list(projected.index) == [0, 1, 2, 3]
+
+    filtered = read_results_store(path, filters=[("model", "=", "phi-general")])
+    assert list(filtered["number"]) == ["Q2", "Q1"]
+
+
+def test_load_results_csv_fallback(tmp_path):
+    df = get_results_df()
+    df.to_csv(tmp_path / "unit_test-clean.csv")
+    loaded = load_results(str(tmp_path), "unit_test", "clean", ["number", "unknown"])
+    assert list(loaded.columns) == ["number"]
+    assert list(loaded["number"]) == list(df["number"])
+
+
+def test_write_results_store_chunks(tmp_path):
+    df = get_results_df().reset_index(drop=True)
+    df["subtopic"] = [None, None, "Friends", "Friends"]
+    df["group"], df["choices"] = "Important in life", [["1: agree"]] * 4
+    runs = pd.DataFrame({"subgroup": [None, "men"]}, index=["phi", "llama"])
+    chunks = [df.iloc[:2].drop(columns="subgroup"), df.iloc[2:]]
+
+    path = get_store_path(str(tmp_path), "unit_test", "results")
+    n_rows = write_results_store_chunks(chunks, path, get_results_schema(runs))
+
+    assert n_rows == 4
+    stored = read_results_store(path)
+    assert list(stored["number"]) == ["Q1", "Q1", "Q2", "Q2"]
+    assert list(stored["subtopic"]) == [None, None, "Friends", "Friends"]
+    assert list(stored["subgroup"]) == [None, None, "men", "men"]
@@ -0,0 +1,142 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.analysis.tensors import (
+    MISSING_CODE,
+    DistributionCache,
+    decode_data_dict,
+    encode_data_dict,
+    encode_responses,
+    get_distributions,
+    get_histograms,
+    histograms_to_distributions,
+    resample_histograms,
+)
+
+
+def test_encode_responses(responses, response_maps):
+    tensor = encode_responses(responses, response_maps)
+
+    assert tensor.qnums == ["Q1", "Q2"]
+    np.testing.assert_array_equal(tensor.support_sizes, [2, 3])
+    np.testing.assert_array_equal(tensor.n_bins, [3, 5])
+    # keys outside the response map follow the support
+    np.testing.assert_array_equal(
+        tensor.keys, [[1, 2, -1, np.nan, np.nan], [1, 2, 3, -2, 7]]
+    )
+    np.testing.assert_array_equal(
+        tensor.codes,
+        [[0, 2], [1, 0], [2, MISSING_CODE], [0, 4], [MISSING_CODE, 3]],
+    )
+    assert tensor.codes.dtype == np.int8
+    np.testing.assert_array_equal(tensor.weights, [1.0, 0.5, 2.0, 1.0, 1.5])
+
+
+def test_response_tensor_round_trip(responses, response_maps):
+    tensor = encode_responses(responses, response_maps)
+    pd.testing.assert_frame_equal(
+        tensor.to_frame(), responses[["Q1", "Q2", "weight"]].astype(float)
+    )
+    selected = tensor.select(["Q2"])
+    np.testing.assert_array_equal(selected.codes[:, 0], tensor.codes[:, 1])
+    pd.testing.assert_frame_equal(
+        selected.to_frame(), responses[["Q2", "weight"]].astype(float)
+    )
+
+
+def test_data_dict_round_trip(responses, response_maps):
+    model = responses[["Q1", "Q2"]]
+    tensors = encode_data_dict(
+        {"men": {"true": responses, "base": model}}, response_maps
+    )
+    assert tensors["men"]["base"].weights is None
+    decoded = decode_data_dict(tensors)
+    pd.testing.assert_frame_equal(decoded["men"]["base"], model.astype(float))
+
+
+def test_get_histograms(responses, response_maps):
+    tensor = encode_responses(responses, response_maps)
+    np.testing.assert_array_equal(
+        get_histograms(tensor, is_weighted=False), [[2, 1, 1, 0, 0], [1, 0, 1, 1, 1]]
+    )
+    np.testing.assert_allclose(
+        get_histograms(tensor), [[2, 0.5, 2, 0, 0], [0.5, 0, 1, 1.5, 1]]
+    )
+
+
+def test_get_distributions(responses, response_maps):
+    tensor = encode_responses(responses, response_maps)
+    np.testing.assert_allclose(
+        get_distributions(tensor, is_normalize=False, is_weighted=False),
+        [[2, 1, 0], [1, 0, 1]],
+    )
+    # the key 7 outside the support counts towards the total of Q2
+    np.testing.assert_allclose(
+        get_distributions(tensor, is_weighted=False),
+        [[2 / 3, 1 / 3, 0], [1 / 3, 0, 1 / 3]],
+    )
+    np.testing.assert_allclose(
+        get_distributions(tensor), [[0.8, 0.2, 0], [0.5 / 2.5, 0, 1 / 2.5]]
+    )
+    # only invalid responses
+    tensor.codes[:, 0] = 2
+    np.testing.assert_allclose(get_distributions(tensor)[0], [0, 0, 0])
+
+
+def test_distribution_cache(responses, response_maps):
+    cache = DistributionCache()
+    key = ("subgroup", "USA", "true")
+    tensor, dists = cache.get_distributions(key, responses, response_maps)
+    np.testing.assert_allclose(dists, [[0.8, 0.2, 0], [0.5 / 2.5, 0, 1 / 2.5]])
+    # computed once per key and flags, the responses of a cached key are not read again
+    assert cache.get_distributions(key, None, response_maps)[1] is dists
+    assert cache.get_tensor(key, None, response_maps) is tensor
+    _, unweighted = cache.get_distributions(
+        key, None, response_maps, is_weighted=False
+    )
+    np.testing.assert_allclose(unweighted, [[2 / 3, 1 / 3, 0], [1 / 3, 0, 1 / 3]])
+    assert len(cache.tensors) == 1 and len(cache.distributions) == 2
+
+
+def test_resample_histograms(responses, response_maps):
+    tensor = encode_responses(responses, response_maps)
+    rng = np.random.default_rng(0)
+    replicates = resample_histograms(tensor, 2000, rng, is_weighted=False)
+    assert replicates.shape == (2000, *tensor.keys.shape)
+    # draws of all 5 respondents, of which some did not respond
+    assert (replicates.sum(axis=2) <= 5).all()
+    np.testing.assert_allclose(
+        replicates.mean(axis=0), get_histograms(tensor, False), atol=0.1
+    )
+    dists = histograms_to_distributions(replicates, tensor)
+    assert dists.shape == (2000, 2, 3)
+    np.testing.assert_allclose(
+        dists.mean(axis=0), get_distributions(tensor, is_weighted=False), atol=0.05
+    )
+
+    # the draws of weighted responses have the effective sample size of the weights
+    weighted = resample_histograms(tensor, 10, rng)
+    n_effective = round(6**2 / (responses["weight"] ** 2).sum())
+    assert (weighted.sum(axis=2) <= n_effective).all()
+
+
+@pytest.fixture
+def response_maps():
+    return {
+        "Q1": {1: "agree", 2: "disagree"},
+        "Q2": {1: "a", 2: "b", 3: "c"},
+        "Q3": {1: "yes", 2: "no"},
+    }
+
+
+@pytest.fixture
+def responses() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "Q1": [1, 2, -1, 1, np.nan],
+            "Q2": [3, 1, np.nan, 7, -2],
+            "Q4": [1, 1, 1, 1, 1],
+            "weight": [1.0, 0.5, 2.0, 1.0, 1.5],
+        }
+    )
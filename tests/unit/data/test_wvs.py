@@ -0,0 +1,41 @@
+import os
+
+import pandas as pd
+
+from src.data.wvs import WVS_FILE, get_wvs_cache_path, load_wvs
+
+
+def write_wvs(directory: str, q1: list[int]):
+    os.makedirs(os.path.join(directory, "WV7"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "variables"), exist_ok=True)
+    pd.DataFrame({"number": ["Q1", "Q2"]}).to_csv(
+        os.path.join(directory, "variables", "variables.csv")
+    )
+    pd.DataFrame(
+        {
+            "version": ["v6"] * 3,
+            "B_COUNTRY_ALPHA": ["DEU", "USA", "DEU"],
+            "Q1": q1,
+            "Q2": [4, 3, -2],
+            "Q3": [1, 1, 1],
+            "Q260": [1, 2, 1],
+            "W_WEIGHT": [0.5, 1.0, 1.5],
+        }
+    ).to_csv(os.path.join(directory, WVS_FILE), index=False)
+
+
+def test_load_wvs(tmp_path):
+    directory = str(tmp_path)
+    write_wvs(directory, [1, 2, -1])
+    df = load_wvs(directory)
+
+    assert set(df.columns) == {"B_COUNTRY_ALPHA", "Q1", "Q2", "Q260", "W_WEIGHT"}
+    assert df["Q1"].dtype == "int8"
+    assert df["B_COUNTRY_ALPHA"].dtype == "category"
+    assert os.path.exists(get_wvs_cache_path(directory))
+    pd.testing.assert_frame_equal(load_wvs(directory), df)
+    assert list(load_wvs(directory, columns=["Q1"]).columns) == ["Q1"]
+
+    # cache is rebuilt when the source changes
+    write_wvs(directory, [3, 3, 3])
+    assert list(load_wvs(directory)["Q1"]) == [3, 3, 3]
@@ -10,7 +10,7 @@ from src.prompting.messages import (
     extract_user_prompts_from_survey_grouped,
     build_user_prompt_message_individual,
     extract_user_prompts_from_survey_individual,
-    format_messages, Survey)
+    format_messages, Survey, extract_grouped_qnums, get_common_item_stem)
 from src.simulation.models import ModelConfig
 
 
@@ -105,6 +105,31 @@ def test_format_messages():
     ]
 
 
+def test_extract_grouped_qnums(expected_messages_grouped, expected_messages_individual):
+    assert extract_grouped_qnums(expected_messages_grouped["Q1-Q6"][0]) == [
+        f"Q{i}" for i in range(1, 7)
+    ]
+    assert extract_grouped_qnums(expected_messages_grouped["Q22-Q26"][0]) == [
+        "Q22",
+        "Q23",
+        "Q25",
+        "Q26",
+    ]
+    assert extract_grouped_qnums(expected_messages_individual[False]["Q1"][0]) == []
+
+
+@pytest.mark.parametrize(
+    "item_stems, expected",
+    [
+        (["How important? – Family", "How important? – Friends"], "How important?"),
+        (["Confidence in: The Press", "Confidence in: The Police"], "Confidence in"),
+        (["Do you agree? - One", "Do you agree? - One"], "Do you agree? - One"),
+    ],
+)
+def test_get_common_item_stem(item_stems, expected):
+    assert get_common_item_stem(item_stems) == expected
+
+
 def load_page(num: int, directory: str = "test_data_files/pages"):
     with open(os.path.join(directory, f"page{num}.pkl"), "rb") as f:
         return pickle.load(f)
@@ -136,6 +161,8 @@ The possible responses are:
 3: Not very important
 4: Not at all important
 
+Answer each aspect on a separate line, starting with its number, e.g. 'Q1: 1: Very important'
+
 Your response:
 """
     r22_26 = ["1: Mentioned", "2: Not mentioned"]
@@ -154,6 +181,8 @@ The possible responses are:
 1: Mentioned
 2: Not mentioned
 
+Answer each aspect on a separate line, starting with its number, e.g. 'Q22: 1: Mentioned'
+
 Your response:
 """
     r27 = [
@@ -176,6 +205,8 @@ The possible responses are:
 3: Disagree
 4: Strongly disagree
 
+Answer each aspect on a separate line, starting with its number, e.g. 'Q27: 1: Agree strongly'
+
 Your response:
 """
     return {"Q1-Q6": (q1_q6, r1_6), "Q22-Q26": (q22_q26, r22_26), "Q27": (q27, r27)}
@@ -1,7 +1,9 @@
+import re
+
 import pytest
 
 from src.simulation.models import ModelConfig
-from src.simulation.decoders import UnconstrainedDecoder
+from src.simulation.decoders import UnconstrainedDecoder, ConstrainedDecoder
 
 
 class TestUnconstrainedDecoder:
@@ -26,3 +28,36 @@ class TestUnconstrainedDecoder:
 
         for i, batch in enumerate(self.decoder._get_batches(messages_batched)):
             assert batch == expected[i]
+
+
+class TestGroupedDecoding:
+    config = ModelConfig(batch_size=2, hyperparams={"max_new_tokens": 10})
+    grouped_prompt = """
+For each of the following aspects, indicate how important it is in your life.
+
+The aspects are:
+Q1: Family
+Q2: Friends
+Q3: Leisure time
+
+The possible responses are:
+1: Very important
+2: Not important
+
+Your response:
+"""
+
+    @pytest.mark.parametrize(
+        "prompt, expected", [(grouped_prompt, 30), ("\nQ1: Family\n\nYour response:", 10)]
+    )
+    def test_get_hyperparams_scales_max_new_tokens(self, prompt, expected):
+        decoder = UnconstrainedDecoder("dummy_model", "dummy_tokenizer", self.config)
+        assert decoder._get_hyperparams(prompt)["max_new_tokens"] == expected
+        assert self.config.hyperparams["max_new_tokens"] == 10
+
+    def test_prepare_grouped_choices(self):
+        pattern = ConstrainedDecoder._prepare_grouped_choices(
+            ["Q1", "Q2"], ["1: Very important", "2: Not important"]
+        )
+        assert re.fullmatch(pattern, "Q1: 1: Very important\nQ2: 2: Not important")
+        assert not re.fullmatch(pattern, "Q1: 1: Very important")
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from src.simulation.models import ModelConfig
+from src.simulation.planning import (
+    count_generate_calls_per_question,
+    get_best_batch_size,
+    plan_experiment,
+    ExperimentPlan,
+)
+
+
+class MockTokenizer:
+
+    def apply_chat_template(self, messages, tokenize, add_generation_prompt):
+        return " ".join(m["content"] for m in messages).split()
+
+
+@pytest.mark.parametrize(
+    "decoding_style, sample_size, batch_size, expected",
+    [
+        ("unconstrained", 500, 100, 5),
+        ("unconstrained", 11, 4, 3),
+        ("constrained", 500, 100, 6),
+        ("constrained", 10, 50, 2),
+    ],
+)
+def test_count_generate_calls_per_question(
+    decoding_style, sample_size, batch_size, expected
+):
+    config = ModelConfig(
+        decoding_style=decoding_style, sample_size=sample_size, batch_size=batch_size
+    )
+    assert count_generate_calls_per_question(config) == expected
+
+
+def test_plan_experiment_without_benchmark():
+    config = ModelConfig(
+        base_model_name="llama",
+        sample_size=10,
+        batch_size=4,
+        system_prompt="system",
+        hyperparams={"max_new_tokens": 5},
+    )
+    survey = {"Q1": ("one two", ["1: a"]), "Q2": ("one two three", ["1: a"])}
+    flipped = {"Q1": ("one two three four", ["1: a"]), "Q2": ("one", ["1: a"])}
+    plan = plan_experiment(MockTokenizer(), config, survey, flipped, n_runs=3)
+
+    assert plan.n_questions == 2
+    assert plan.sequences_per_run == 20
+    assert plan.generate_calls_per_run == 6
+    # prompt tokens include the system prompt
+    assert plan.prompt_tokens_per_run == 5 * (3 + 5) + 5 * (4 + 2)
+    assert plan.padded_prompt_tokens_per_run == 10 * 5 + 10 * 4
+    assert plan.max_generated_tokens_per_run == 100
+    assert np.isnan(plan.estimate_runtime())
+
+
+def test_estimate_runtime_and_best_batch_size():
+    throughput = {8: 10.0, 16: 20.0, 32: np.nan}
+    plan = ExperimentPlan(
+        n_runs=2,
+        n_questions=1,
+        sequences_per_run=100,
+        generate_calls_per_run=10,
+        prompt_tokens_per_run=0,
+        padded_prompt_tokens_per_run=0,
+        max_generated_tokens_per_run=0,
+        throughput=throughput,
+        batch_size=8,
+        best_batch_size=get_best_batch_size(throughput),
+    )
+    assert plan.best_batch_size == 16
+    assert plan.estimate_runtime() == 20
+    assert plan.estimate_runtime(16) == 10
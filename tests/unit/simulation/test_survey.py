@@ -1,6 +1,18 @@
+import json
+import os
+import shutil
+
 import pandas as pd
+import pytest
 
-from src.simulation.survey import filter_survey_subset
+from src.simulation.experiment import Experiment
+from src.simulation.survey import (
+    compile_survey,
+    filter_survey_subset,
+    get_compiled_survey_path,
+    load_response_maps,
+    load_survey,
+)
 
 
 def test_filter_survey_subset():
@@ -11,3 +23,76 @@ def test_filter_survey_subset():
     pd.testing.assert_series_equal(
         survey_subset["number"], pd.Series(expected_qnums, name="number")
     )
+
+
+@pytest.fixture
+def experiment(tmp_path):
+    os.makedirs(tmp_path / "variables")
+    shutil.copy(
+        "test_data_files/sample_variables_split.csv",
+        tmp_path / "variables" / "variables.csv",
+    )
+    with open(tmp_path / "variables" / "subset.json", "w") as f:
+        json.dump({"groups": ["Important in life"], "individual_questions": []}, f)
+    return Experiment(
+        setup={"name": "unit_test"},
+        files={
+            "directory": str(tmp_path),
+            "variables": "variables.csv",
+            "subset": "subset.json",
+        },
+        simulation={},
+    )
+
+
+def test_load_survey_compiles_once(experiment, monkeypatch):
+    survey = load_survey(experiment, "individual", False)
+    flipped = load_survey(experiment, "individual", True)
+    assert list(survey) == ["Q1", "Q2", "Q3", "Q4", "Q5", "Q6"]
+    assert survey["Q1"][1][0] == "1: Very important"
+    assert flipped["Q1"][1][-1] == "4: Very important"
+    assert os.path.exists(get_compiled_survey_path(experiment, "individual"))
+
+    def fail(*args):
+        raise AssertionError("survey compiled again")
+
+    monkeypatch.setattr("src.simulation.survey.compile_survey", fail)
+    assert load_survey(experiment, "individual", False) == survey
+
+
+def test_load_survey_recompiles_when_subset_changes(experiment):
+    load_survey(experiment, "grouped", False)
+    subset_path = os.path.join(experiment.files["directory"], "variables", "subset.json")
+    with open(subset_path, "w") as f:
+        json.dump({"individual_questions": ["Q1"]}, f)
+    assert list(load_survey(experiment, "grouped", False)) == ["Q1"]
+
+
+def test_load_response_maps(experiment):
+    response_maps = load_response_maps(experiment, is_reverse=True)
+    assert response_maps["Q1"][1] == "Not at all important"
+
+
+def test_interrupted_compile_keeps_artefact(experiment, monkeypatch):
+    survey = load_survey(experiment, "individual", False)
+    subset_path = os.path.join(experiment.files["directory"], "variables", "subset.json")
+    with open(subset_path, "w") as f:
+        json.dump({"individual_questions": ["Q1"]}, f)
+
+    def interrupt(*args):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr("src.simulation.survey.json.dump", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        load_survey(experiment, "individual", False)
+    monkeypatch.undo()
+
+    path = get_compiled_survey_path(experiment, "individual")
+    with open(path) as f:
+        assert json.load(f)["survey"] == json.loads(json.dumps(survey))
+    assert os.listdir(os.path.dirname(path)) == [os.path.basename(path)]
+
+
+def test_compile_survey_invalid_format(experiment):
+    with pytest.raises(ValueError):
+        compile_survey(experiment, "unknown")
@@ -0,0 +1,44 @@
+import pytest
+
+from src.simulation.decoders import DecoderCache, UnconstrainedDecoder
+from src.simulation.models import ModelConfig
+from src.simulation.sweep import expand_grid
+
+
+def test_expand_grid():
+    points = expand_grid({"temperature": [0.6, 0.9], "top_p": [1.0], "do_sample": True})
+    assert points == {
+        "temperature-0.6_top_p-1.0_do_sample-True": {
+            "temperature": 0.6,
+            "top_p": 1.0,
+            "do_sample": True,
+        },
+        "temperature-0.9_top_p-1.0_do_sample-True": {
+            "temperature": 0.9,
+            "top_p": 1.0,
+            "do_sample": True,
+        },
+    }
+
+
+def test_expand_grid_empty():
+    with pytest.raises(ValueError):
+        expand_grid({})
+
+
+class CountingTokenizer:
+    n_calls = 0
+
+    def apply_chat_template(self, messages, tokenize, add_generation_prompt):
+        self.n_calls += 1
+        return [len(m["content"]) for m in messages]
+
+
+def test_encodings_shared_across_decoders():
+    tokenizer, cache = CountingTokenizer(), DecoderCache()
+    messages = [{"role": "system", "content": "ab"}, {"role": "user", "content": "c"}]
+    for temperature in [0.6, 0.9]:
+        config = ModelConfig(hyperparams={"temperature": temperature})
+        decoder = UnconstrainedDecoder("dummy_model", tokenizer, config, cache)
+        assert decoder._encode(messages) == [2, 1]
+    assert tokenizer.n_calls == 1